@@ -1,12 +1,36 @@
-from typing import List, Optional
+import asyncio
+import json
+import os
+import secrets
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, List, Optional
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
-from rag.retriever import recommend as recommend_fn
+from rag.instrumentation import METRICS, Trace, debug_timings, tracing
+from rag.retriever import RecommenderEngine, set_engine
 
 
-app = FastAPI(title="SHL Assessment Recommendation API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One engine per worker: the vector store and HTTP pools live for the process
+    engine = RecommenderEngine()
+    app.state.engine = engine
+    set_engine(engine)
+    try:
+        yield
+    finally:
+        set_engine(None)
+        await engine.aclose()
+
+
+app = FastAPI(title="SHL Assessment Recommendation API", lifespan=lifespan)
+
+# Upper bound on queries per POST /recommend/batch request
+MAX_BATCH_SIZE = 500
 
 
 class HealthResponse(BaseModel):
@@ -15,6 +39,9 @@ class HealthResponse(BaseModel):
 
 class RecommendRequest(BaseModel):
     query: str = Field(..., description="Job description or natural language hiring query")
+    debug_timings: bool = Field(
+        False, description="Add per-stage timings, spans, call and token counts to the response"
+    )
 
 
 class RecommendedAssessment(BaseModel):
@@ -29,6 +56,41 @@ class RecommendedAssessment(BaseModel):
 
 class RecommendResponse(BaseModel):
     recommended_assessments: List[RecommendedAssessment]
+    debug_timings: Optional[Dict] = None
+
+
+class BatchRecommendRequest(BaseModel):
+    queries: List[str] = Field(
+        ...,
+        min_length=1,
+        max_length=MAX_BATCH_SIZE,
+        description="Job descriptions or natural language hiring queries",
+    )
+
+
+class BatchRecommendItem(BaseModel):
+    query: str
+    recommended_assessments: Optional[List[RecommendedAssessment]] = None
+    error: Optional[str] = None
+
+
+class BatchRecommendResponse(BaseModel):
+    results: List[BatchRecommendItem]
+
+
+@contextmanager
+def _observed(endpoint: str) -> Iterator[Trace]:
+    """Trace the request and record it in the process-wide metrics when it ends."""
+    start = time.perf_counter()
+    status = "ok"
+    with tracing() as trace:
+        try:
+            yield trace
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            METRICS.observe_request(endpoint, time.perf_counter() - start, trace, status)
 
 
 @app.get("/health", response_model=HealthResponse)
@@ -43,8 +105,20 @@ async def health_check() -> HealthResponse:
     return HealthResponse(status="healthy")
 
 
-@app.post("/recommend", response_model=RecommendResponse)
-async def recommend(payload: RecommendRequest) -> RecommendResponse:
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request) -> PlainTextResponse:
+    """
+    Prometheus scrape endpoint: request and per-stage latency histograms,
+    external call and token counters, and cache hit ratios.
+    """
+    return PlainTextResponse(
+        METRICS.render(request.app.state.engine.cache_stats()),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+@app.post("/recommend", response_model=RecommendResponse, response_model_exclude_unset=True)
+async def recommend(payload: RecommendRequest, request: Request) -> RecommendResponse:
     """
     Assessment Recommendation Endpoint
 
@@ -67,11 +141,125 @@ async def recommend(payload: RecommendRequest) -> RecommendResponse:
         }
       ]
     }
+
+    With `"debug_timings": true` in the request the response also carries a
+    `debug_timings` block (total and per-stage ms, spans, calls, tokens).
     """
-    raw = recommend_fn(payload.query)
+    with _observed("recommend") as trace:
+        raw = await request.app.state.engine.arecommend(payload.query)
+    if payload.debug_timings:
+        return RecommendResponse(**raw, debug_timings=debug_timings(trace))
     return RecommendResponse(**raw)
 
 
+async def _stream_events(engine, query: str, sse: bool, debug: bool = False) -> AsyncIterator[str]:
+    # The failure passes through `_observed` first, so /metrics counts it as an error
+    try:
+        with _observed("recommend_stream") as trace:
+            async for event in engine.astream_recommend(query):
+                if event.get("recommended_assessments") is not None:
+                    # Validate against the same schema as POST /recommend
+                    event = {
+                        "stage": event["stage"],
+                        **RecommendResponse(**event).model_dump(exclude_unset=True),
+                    }
+                    if debug and event["stage"] == "final":
+                        event["debug_timings"] = debug_timings(trace)
+                yield _format_event(event, sse)
+    except Exception as exc:
+        yield _format_event({"stage": "error", "error": f"{type(exc).__name__}: {exc}"}, sse)
+
+
+def _format_event(event: dict, sse: bool) -> str:
+    data = json.dumps(event)
+    if sse:
+        return f"event: {event['stage']}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+@app.post("/recommend/stream")
+async def recommend_stream(
+    payload: RecommendRequest,
+    request: Request,
+    accept: Optional[str] = Header(default=None),
+) -> StreamingResponse:
+    """
+    Streaming Assessment Recommendation Endpoint
+
+    Emits one event per pipeline stage as soon as it completes:
+    - "candidates": the balanced selection in provisional (retrieval) order
+    - "final": the LLM re-ranked list (the same body as POST /recommend)
+    - "error": if the pipeline fails part-way
+
+    Responds with NDJSON (one JSON object per line) by default, or with
+    Server-Sent Events when the request sends `Accept: text/event-stream`.
+    Each event looks like:
+    {"stage": "candidates", "recommended_assessments": [...]}
+
+    With `"debug_timings": true` the "final" event carries `debug_timings`.
+    """
+    sse = bool(accept and "text/event-stream" in accept)
+    return StreamingResponse(
+        _stream_events(request.app.state.engine, payload.query, sse, payload.debug_timings),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+    )
+
+
+@app.post("/recommend/batch", response_model=BatchRecommendResponse)
+async def recommend_batch(payload: BatchRecommendRequest, request: Request) -> BatchRecommendResponse:
+    """
+    Batch Assessment Recommendation Endpoint
+
+    Request:
+    {
+      "queries": ["JD/query 1", "JD/query 2", ...]
+    }
+
+    Response (same order as the request; a failed item carries `error`
+    instead of `recommended_assessments`):
+    {
+      "results": [
+        {"query": "JD/query 1", "recommended_assessments": [...]},
+        {"query": "JD/query 2", "error": "reason"}
+      ]
+    }
+    """
+    with _observed("recommend_batch"):
+        raw = await request.app.state.engine.arecommend_many(payload.queries)
+    return BatchRecommendResponse(
+        results=[
+            BatchRecommendItem(query=query, **item)
+            for query, item in zip(payload.queries, raw)
+        ]
+    )
+
+
+@app.post("/reload", response_model=HealthResponse)
+async def reload_index(
+    request: Request,
+    x_admin_token: Optional[str] = Header(default=None),
+) -> HealthResponse:
+    """
+    Re-open the persisted vector store in the worker serving this request.
+
+    Workers already pick up a rebuilt index by themselves: every request
+    compares the index version file rag/embeddings.py rewrites after each
+    build, and a worker that sees a new version reloads before answering.
+    This endpoint forces the reload in one worker anyway, e.g. after the
+    files were replaced without a build.
+
+    Disabled unless ADMIN_TOKEN is set; the request must carry a matching
+    `X-Admin-Token` header.
+    """
+    expected = os.getenv("ADMIN_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=403, detail="Reload is disabled (ADMIN_TOKEN is not set)")
+    if not secrets.compare_digest(x_admin_token or "", expected):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    await asyncio.to_thread(request.app.state.engine.reload)
+    return HealthResponse(status="reloaded")
+
+
 # For local testing:
 #   uvicorn api:app --reload
 
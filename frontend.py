@@ -5,7 +5,8 @@ A Streamlit web application for testing the recommendation system.
 
 import streamlit as st
 import requests
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterator, Optional
+import json
 import time
 import os
 from dotenv import load_dotenv
@@ -102,13 +103,25 @@ USE_API = st.sidebar.checkbox(
     help="If checked, uses the FastAPI endpoint. Otherwise, calls retriever directly."
 )
 
+STREAM_RESULTS = st.sidebar.checkbox(
+    "Stream results",
+    value=True,
+    help="Show retrieval results as soon as they are ready, then replace them with the re-ranked list."
+)
+
+SHOW_TIMINGS = st.sidebar.checkbox(
+    "Show debug timings",
+    value=False,
+    help="Ask for a per-stage timing breakdown (intent, embedding, search, balancing, scoring)."
+)
+
 
 def call_api_recommend(query: str) -> Optional[Dict]:
     """Call the FastAPI recommendation endpoint."""
     try:
         response = requests.post(
             f"{API_BASE_URL}/recommend",
-            json={"query": query},
+            json={"query": query, "debug_timings": SHOW_TIMINGS},
             timeout=30
         )
         response.raise_for_status()
@@ -121,13 +134,49 @@ def call_api_recommend(query: str) -> Optional[Dict]:
 def call_direct_recommend(query: str) -> Optional[Dict]:
     """Call the retriever function directly."""
     try:
+        from rag.instrumentation import debug_timings, tracing
         from rag.retriever import recommend
-        return recommend(query)
+        with tracing() as trace:
+            result = recommend(query)
+        if SHOW_TIMINGS:
+            result = {**result, "debug_timings": debug_timings(trace)}
+        return result
     except Exception as e:
         st.error(f"Error: {str(e)}")
         return None
 
 
+def stream_api_recommend(query: str) -> Iterator[Dict]:
+    """Yield staged results from the streaming FastAPI endpoint (NDJSON)."""
+    try:
+        with requests.post(
+            f"{API_BASE_URL}/recommend/stream",
+            json={"query": query, "debug_timings": SHOW_TIMINGS},
+            stream=True,
+            timeout=30
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+    except requests.exceptions.RequestException as e:
+        yield {"stage": "error", "error": f"API Error: {str(e)}"}
+
+
+def stream_direct_recommend(query: str) -> Iterator[Dict]:
+    """Yield staged results from the retriever directly."""
+    try:
+        from rag.instrumentation import debug_timings, tracing
+        from rag.retriever import stream_recommend
+        with tracing() as trace:
+            for event in stream_recommend(query):
+                if SHOW_TIMINGS and event.get("stage") == "final":
+                    event = {**event, "debug_timings": debug_timings(trace)}
+                yield event
+    except Exception as e:
+        yield {"stage": "error", "error": f"Error: {str(e)}"}
+
+
 def format_duration(duration: Optional[int]) -> str:
     """Format duration in minutes."""
     if duration is None:
@@ -135,6 +184,20 @@ def format_duration(duration: Optional[int]) -> str:
     return f"{duration} min"
 
 
+def render_debug_timings(timings: Dict):
+    """Per-stage breakdown of one request, from the `debug_timings` response block."""
+    with st.expander(f"⏱️ Debug timings ({timings.get('total_ms', 0):.0f} ms total)"):
+        stages = timings.get("stages_ms", {})
+        if stages:
+            st.bar_chart({"ms": stages})
+        spans = timings.get("spans", [])
+        if spans:
+            st.markdown("**Spans** (start offset within the request)")
+            st.dataframe(spans, use_container_width=True, hide_index=True)
+        st.markdown(f"**Calls**: {timings.get('calls', {})}")
+        st.markdown(f"**Tokens**: {timings.get('tokens', {})}")
+
+
 def render_assessment_card(assessment: Dict, index: int):
     """Render a single assessment card using clean Streamlit components (no raw HTML dump)."""
     name = assessment.get("name", "Unknown Assessment")
@@ -237,7 +300,28 @@ def main():
                 start_time = time.time()
                 
                 # Call recommendation function
-                if USE_API:
+                if STREAM_RESULTS:
+                    result = None
+                    placeholder = st.empty()
+                    events = stream_api_recommend(query) if USE_API else stream_direct_recommend(query)
+                    for event in events:
+                        stage = event.get("stage")
+                        if stage == "candidates":
+                            # Show the retrieval-stage list right away while re-ranking runs
+                            with placeholder.container():
+                                st.info(
+                                    f"⏳ Preliminary results after {time.time() - start_time:.2f}s "
+                                    "(re-ranking in progress...)"
+                                )
+                                for idx, assessment in enumerate(event.get("recommended_assessments", [])):
+                                    render_assessment_card(assessment, idx)
+                        elif stage == "final":
+                            placeholder.empty()
+                            result = event
+                        elif stage == "error":
+                            placeholder.empty()
+                            st.error(event.get("error", "Unknown error"))
+                elif USE_API:
                     result = call_api_recommend(query)
                 else:
                     result = call_direct_recommend(query)
@@ -257,6 +341,9 @@ def main():
                         
                         for idx, assessment in enumerate(assessments):
                             render_assessment_card(assessment, idx)
+
+                        if result.get("debug_timings"):
+                            render_debug_timings(result["debug_timings"])
                         
                         # Summary statistics
                         st.markdown("---")
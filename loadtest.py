@@ -0,0 +1,127 @@
+"""
+Concurrency load test for the SHL Assessment Recommendation API.
+
+Fires N concurrent POST /recommend requests at a running server (ideally a
+single worker: `uvicorn api:app --workers 1`) while polling GET /health, then
+reports whether the requests overlapped or were served one after another.
+
+    python loadtest.py --concurrency 8
+
+The target defaults to a local server; any other host (a staging or
+production deployment) has to be named explicitly with `--url`.
+
+Requests rotate through the distinct queries of data/train_queries.csv, and
+each one gets a unique per-run suffix by default, so the result and LLM
+caches cannot answer them and the burst measures real concurrent work.
+`--no-bust-cache` sends the plain queries instead.
+
+Overlap factor = sum(individual latencies) / wall-clock time of the burst.
+A value close to 1 means requests were serialized; a value close to the
+concurrency level means they ran in parallel on the event loop.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from typing import List
+
+import httpx
+import pandas as pd
+
+DEFAULT_URL = "http://localhost:8000"
+DEFAULT_QUERIES_CSV = "data/train_queries.csv"
+
+
+def load_queries(path: str) -> List[str]:
+    """Distinct non-empty values of the CSV's query column, in file order."""
+    df = pd.read_csv(path)
+    cols = {c.lower(): c for c in df.columns}
+    queries: List[str] = []
+    for value in df[cols["query"]].dropna():
+        query = str(value).strip()
+        if query and query not in queries:
+            queries.append(query)
+    return queries
+
+
+def burst_queries(queries: List[str], n: int, bust_cache: bool) -> List[str]:
+    """`n` queries taken round-robin, each made unique to this run if `bust_cache`."""
+    run_id = uuid.uuid4().hex[:8]
+    burst = []
+    for i in range(n):
+        query = queries[i % len(queries)]
+        burst.append(f"{query} (load test {run_id}-{i})" if bust_cache else query)
+    return burst
+
+
+async def _timed_post(client: httpx.AsyncClient, url: str, query: str) -> float:
+    start = time.perf_counter()
+    response = await client.post(f"{url}/recommend", json={"query": query})
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def _poll_health(client: httpx.AsyncClient, url: str, stop: asyncio.Event) -> List[float]:
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get(f"{url}/health")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.05)
+    return latencies
+
+
+async def run_load_test(url: str, concurrency: int, queries: List[str], bust_cache: bool = True) -> dict:
+    burst = burst_queries(queries, concurrency, bust_cache)
+    async with httpx.AsyncClient(timeout=120) as client:
+        stop = asyncio.Event()
+        health_task = asyncio.create_task(_poll_health(client, url, stop))
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(
+            *(_timed_post(client, url, query) for query in burst)
+        )
+        wall = time.perf_counter() - start
+
+        stop.set()
+        health = await health_task
+
+    return {
+        "concurrency": concurrency,
+        "distinct_queries": len(set(burst)),
+        "wall_seconds": wall,
+        "mean_request_seconds": statistics.mean(latencies),
+        "max_request_seconds": max(latencies),
+        "overlap_factor": sum(latencies) / wall if wall else 0.0,
+        "health_probes": len(health),
+        "health_max_seconds": max(health) if health else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default=DEFAULT_URL, help="Server to test (default: a local one)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--queries-csv", default=DEFAULT_QUERIES_CSV, help="CSV with a Query column")
+    parser.add_argument("--query", default=None, help="Send only this query instead of the CSV's")
+    parser.add_argument(
+        "--bust-cache",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Make every query unique to the run so no cache can answer it",
+    )
+    args = parser.parse_args()
+
+    queries = [args.query] if args.query else load_queries(args.queries_csv)
+    report = asyncio.run(run_load_test(args.url.rstrip("/"), args.concurrency, queries, args.bust_cache))
+    print("\n" + "=" * 60)
+    print("Load test results:")
+    print("=" * 60)
+    for key, value in report.items():
+        if isinstance(value, float):
+            print(f"{key}: {value:.3f}")
+        else:
+            print(f"{key}: {value}")
+    print("=" * 60)
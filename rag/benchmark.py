@@ -0,0 +1,386 @@
+"""
+Latency benchmarks for the SHL Assessment Recommendation System.
+
+Backend comparison (Chroma HNSW vs. in-memory NumPy scan):
+    python rag/benchmark.py backends [--queries 200] [--k 20]
+
+Probe vectors are the stored catalog embeddings plus a little Gaussian
+noise, so no embedding API calls are made. Recall parity is the overlap of
+each Chroma result with the exact NumPy result for the same probe.
+
+End-to-end pipeline suite (index build, `balanced_selection`, hybrid BM25
+search and fusion, `recommend` and API throughput), fully offline with the
+fake models:
+    MODEL_PROVIDER=fake python rag/benchmark.py pipeline [--rounds 50] [--concurrency 8]
+
+Set FAKE_EMBEDDING_LATENCY_SECONDS / FAKE_LLM_LATENCY_SECONDS to emulate
+network round trips. The suite builds its own index in a temporary
+directory and never touches vectorstore/.
+
+Reload check (a row written by another process is searchable after
+`reload_if_stale()`), also offline and in a temporary directory:
+    MODEL_PROVIDER=fake python rag/benchmark.py reload [--backend chroma]
+
+This file is NOT used by the API – it is for offline experiments only.
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import httpx
+import numpy as np
+import pandas as pd
+from langchain_chroma import Chroma
+
+import retriever
+from embeddings import build_chroma_vectorstore, export_snapshot, mark_index_updated
+from instrumentation import latency_summary
+from numpy_index import NumpyVectorStore
+from retriever import (
+    CANDIDATE_POOL_K,
+    COLLECTION_NAME,
+    FINAL_K,
+    RecommenderEngine,
+    balanced_selection,
+    build_lexical_index,
+    catalog_documents,
+    detect_query_intent,
+    hybrid_candidates,
+    infer_required_test_types,
+    load_vectorstore,
+    retrieve_by_vector,
+)
+
+QUERY_FILES = ["data/train_queries.csv", "data/unlabeled_test_queries.csv"]
+
+
+def _time_calls(fn: Callable, probes: List[List[float]]) -> List[float]:
+    """Milliseconds per call of `fn(probe)`."""
+    samples = []
+    for probe in probes:
+        start = time.perf_counter()
+        fn(probe)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def _probe_vectors(store: NumpyVectorStore, n: int, noise: float = 0.01, seed: int = 0) -> List[List[float]]:
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(store), size=n)
+    probes = store.matrix[rows] + rng.normal(0, noise, size=(n, store.matrix.shape[1])).astype(np.float32)
+    return [p.tolist() for p in probes]
+
+
+def benchmark_backends(num_queries: int = 200, k: int = 20) -> Dict[str, Dict]:
+    """Compare per-query latency and result parity of the two vector backends."""
+    chroma = load_vectorstore(backend="chroma")
+    start = time.perf_counter()
+    numpy_store = load_vectorstore(backend="numpy")
+    load_seconds = time.perf_counter() - start
+
+    probes = _probe_vectors(numpy_store, num_queries)
+    cases = {
+        "unfiltered": lambda vs: (lambda v: vs.similarity_search_by_vector(v, k=k)),
+        "filtered_is_type_K": lambda vs: (
+            lambda v: vs.similarity_search_by_vector(v, k=k, filter={"is_type_K": True})
+        ),
+        "intent_retrieval_K_P": lambda vs: (lambda v: retrieve_by_vector(vs, v, ["K", "P"], top_k=k)),
+    }
+
+    report: Dict[str, Dict] = {
+        "config": {
+            "queries": num_queries,
+            "k": k,
+            "catalog_rows": len(numpy_store),
+            "numpy_load_ms": load_seconds * 1000,
+        }
+    }
+    for name, make in cases.items():
+        chroma_fn, numpy_fn = make(chroma), make(numpy_store)
+        overlaps = []
+        for probe in probes:
+            expected = {d.metadata.get("assessment_url") for d in numpy_fn(probe)}
+            got = {d.metadata.get("assessment_url") for d in chroma_fn(probe)}
+            overlaps.append(len(expected & got) / len(expected) if expected else 1.0)
+        report[name] = {
+            "chroma": latency_summary(_time_calls(chroma_fn, probes)),
+            "numpy": latency_summary(_time_calls(numpy_fn, probes)),
+            "chroma_recall_vs_exact": statistics.mean(overlaps) if overlaps else 1.0,
+        }
+    return report
+
+
+# ================== PIPELINE SUITE ==================
+def _benchmark_queries() -> List[str]:
+    """Distinct queries from the train and test CSVs."""
+    queries: List[str] = []
+    for path in QUERY_FILES:
+        df = pd.read_csv(path)
+        col = next(c for c in df.columns if c.lower() == "query")
+        queries.extend(str(q).strip() for q in df[col] if str(q).strip())
+    return list(dict.fromkeys(queries))
+
+
+def _bench_balanced_selection(engine: RecommenderEngine, queries: List[str], rounds: int) -> Dict:
+    cases = []
+    for q in queries:
+        types = infer_required_test_types(detect_query_intent(q, engine.llm).domains)
+        docs = retrieve_by_vector(engine.vectorstore, engine.embeddings.embed_query(q), types)
+        cases.append((docs, types))
+    samples = []
+    for i in range(rounds):
+        docs, types = cases[i % len(cases)]
+        start = time.perf_counter()
+        balanced_selection(docs, types, FINAL_K)
+        samples.append((time.perf_counter() - start) * 1000)
+    return latency_summary(samples)
+
+
+def _bench_hybrid(engine: RecommenderEngine, queries: List[str], rounds: int) -> Dict[str, Dict]:
+    """BM25 search over the inverted index alone, and the full dense + BM25 + RRF pool."""
+    catalog = catalog_documents(engine.vectorstore)
+    lexical = build_lexical_index(catalog)
+    vectors = [engine.embeddings.embed_query(q) for q in queries]
+    bm25, fused = [], []
+    for i in range(rounds):
+        q, v = queries[i % len(queries)], vectors[i % len(queries)]
+        start = time.perf_counter()
+        lexical.top(q, CANDIDATE_POOL_K)
+        bm25.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        hybrid_candidates(engine.vectorstore, lexical, catalog, q, v)
+        fused.append((time.perf_counter() - start) * 1000)
+    return {"bm25_search": latency_summary(bm25), "hybrid_pool": latency_summary(fused)}
+
+
+def _bench_recommend(engine: RecommenderEngine, queries: List[str], rounds: int) -> Dict:
+    """Uncached end-to-end latency: the result cache is cleared before every call."""
+    samples = []
+    for i in range(rounds):
+        engine.cache.clear()
+        start = time.perf_counter()
+        engine.recommend(queries[i % len(queries)])
+        samples.append((time.perf_counter() - start) * 1000)
+    return latency_summary(samples)
+
+
+async def _bench_api(persist_dir: str, backend: str, queries: List[str], requests: int, concurrency: int) -> Dict:
+    """POST /recommend throughput in-process over ASGI (no sockets, no uvicorn)."""
+    sys.path.insert(0, os.getcwd())
+    import api  # the app imports `rag.retriever`, a separate module object from `retriever`
+    from rag import retriever as app_retriever
+
+    app_retriever.LLM_CACHE_PATH = None
+    app_retriever.EMBEDDING_CACHE_DIR = None
+    engine = app_retriever.RecommenderEngine(persist_dir=persist_dir, backend=backend)
+    api.app.state.engine = engine
+    sem = asyncio.Semaphore(concurrency)
+    samples: List[float] = []
+
+    async def one(client: httpx.AsyncClient, i: int) -> None:
+        # A per-request suffix keeps every request a result-cache miss
+        query = f"{queries[i % len(queries)]} (request {i})"
+        async with sem:
+            start = time.perf_counter()
+            response = await client.post("/recommend", json={"query": query})
+            response.raise_for_status()
+            samples.append((time.perf_counter() - start) * 1000)
+
+    transport = httpx.ASGITransport(app=api.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            start = time.perf_counter()
+            await asyncio.gather(*(one(client, i) for i in range(requests)))
+            wall = time.perf_counter() - start
+    finally:
+        await engine.aclose()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "requests_per_second": requests / wall if wall else 0.0,
+        **latency_summary(samples),
+    }
+
+
+def benchmark_pipeline(
+    rounds: int = 50,
+    requests: int = 100,
+    concurrency: int = 8,
+    backend: str = "chroma",
+) -> Dict[str, Dict]:
+    """
+    Time index build, `balanced_selection`, hybrid retrieval, `recommend`
+    and API throughput.
+
+    Runs against whichever models `MODEL_PROVIDER` selects; with the fake
+    provider nothing leaves the machine.
+    """
+    # Every call should exercise the model path, not the on-disk response/vector stores
+    retriever.LLM_CACHE_PATH = None
+    retriever.EMBEDDING_CACHE_DIR = None
+    queries = _benchmark_queries()
+    report: Dict[str, Dict] = {
+        "config": {
+            "provider": retriever.MODEL_PROVIDER,
+            "backend": backend,
+            "rounds": rounds,
+            "queries": len(queries),
+            "fake_embedding_latency_s": retriever.FAKE_EMBEDDING_LATENCY_SECONDS,
+            "fake_llm_latency_s": retriever.FAKE_LLM_LATENCY_SECONDS,
+        }
+    }
+
+    with tempfile.TemporaryDirectory(prefix="shl_bench_") as persist_dir:
+        start = time.perf_counter()
+        # No ingestion throttle: time the indexing work, not the configured rate limit
+        build_chroma_vectorstore(
+            persist_dir=persist_dir,
+            embeddings=retriever.make_embeddings(),
+            requests_per_second=1e9,
+        )
+        report["index_build"] = {"seconds": time.perf_counter() - start}
+
+        engine = RecommenderEngine(persist_dir=persist_dir, backend=backend)
+        try:
+            report["balanced_selection"] = _bench_balanced_selection(engine, queries, rounds * 20)
+            report.update(_bench_hybrid(engine, queries, rounds * 20))
+            report["recommend"] = _bench_recommend(engine, queries, rounds)
+        finally:
+            engine.close()
+
+        report["api_recommend"] = asyncio.run(
+            _bench_api(persist_dir, backend, queries, requests, concurrency)
+        )
+    return report
+
+
+# ================== RELOAD CHECK ==================
+RELOAD_PROBE_ID = "reload-probe"
+RELOAD_PROBE_URL = "https://example.invalid/reload-probe/"
+
+
+def _write_reload_probe(persist_dir: str, source_id: str) -> None:
+    """
+    Run in a separate process: store a copy of row `source_id` under a new
+    URL, re-export the snapshot and mark the index updated, as a rebuild by
+    rag/embeddings.py would.
+    """
+    store = Chroma(
+        collection_name=COLLECTION_NAME,
+        persist_directory=persist_dir,
+        embedding_function=retriever.make_embeddings(),
+    )
+    row = store._collection.get(ids=[source_id], include=["embeddings", "documents", "metadatas"])
+    metadata = dict(row["metadatas"][0], assessment_url=RELOAD_PROBE_URL, assessment_name="Reload probe")
+    store._collection.upsert(
+        ids=[RELOAD_PROBE_ID],
+        embeddings=row["embeddings"],
+        documents=row["documents"],
+        metadatas=[metadata],
+    )
+    export_snapshot(store, persist_dir)
+    mark_index_updated(persist_dir)
+
+
+def check_reload(backend: str = "chroma") -> Dict[str, Dict]:
+    """
+    Build an index, open an engine on it, let another process add a row,
+    and check that after `reload_if_stale()` the engine both lists the row
+    and finds it by vector search.
+    """
+    retriever.LLM_CACHE_PATH = None
+    retriever.EMBEDDING_CACHE_DIR = None
+    with tempfile.TemporaryDirectory(prefix="shl_reload_") as persist_dir:
+        build_chroma_vectorstore(
+            persist_dir=persist_dir,
+            embeddings=retriever.make_embeddings(),
+            requests_per_second=1e9,
+        )
+        engine = RecommenderEngine(persist_dir=persist_dir, backend=backend)
+        try:
+            rows_before = len(engine.catalog)
+            source = engine.catalog[0]
+            # The probe row is a copy of `source`, so this vector ranks it in the top 2
+            probe_vector = engine.embeddings.embed_query(source.page_content)
+
+            # spawn: a fresh interpreter, with no chromadb state shared with this one
+            writer = multiprocessing.get_context("spawn").Process(
+                target=_write_reload_probe, args=(persist_dir, source.id)
+            )
+            writer.start()
+            writer.join()
+            if writer.exitcode != 0:
+                raise RuntimeError(f"Probe writer failed with exit code {writer.exitcode}")
+
+            stale = engine.index_is_stale()
+            reloaded = engine.reload_if_stale()
+            found = [
+                d.metadata.get("assessment_url")
+                for d in engine.vectorstore.similarity_search_by_vector(probe_vector, k=2)
+            ]
+        finally:
+            engine.close()
+
+    report = {
+        "reload": {
+            "backend": backend,
+            "stale_after_write": stale,
+            "reloaded": reloaded,
+            "rows_before": rows_before,
+            "rows_after": len(engine.catalog),
+            "probe_listed": RELOAD_PROBE_URL in engine.entries,
+            "probe_searchable": RELOAD_PROBE_URL in found,
+        }
+    }
+    if not (reloaded and report["reload"]["probe_listed"] and report["reload"]["probe_searchable"]):
+        _print_report(report)
+        raise SystemExit("❌ The reloaded engine does not serve the row written by the other process")
+    return report
+
+
+def _print_report(report: Dict[str, Dict]) -> None:
+    print("\n" + "=" * 60)
+    for section, values in report.items():
+        print(f"[{section}]")
+        for key, value in values.items():
+            if isinstance(value, dict):
+                inner = ", ".join(f"{k}={v:.3f}" for k, v in value.items())
+                print(f"  {key}: {inner}")
+            elif isinstance(value, float):
+                print(f"  {key}: {value:.4f}")
+            else:
+                print(f"  {key}: {value}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline latency benchmarks.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    backends = sub.add_parser("backends", help="Chroma vs. NumPy vector search")
+    backends.add_argument("--queries", type=int, default=200)
+    backends.add_argument("--k", type=int, default=20)
+
+    pipeline = sub.add_parser("pipeline", help="Index build, balancing, recommend and API throughput")
+    pipeline.add_argument("--rounds", type=int, default=50)
+    pipeline.add_argument("--requests", type=int, default=100)
+    pipeline.add_argument("--concurrency", type=int, default=8)
+    pipeline.add_argument("--backend", choices=["chroma", "numpy"], default="chroma")
+
+    reload = sub.add_parser("reload", help="Check that a rebuild by another process is served after a reload")
+    reload.add_argument("--backend", choices=["chroma", "numpy", "snapshot"], default="chroma")
+
+    args = parser.parse_args()
+    if args.command == "backends":
+        _print_report(benchmark_backends(args.queries, args.k))
+    elif args.command == "pipeline":
+        _print_report(benchmark_pipeline(args.rounds, args.requests, args.concurrency, args.backend))
+    elif args.command == "reload":
+        _print_report(check_reload(args.backend))
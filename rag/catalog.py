@@ -0,0 +1,99 @@
+"""
+Typed catalog records, precomputed once per loaded index.
+
+The stored metadata keeps everything as Chroma-friendly strings and
+numbers: durations like "30" or 30.0, test types as a "K,P" code string, the
+description embedded in `page_content`. `CatalogEntry` parses all of that
+once, when the engine loads the collection, so the request path only does
+dictionary lookups by assessment URL:
+
+- the duration as an int (None when the catalog has none)
+- the test types as codes, bitmask and expanded category names
+- the remote / adaptive flags as booleans
+- the description and the scoring-prompt block for the assessment
+- the response item, ready to serialize
+
+Durations go through `numpy_index.duration_minutes`, the same parser that
+fills the store's constraint columns, so both always agree.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+try:  # imported as part of the `rag` package (api.py, frontend.py)
+    from rag.numpy_index import codes_to_mask, duration_minutes
+except ImportError:  # run as a script from rag/
+    from numpy_index import codes_to_mask, duration_minutes
+
+
+def parse_codes(raw) -> List[str]:
+    """SHL test-type codes from a "K,P" string or a list."""
+    if isinstance(raw, str):
+        return [c.strip() for c in raw.split(",") if c.strip()]
+    if isinstance(raw, list):
+        return [str(c).strip() for c in raw if str(c).strip()]
+    return []
+
+
+def parse_description(page_content: str) -> str:
+    """The text after "Description:" in the embedded page content."""
+    text = page_content or ""
+    if "Description:" in text:
+        return text.split("Description:", 1)[1].strip()
+    return text.strip()
+
+
+class CatalogEntry:
+    """One assessment with every request-time field already parsed."""
+
+    __slots__ = (
+        "url",
+        "name",
+        "codes",
+        "type_mask",
+        "categories",
+        "duration",
+        "remote",
+        "adaptive",
+        "description",
+        "prompt_block",
+        "response",
+    )
+
+    def __init__(self, doc: Document, type_names: Dict[str, str]):
+        metadata = doc.metadata
+        self.url: str = metadata.get("assessment_url")
+        self.name: str = metadata.get("assessment_name")
+        self.codes: Tuple[str, ...] = tuple(parse_codes(metadata.get("test_type_codes", [])))
+        self.type_mask: int = codes_to_mask(self.codes)
+        self.categories: str = ", ".join(type_names[c] for c in self.codes if c in type_names)
+        minutes = duration_minutes(metadata.get("duration"))
+        self.duration: Optional[int] = None if minutes < 0 else minutes
+        self.remote: bool = metadata.get("remote_testing") == "Yes"
+        self.adaptive: bool = metadata.get("adaptive_irt") == "Yes"
+        self.description: str = parse_description(doc.page_content)
+        # Same text `build_scoring_prompt` writes for the assessment
+        self.prompt_block: str = (
+            f"Name: {self.name}\nCategories: {self.categories}\nDescription:\n{self.description}\n"
+        )
+        self.response: Dict = {
+            "url": self.url,
+            "name": self.name,
+            "adaptive_support": metadata.get("adaptive_irt"),
+            "description": self.description,
+            "duration": self.duration,
+            "remote_support": metadata.get("remote_testing"),
+            "test_type": [type_names.get(c, c) for c in self.codes],
+        }
+
+
+def build_entries(documents: List[Document], type_names: Dict[str, str]) -> Dict[str, CatalogEntry]:
+    """Catalog entries keyed by assessment URL (first document wins on duplicates)."""
+    entries: Dict[str, CatalogEntry] = {}
+    for doc in documents:
+        url = doc.metadata.get("assessment_url")
+        if url and url not in entries:
+            entries[url] = CatalogEntry(doc, type_names)
+    return entries
+
@@ -0,0 +1,309 @@
+"""
+Persistent embedding cache shared by indexing and querying.
+
+Vectors are keyed by embedding model and a SHA-256 of the exact text, so a
+rebuilt index or a repeated evaluation run never pays twice for the same
+text. Per model, the cache is two append-only files plus a lock file:
+
+- `<model>.f32`: raw float32 rows, read through a read-only `np.memmap`
+- `<model>.idx`: a `dim <n>` header line, then one `<text hash> <row>` line
+  per vector
+- `<model>.lock`: `flock`ed exclusively by writers and shared by readers
+
+Several processes (API workers, an index build, an evaluation run) can share
+one cache. A writer holds the exclusive lock while it appends: it first reads
+the index lines other processes added since it last looked, then numbers its
+new rows from the vector file's size after the write, so two processes never
+claim the same row. Readers take the shared lock only to pick up those lines
+when they miss.
+
+A vector is written before its index line, so an interrupted write leaves
+at worst an orphaned row, never an index entry pointing at garbage. The next
+writer drops a partial trailing row or index line before appending.
+
+The files only grow. Compact them (dropping orphaned rows and, optionally,
+all but the newest entries) from the project root:
+    python rag/embedding_cache.py stats
+    python rag/embedding_cache.py compact [--max-entries N] [--model M]
+"""
+
+import argparse
+import asyncio
+import fcntl
+import glob
+import hashlib
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_DIR = "vectorstore/embedding_cache"
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _file_stem(model: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+
+
+class EmbeddingCache:
+    """Thread- and process-safe, memory-mapped store of one model's embeddings."""
+
+    def __init__(self, model: str, directory: str = DEFAULT_DIR):
+        self.model = model
+        os.makedirs(directory, exist_ok=True)
+        stem = os.path.join(directory, _file_stem(model))
+        self.vectors_path = stem + ".f32"
+        self.index_path = stem + ".idx"
+        self.lock_path = stem + ".lock"
+
+        self._lock = threading.Lock()
+        self._lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._rows: Dict[str, int] = {}
+        self.dim: Optional[int] = None
+        self._matrix: Optional[np.memmap] = None
+        # Which index file has been read, and up to which byte
+        self._index_id = None
+        self._index_offset = 0
+
+        self.hits = 0
+        self.misses = 0
+        with self._lock, self._file_lock(fcntl.LOCK_SH):
+            self._sync_index()
+
+    @contextmanager
+    def _file_lock(self, mode: int):
+        fcntl.flock(self._lock_fd, mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    # ---------- index (callers hold both locks) ----------
+    def _sync_index(self) -> None:
+        """Read index lines appended since the last sync, starting over if the files were compacted."""
+        try:
+            st = os.stat(self.index_path)
+        except FileNotFoundError:
+            return
+        if (st.st_dev, st.st_ino) != self._index_id:
+            self._index_id = (st.st_dev, st.st_ino)
+            self._index_offset = 0
+            self._rows.clear()
+            self.dim = None
+            self._matrix = None
+        if st.st_size <= self._index_offset:
+            return
+
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_offset)
+            data = f.read()
+        # An unterminated last line is a torn write; the next writer truncates it
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].decode("ascii").splitlines():
+            parts = line.split()
+            if len(parts) != 2:
+                continue
+            if parts[0] == "dim":
+                self.dim = int(parts[1])
+            else:
+                self._rows[parts[0]] = int(parts[1])
+        self._index_offset += end
+
+        if self._rows and (self._matrix is None or max(self._rows.values()) >= self._matrix.shape[0]):
+            self._remap()
+
+    def _remap(self) -> None:
+        rows = os.path.getsize(self.vectors_path) // (4 * self.dim)
+        self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+
+    # ---------- reads and writes ----------
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Cached vector per text, or None where the text has not been embedded yet."""
+        keys = [text_hash(text) for text in texts]
+        with self._lock:
+            if any(key not in self._rows for key in keys):
+                # Another process may have embedded them since
+                with self._file_lock(fcntl.LOCK_SH):
+                    self._sync_index()
+            out: List[Optional[List[float]]] = []
+            for key in keys:
+                row = self._rows.get(key)
+                if row is None:
+                    self.misses += 1
+                    out.append(None)
+                else:
+                    self.hits += 1
+                    out.append(self._matrix[row].tolist())
+        return out
+
+    def put_many(self, texts: List[str], vectors: List[List[float]]) -> None:
+        with self._lock:
+            pending = {text_hash(text): vector for text, vector in zip(texts, vectors)}
+            if all(key in self._rows for key in pending):
+                return
+            with self._file_lock(fcntl.LOCK_EX):
+                self._sync_index()
+                new = {key: vector for key, vector in pending.items() if key not in self._rows}
+                if not new:
+                    return
+
+                matrix = np.asarray(list(new.values()), dtype=np.float32)
+                header = ""
+                if self.dim is None:
+                    self.dim = matrix.shape[1]
+                    header = f"dim {self.dim}\n"
+                elif matrix.shape[1] != self.dim:
+                    raise ValueError(
+                        f"Embedding dimension {matrix.shape[1]} does not match cached {self.dim} for {self.model}"
+                    )
+
+                row_bytes = 4 * self.dim
+                with open(self.vectors_path, "ab") as f:
+                    size = os.fstat(f.fileno()).st_size
+                    if size % row_bytes:
+                        f.truncate(size - size % row_bytes)
+                    f.write(matrix.tobytes())
+                    f.flush()
+                    first_row = os.fstat(f.fileno()).st_size // row_bytes - len(new)
+                with open(self.index_path, "a", encoding="ascii") as f:
+                    if os.fstat(f.fileno()).st_size > self._index_offset:
+                        f.truncate(self._index_offset)
+                    f.write(header + "".join(f"{key} {first_row + i}\n" for i, key in enumerate(new)))
+                self._sync_index()
+
+    # ---------- maintenance (used by the CLI) ----------
+    def _disk_bytes(self) -> int:
+        return sum(os.path.getsize(p) for p in (self.vectors_path, self.index_path) if os.path.exists(p))
+
+    def compact(self, max_entries: Optional[int] = None) -> Dict:
+        """
+        Rewrite the files with only indexed rows, keeping the newest
+        `max_entries` if given. Other processes pick up the new files on
+        their next miss or write.
+        """
+        with self._lock, self._file_lock(fcntl.LOCK_EX):
+            self._sync_index()
+            before = {"entries": len(self._rows), "bytes": self._disk_bytes()}
+            keys = sorted(self._rows, key=self._rows.get)
+            if max_entries is not None:
+                keys = keys[max(0, len(keys) - max_entries):]
+
+            vectors_tmp = self.vectors_path + ".tmp"
+            index_tmp = self.index_path + ".tmp"
+            with open(vectors_tmp, "wb") as f:
+                if keys:
+                    f.write(self._matrix[[self._rows[key] for key in keys]].tobytes())
+            with open(index_tmp, "w", encoding="ascii") as f:
+                if self.dim is not None:
+                    f.write(f"dim {self.dim}\n")
+                f.write("".join(f"{key} {i}\n" for i, key in enumerate(keys)))
+            os.replace(vectors_tmp, self.vectors_path)
+            os.replace(index_tmp, self.index_path)
+
+            self._sync_index()
+            return {"before": before, "after": {"entries": len(self._rows), "bytes": self._disk_bytes()}}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "model": self.model,
+                "entries": len(self._rows),
+                "dim": self.dim,
+                "bytes": self._disk_bytes(),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves repeated texts from an `EmbeddingCache`.
+
+    Only texts missing from the cache reach `inner`, in one request per call.
+    """
+
+    def __init__(self, inner: Embeddings, cache: EmbeddingCache):
+        self.inner = inner
+        self.cache = cache
+
+    def _missing(self, texts: List[str], cached: List[Optional[List[float]]]) -> List[str]:
+        return list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+
+    def _fill(self, texts, cached, missing, vectors) -> List[List[float]]:
+        self.cache.put_many(missing, vectors)
+        by_text = dict(zip(missing, vectors))
+        return [v if v is not None else by_text[t] for t, v in zip(texts, cached)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        cached = self.cache.get_many(texts)
+        missing = self._missing(texts, cached)
+        if not missing:
+            return cached
+        return self._fill(texts, cached, missing, self.inner.embed_documents(missing))
+
+    def embed_query(self, text: str) -> List[float]:
+        cached = self.cache.get_many([text])[0]
+        if cached is not None:
+            return cached
+        vector = self.inner.embed_query(text)
+        self.cache.put_many([text], [vector])
+        return vector
+
+    # The cache takes a file lock and reads/writes files, so the async
+    # methods use it from a worker thread, never on the event loop
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        cached = await asyncio.to_thread(self.cache.get_many, texts)
+        missing = self._missing(texts, cached)
+        if not missing:
+            return cached
+        vectors = await self.inner.aembed_documents(missing)
+        return await asyncio.to_thread(self._fill, texts, cached, missing, vectors)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        cached = (await asyncio.to_thread(self.cache.get_many, [text]))[0]
+        if cached is not None:
+            return cached
+        vector = await self.inner.aembed_query(text)
+        await asyncio.to_thread(self.cache.put_many, [text], [vector])
+        return vector
+
+
+def _main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect and compact the embedding cache.")
+    parser.add_argument("--dir", default=DEFAULT_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("stats", help="Show entries and size per model")
+
+    compact = sub.add_parser("compact", help="Drop orphaned rows and, optionally, old entries")
+    compact.add_argument("--max-entries", type=int, default=None, help="Keep only the newest N entries")
+    compact.add_argument("--model", help="Only this model's files (as named in the directory)")
+
+    args = parser.parse_args()
+    # File stems stand in for model names: `_file_stem` leaves them unchanged
+    stems = sorted(os.path.basename(p)[: -len(".idx")] for p in glob.glob(os.path.join(args.dir, "*.idx")))
+    if args.command == "compact" and args.model:
+        stems = [s for s in stems if s == _file_stem(args.model)]
+
+    for stem in stems:
+        cache = EmbeddingCache(stem, args.dir)
+        if args.command == "stats":
+            s = cache.stats()
+            print(f"{stem}  entries={s['entries']}  dim={s['dim']}  bytes={s['bytes']}")
+        elif args.command == "compact":
+            result = cache.compact(args.max_entries)
+            print(
+                f"{stem}  entries {result['before']['entries']} -> {result['after']['entries']}  "
+                f"bytes {result['before']['bytes']} -> {result['after']['bytes']}"
+            )
+
+
+if __name__ == "__main__":
+    _main()
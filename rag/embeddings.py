@@ -1,10 +1,29 @@
+import argparse
+import hashlib
+import json
 import os
+import random
+import threading
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List
 
+import openai
 import pandas as pd
 from langchain_core.documents import Document
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
 from dotenv import load_dotenv
+
+try:  # imported as part of the `rag` package
+    from rag.embedding_cache import CachedEmbeddings, EmbeddingCache
+    from rag.fake_models import HashedEmbeddings
+    from rag.numpy_index import SNAPSHOT_FILE, NumpyVectorStore
+except ImportError:  # run as a script from rag/ (`python rag/embeddings.py`, benchmark.py)
+    from embedding_cache import CachedEmbeddings, EmbeddingCache
+    from fake_models import HashedEmbeddings
+    from numpy_index import SNAPSHOT_FILE, NumpyVectorStore
+
 load_dotenv()
 
 # ================== CONFIG ==================
@@ -12,6 +31,30 @@ load_dotenv()
 DATA_PATH = "data/shl_catelog.csv"
 PERSIST_DIR = "vectorstore/chroma"
 EMBEDDING_MODEL = "openai/text-embedding-3-large"
+# "openrouter" or "fake" (offline hashed embeddings, see rag/fake_models.py)
+MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "openrouter")
+FAKE_EMBEDDING_LATENCY_SECONDS = float(os.getenv("FAKE_EMBEDDING_LATENCY_SECONDS", "0"))
+# Touched after every build so running retrievers can drop stale cached results
+INDEX_VERSION_FILE = "index_version"
+# Vectors keyed by model + text hash, shared with rag/retriever.py (None disables it)
+EMBEDDING_CACHE_DIR = "vectorstore/embedding_cache"
+
+# Ingestion: rows per embedding request, requests in flight, and the
+# token-bucket limit on request starts (sustained rate + burst)
+INGEST_BATCH_SIZE = 64
+INGEST_CONCURRENCY = 4
+INGEST_REQUESTS_PER_SECOND = 2.0
+INGEST_BURST = 4
+INGEST_MAX_RETRIES = 5
+INGEST_BACKOFF_SECONDS = 1.0
+
+# Transient provider errors worth retrying (429, timeouts, 5xx, dropped connections)
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
 
 
 # ================== SHL TEST TYPE MAP ==================
@@ -27,32 +70,47 @@ TEST_TYPE_MAP = {
 }
 
 
-def load_catalog(csv_path: str) -> pd.DataFrame:
-    """Load and validate SHL catalog CSV."""
-    df = pd.read_csv(csv_path)
+REQUIRED_COLUMNS = [
+    "name",
+    "url",
+    "description",
+    "test_type",
+    "duration",
+    "remote_testing",
+    "adaptive_irt"
+]
+MIN_CATALOG_ROWS = 377
 
-    required_columns = [
-        "name",
-        "url",
-        "description",
-        "test_type",
-        "duration",
-        "remote_testing",
-        "adaptive_irt"
-    ]
-
-    for col in required_columns:
+
+def _check_columns(df: pd.DataFrame) -> None:
+    for col in REQUIRED_COLUMNS:
         if col not in df.columns:
             raise ValueError(f"Missing required column: {col}")
 
-    if len(df) < 377:
+
+def _check_row_count(n: int) -> None:
+    if n < MIN_CATALOG_ROWS:
         raise ValueError(
-            f"Expected ≥ 377 individual test solutions, found {len(df)}"
+            f"Expected ≥ {MIN_CATALOG_ROWS} individual test solutions, found {n}"
         )
 
+
+def load_catalog(csv_path: str) -> pd.DataFrame:
+    """Load and validate SHL catalog CSV."""
+    df = pd.read_csv(csv_path)
+    _check_columns(df)
+    _check_row_count(len(df))
     return df
 
 
+def iter_catalog_batches(csv_path: str, batch_size: int = INGEST_BATCH_SIZE) -> Iterator[pd.DataFrame]:
+    """Stream the catalog CSV in `batch_size`-row chunks (columns checked on the first)."""
+    for i, chunk in enumerate(pd.read_csv(csv_path, chunksize=batch_size)):
+        if i == 0:
+            _check_columns(chunk)
+        yield chunk
+
+
 def expand_test_types(test_type_str: str) -> str:
     """Convert test-type codes into semantic descriptions."""
     if pd.isna(test_type_str):
@@ -102,36 +160,262 @@ Assessment Categories:
         **type_flags,
     }
 
+    metadata["content_hash"] = content_hash(page_content, metadata)
+
     return Document(
+        id=document_id(row["url"]),
         page_content=page_content,
         metadata=metadata
     )
 
 
-def build_chroma_vectorstore():
-    """Build and persist ChromaDB vector store."""
-    os.makedirs(PERSIST_DIR, exist_ok=True)
+def document_id(url: str) -> str:
+    """Stable collection ID for a catalog row, derived from its assessment URL."""
+    return hashlib.sha1(str(url).strip().encode("utf-8")).hexdigest()
+
+
+def content_hash(page_content: str, metadata: Dict) -> str:
+    """Hash of everything stored for a row, so any edit to it triggers a re-embed."""
+    payload = json.dumps(
+        {
+            "page_content": page_content,
+            "metadata": {k: v for k, v in metadata.items() if k != "content_hash"},
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def mark_index_updated(persist_dir: str = PERSIST_DIR) -> None:
+    """Record that the collection in `persist_dir` has changed."""
+    with open(os.path.join(persist_dir, INDEX_VERSION_FILE), "w") as f:
+        f.write(f"{time.time_ns()}\n")
+
+
+def make_embeddings():
+    """Embedding model for the configured provider, behind the shared embedding cache."""
+    if MODEL_PROVIDER == "fake":
+        embeddings = HashedEmbeddings(latency_seconds=FAKE_EMBEDDING_LATENCY_SECONDS)
+    else:
+        # Make sure OPENROUTER_API_KEY is set in your environment.
+        embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL,base_url="https://openrouter.ai/api/v1",
+        api_key=os.getenv("OPENROUTER_API_KEY"))
+    if EMBEDDING_CACHE_DIR:
+        return CachedEmbeddings(embeddings, EmbeddingCache(embeddings.model, EMBEDDING_CACHE_DIR))
+    return embeddings
+
+
+# ================== INGESTION ==================
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, at most `capacity` banked."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_seconds = (1 - self._tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+def embed_with_retries(
+    embeddings,
+    texts: List[str],
+    limiter: TokenBucket,
+    max_retries: int = INGEST_MAX_RETRIES,
+    backoff_seconds: float = INGEST_BACKOFF_SECONDS,
+) -> List[List[float]]:
+    """One rate-limited `embed_documents` call, retried with jittered exponential backoff."""
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            return embeddings.embed_documents(texts)
+        except RETRYABLE_ERRORS as exc:
+            if attempt == max_retries:
+                raise
+            delay = backoff_seconds * (2 ** attempt) * (1 + random.random())
+            print(f"⚠️ Embedding batch failed ({type(exc).__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def _stored_hashes(vectorstore: Chroma) -> Dict[str, str]:
+    """Content hash of every stored row, by ID (metadata only, no vectors)."""
+    existing = vectorstore._collection.get(include=["metadatas"])
+    return {
+        doc_id: (metadata or {}).get("content_hash")
+        for doc_id, metadata in zip(existing["ids"], existing["metadatas"])
+    }
 
-    df = load_catalog(DATA_PATH)
-    documents = [row_to_document(row) for _, row in df.iterrows()]
 
-    # Uses Gemini embeddings via langchain-google-genai.
-    # Make sure GOOGLE_API_KEY is set in your environment.
-    embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL,base_url="https://openrouter.ai/api/v1",
-    api_key=os.getenv("OPENROUTER_API_KEY"))
+def plan_index_update(stored: Dict[str, str], documents: List[Document]) -> Dict[str, List]:
+    """
+    Diff a batch of catalog documents against the stored content hashes.
+
+    Returns {"added": [docs], "updated": [docs], "unchanged": [ids]}.
+    """
+    plan: Dict[str, List] = {"added": [], "updated": [], "unchanged": []}
+    for doc in documents:
+        if doc.id not in stored:
+            plan["added"].append(doc)
+        elif stored[doc.id] != doc.metadata["content_hash"]:
+            plan["updated"].append(doc)
+        else:
+            plan["unchanged"].append(doc.id)
+    return plan
+
+
+def _write_batch(vectorstore: Chroma, docs: List[Document], vectors: List[List[float]]) -> None:
+    # Upserts by ID, so updated rows replace their old versions
+    vectorstore._collection.upsert(
+        ids=[doc.id for doc in docs],
+        embeddings=vectors,
+        documents=[doc.page_content for doc in docs],
+        metadatas=[doc.metadata for doc in docs],
+    )
+
+
+def export_snapshot(vectorstore: Chroma, persist_dir: str = PERSIST_DIR) -> str:
+    """Write the memory-mapped snapshot the retriever's "snapshot" backend loads."""
+    path = os.path.join(persist_dir, SNAPSHOT_FILE)
+    NumpyVectorStore.from_chroma(vectorstore).to_snapshot(path)
+    print(f"🗂️ Snapshot written to {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+    return path
+
+
+def build_chroma_vectorstore(
+    persist_dir: str = PERSIST_DIR,
+    embeddings=None,
+    batch_size: int = INGEST_BATCH_SIZE,
+    concurrency: int = INGEST_CONCURRENCY,
+    requests_per_second: float = INGEST_REQUESTS_PER_SECOND,
+):
+    """
+    Build or incrementally update the persisted ChromaDB vector store.
+
+    Rows are streamed from the CSV in batches; only rows that are new or
+    whose content hash changed are embedded, with up to `concurrency`
+    rate-limited, retried requests in flight. Each batch is written as soon
+    as it is embedded, so if a batch ultimately fails, everything written
+    so far is kept and a rerun picks up where this one stopped. Rows that
+    left the catalog are deleted once the whole catalog has been read.
+    Rows stored without a stable ID (older builds used random UUIDs) count
+    as left, so the first run also removes their duplicates.
+    """
+    os.makedirs(persist_dir, exist_ok=True)
+
+    if embeddings is None:
+        embeddings = make_embeddings()
     vectorstore = Chroma(
         collection_name="shl_catalog",
         embedding_function=embeddings,
-        persist_directory=PERSIST_DIR,
+        persist_directory=persist_dir,
     )
 
-    # Add all assessment documents
-    vectorstore.add_documents(documents)
-
-
-    print("✅ Chroma vector store created successfully")
-    print(f"📦 Total assessments indexed: {len(documents)}")
+    stored = _stored_hashes(vectorstore)
+    limiter = TokenBucket(requests_per_second, INGEST_BURST)
+    counts = {"added": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+    seen_ids = set()
+    failure = None
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        in_flight = {}
+
+        def drain(return_when) -> None:
+            nonlocal failure
+            done, _ = wait(in_flight, return_when=return_when)
+            for future in done:
+                docs = in_flight.pop(future)
+                try:
+                    _write_batch(vectorstore, docs, future.result())
+                except Exception as exc:
+                    failure = failure or exc
+                    continue
+                for doc in docs:
+                    counts["added" if doc.id not in stored else "updated"] += 1
+
+        for chunk in iter_catalog_batches(DATA_PATH, batch_size):
+            documents = []
+            for _, row in chunk.iterrows():
+                doc = row_to_document(row)
+                # A URL listed twice is indexed once (first row wins)
+                if doc.id not in seen_ids:
+                    seen_ids.add(doc.id)
+                    documents.append(doc)
+
+            plan = plan_index_update(stored, documents)
+            counts["unchanged"] += len(plan["unchanged"])
+            changed = plan["added"] + plan["updated"]
+            if changed and failure is None:
+                future = pool.submit(
+                    embed_with_retries, embeddings, [doc.page_content for doc in changed], limiter
+                )
+                in_flight[future] = changed
+            # Bound the number of embedded-but-unwritten batches held in memory
+            while len(in_flight) >= max(1, concurrency):
+                drain(FIRST_COMPLETED)
+            if failure is not None:
+                break
+        if in_flight:
+            drain(ALL_COMPLETED)
+
+    if failure is not None:
+        if counts["added"] or counts["updated"]:
+            # The batches written so far are live in Chroma; the snapshot must
+            # carry them too before the new version sends workers to reload it
+            export_snapshot(vectorstore, persist_dir)
+            mark_index_updated(persist_dir)
+        print(f"❌ Ingestion stopped: {counts['added']} added, {counts['updated']} updated so far. Re-run to resume.")
+        raise failure
+
+    _check_row_count(len(seen_ids))
+    removed = [doc_id for doc_id in stored if doc_id not in seen_ids]
+    if removed:
+        vectorstore.delete(ids=removed)
+        counts["deleted"] = len(removed)
+
+    changed = counts["added"] or counts["updated"] or counts["deleted"]
+    if changed or not os.path.exists(os.path.join(persist_dir, SNAPSHOT_FILE)):
+        export_snapshot(vectorstore, persist_dir)
+    # Only after the export, so a reload triggered by the version loads the new snapshot
+    if changed:
+        mark_index_updated(persist_dir)
+
+    print("✅ Chroma vector store is up to date")
+    print(
+        f"📦 {len(seen_ids)} assessments: {counts['added']} added, "
+        f"{counts['updated']} updated, {counts['deleted']} deleted, "
+        f"{counts['unchanged']} unchanged"
+    )
+    return vectorstore
 
 
 if __name__ == "__main__":
-    build_chroma_vectorstore()
+    parser = argparse.ArgumentParser(description="Build or update the catalog index.")
+    parser.add_argument("--persist-dir", default=PERSIST_DIR)
+    parser.add_argument(
+        "--snapshot-only",
+        action="store_true",
+        help="Only re-export the snapshot from the existing collection (no embedding calls)",
+    )
+    args = parser.parse_args()
+
+    if args.snapshot_only:
+        export_snapshot(
+            Chroma(collection_name="shl_catalog", embedding_function=make_embeddings(), persist_directory=args.persist_dir),
+            args.persist_dir,
+        )
+        mark_index_updated(args.persist_dir)
+    else:
+        build_chroma_vectorstore(args.persist_dir)
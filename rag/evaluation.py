@@ -2,19 +2,67 @@
 Evaluation utilities for the SHL Assessment Recommendation System.
 
 Implements Recall@K and Mean Recall@K and applies them at:
-- Dense retrieval stage (vector search only)
+- Retrieval stage (vector search only, or the fused dense + BM25 pool when
+  the engine runs with `retrieval_mode="hybrid"`)
 - Final recommendation stage (after intent + LLM re‑ranking)
 
+Queries are fanned out over a worker pool against one shared engine (the
+store is loaded once). Besides recall, the run reports p50/p95/p99 latency
+per pipeline stage, network calls and LLM token counts, and can write the
+whole thing as a JSON report to diff between commits:
+
+    python rag/evaluation.py --workers 8 --report eval_report.json
+
+Compare final-stage re-rankers (LLM scoring vs. local BM25) on the same
+queries, recall next to latency and LLM calls:
+
+    python rag/evaluation.py --rerankers llm bm25
+
+Either run can use hybrid (dense + BM25, RRF-fused) candidate retrieval:
+
+    python rag/evaluation.py --retrieval-mode hybrid
+
+Compare the two-call pipeline (intent, then scoring) against the merged
+single-call one, including input tokens served from the provider's prompt
+cache:
+
+    python rag/evaluation.py --pipelines two_call merged
+
+One comparison per run: `--pipelines` and `--rerankers` cannot both list
+several values (fix the other with a single value, e.g. `--rerankers bm25`).
+
+By default the run reads and fills the on-disk LLM response and embedding
+stores, so a repeated run measures warm caches. `--no-cache` disables both
+(as `benchmark.py` does), so latency and call counts reflect real model
+calls; use it for re-ranker and pipeline comparisons:
+
+    python rag/evaluation.py --no-cache --pipelines two_call merged
+
 This file is NOT used by the API – it is for offline experiments only.
 """
 
-from collections import defaultdict
-from typing import Dict, Iterable, List, Tuple
+import argparse
+import json
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
 from urllib.parse import urlparse, urlunparse
 
 import pandas as pd
 
-from retriever import load_vectorstore, recommend
+import retriever
+from instrumentation import STAGES, latency_summary, tracing
+from retriever import (
+    EMBEDDING_MODEL,
+    LLM_MODEL,
+    PIPELINE_MODE,
+    RERANKER,
+    RETRIEVAL_MODE,
+    RecommenderEngine,
+    get_engine,
+    hybrid_candidates,
+)
 
 
 def _load_train_data(path: str) -> Dict[str, List[str]]:
@@ -114,10 +162,171 @@ def _recall_at_k(relevant: Iterable[str], predicted: Iterable[str], k: int) -> f
     return hits / len(rel)
 
 
+def disable_persistent_caches() -> None:
+    """Turn off the on-disk LLM and embedding stores for engines created afterwards."""
+    retriever.LLM_CACHE_PATH = None
+    retriever.EMBEDDING_CACHE_DIR = None
+
+
+def _evaluate_query(
+    engine: RecommenderEngine,
+    query: str,
+    relevant_urls: List[str],
+    query_vector: List[float],
+    retrieval_k: int,
+    final_k: int,
+) -> Dict:
+    """
+    Score one query at both stages and capture its trace. The pipeline is
+    given the batch-embedded vector, so its trace has no embedding stage.
+    """
+    record: Dict = {"query": query}
+
+    # 1) Retrieval stage (the query vector was embedded up front in one batch)
+    index = engine.index
+    if engine.retrieval_mode == "hybrid":
+        retrieved_docs = hybrid_candidates(
+            index.vectorstore, index.lexical, index.catalog, query, query_vector
+        )[:retrieval_k]
+    else:
+        retrieved_docs = index.vectorstore.similarity_search_by_vector(query_vector, k=retrieval_k)
+    retrieved_urls = [
+        (doc.metadata.get("assessment_url") or "").strip()
+        for doc in retrieved_docs
+    ]
+    record["retrieval_recall"] = _recall_at_k(relevant_urls, retrieved_urls, final_k)
+
+    # 2) Full recommendation stage
+    with tracing() as trace:
+        start = time.perf_counter()
+        try:
+            rec_output = engine.recommend(query, final_k, query_vector)
+        except Exception as exc:
+            record["error"] = f"{type(exc).__name__}: {exc}"
+            rec_output = None
+        record["total_ms"] = (time.perf_counter() - start) * 1000
+
+    if rec_output is not None:
+        final_urls = [
+            (item.get("url") or "").strip()
+            for item in rec_output.get("recommended_assessments", [])[:final_k]
+        ]
+        record["final_recall"] = _recall_at_k(relevant_urls, final_urls, final_k)
+    record.update(trace.to_dict())
+    return record
+
+
+def run_evaluation(
+    train_csv_path: str,
+    retrieval_k: int = 20,
+    final_k: int = 10,
+    workers: int = 4,
+    engine: Optional[RecommenderEngine] = None,
+) -> Dict:
+    """
+    Evaluate every ground-truth query concurrently and build the full report.
+
+    Returns a dict with `config`, `metrics` (Mean Recall@K at both stages),
+    `latency` (per stage and end to end), `network_calls`, `tokens` and a
+    `per_query` breakdown.
+    """
+    ground_truth = _load_train_data(train_csv_path)
+    if not ground_truth:
+        raise ValueError("No valid train examples found.")
+
+    engine = engine or get_engine()
+    queries = list(ground_truth)
+
+    start = time.perf_counter()
+    # The embedding stage: one batched request for every query, through the
+    # embedding cache (a repeat run reads it; --no-cache always calls the
+    # provider). Both stages of every query reuse these vectors.
+    cache = getattr(engine.embeddings, "cache", None)
+    calls_before = engine.embedding_calls
+    hits_before = cache.hits if cache is not None else 0
+    embed_start = time.perf_counter()
+    query_vectors = engine.embeddings.embed_documents(queries)
+    embed_ms = (time.perf_counter() - embed_start) * 1000
+    embed_calls = engine.embedding_calls - calls_before
+    embed_hits = (cache.hits - hits_before) if cache is not None else 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        records = list(
+            pool.map(
+                lambda item: _evaluate_query(
+                    engine, item[0], ground_truth[item[0]], item[1], retrieval_k, final_k
+                ),
+                zip(queries, query_vectors),
+            )
+        )
+    wall_seconds = time.perf_counter() - start
+
+    def _mean(xs: List[float]) -> float:
+        return sum(xs) / len(xs) if xs else 0.0
+
+    ok = [r for r in records if "error" not in r]
+    calls: Counter = Counter({"embedding": embed_calls, "embedding_cache_hit": embed_hits})
+    tokens: Counter = Counter()
+    stage_samples: Dict[str, List[float]] = defaultdict(list)
+    for r in records:
+        calls.update(r["calls"])
+        tokens.update(r["tokens"])
+        for name, ms in r["stages_ms"].items():
+            stage_samples[name].append(ms)
+
+    return {
+        "config": {
+            "train_csv": train_csv_path,
+            "retrieval_k": retrieval_k,
+            "final_k": final_k,
+            "workers": workers,
+            "backend": engine.backend,
+            "reranker": engine.reranker,
+            "retrieval_mode": engine.retrieval_mode,
+            "pipeline": engine.pipeline,
+            "llm_model": LLM_MODEL,
+            "embedding_model": EMBEDDING_MODEL,
+            "llm_cache": engine.llm_store is not None,
+            "embedding_cache": engine.embeddings is not engine.provider_embeddings,
+        },
+        "metrics": {
+            "retrieval_mean_recall@K": _mean([r["retrieval_recall"] for r in records]),
+            # A failed query counts as recall 0, not as absent
+            "final_mean_recall@K": _mean([r.get("final_recall", 0.0) for r in records]),
+            "num_queries": len(ground_truth),
+            "errors": len(records) - len(ok),
+        },
+        "latency": {
+            "wall_seconds": wall_seconds,
+            # Per query, excluding the embedding batch below
+            "end_to_end": latency_summary([r["total_ms"] for r in ok]),
+            "embedding_batch": {
+                "ms": embed_ms,
+                "queries": len(queries),
+                "per_query_ms": embed_ms / len(queries),
+            },
+            "stages": {
+                name: latency_summary(stage_samples[name])
+                for name in STAGES
+                if stage_samples.get(name)
+            },
+        },
+        "network_calls": dict(calls),
+        "tokens": {
+            "input": tokens["input"],
+            "output": tokens["output"],
+            "total": tokens["total"],
+            "cached_input": tokens["cached_input"],
+            "per_query_mean": tokens["total"] / len(records) if records else 0.0,
+        },
+        "per_query": records,
+    }
+
+
 def evaluate(
     train_csv_path: str,
     retrieval_k: int = 20,
     final_k: int = 10,
+    workers: int = 4,
 ) -> Dict[str, float]:
     """
     Run evaluation over the provided train data.
@@ -126,63 +335,166 @@ def evaluate(
         train_csv_path: Path to train CSV with Query and Assessment_url columns
         retrieval_k: Number of docs retrieved in dense search stage
         final_k: Number of final recommendations returned by the system
-        debug: If True, print detailed debugging information for first query
+        workers: Number of queries evaluated concurrently
 
     Returns:
         {
           "retrieval_mean_recall@K": ...,
           "final_mean_recall@K": ...,
-          "num_queries": N
+          "num_queries": N,
+          "errors": E
         }
     """
-    ground_truth = _load_train_data(train_csv_path)
-    if not ground_truth:
-        raise ValueError("No valid train examples found.")
+    return run_evaluation(train_csv_path, retrieval_k, final_k, workers)["metrics"]
 
-    vectorstore = load_vectorstore()
 
-    retrieval_recalls: List[float] = []
-    final_recalls: List[float] = []
+def compare_rerankers(
+    train_csv_path: str,
+    rerankers: List[str],
+    retrieval_k: int = 20,
+    final_k: int = 10,
+    workers: int = 4,
+    retrieval_mode: str = RETRIEVAL_MODE,
+    pipeline: str = PIPELINE_MODE,
+) -> Dict[str, Dict]:
+    """Full evaluation report per re-ranker, each on its own engine."""
+    reports = {}
+    for reranker in rerankers:
+        engine = RecommenderEngine(reranker=reranker, retrieval_mode=retrieval_mode, pipeline=pipeline)
+        try:
+            reports[reranker] = run_evaluation(train_csv_path, retrieval_k, final_k, workers, engine)
+        finally:
+            engine.close()
+    return reports
 
-    for idx, (query, relevant_urls) in enumerate(ground_truth.items()):
-        # 1) Retrieval stage
-        retrieved_docs = vectorstore.similarity_search(query, k=retrieval_k)
-        retrieved_urls = [
-            (doc.metadata.get("assessment_url") or "").strip()
-            for doc in retrieved_docs
-        ]
-        retrieval_recall = _recall_at_k(relevant_urls, retrieved_urls, final_k)
-        retrieval_recalls.append(retrieval_recall)
 
-        # 2) Full recommendation stage
-        rec_output = recommend(query, final_k)
-        final_urls = [
-            (item.get("url") or "").strip()
-            for item in rec_output.get("recommended_assessments", [])[:final_k]
-        ]
-        final_recall = _recall_at_k(relevant_urls, final_urls, final_k)
-        final_recalls.append(final_recall)
+def compare_pipelines(
+    train_csv_path: str,
+    pipelines: List[str],
+    retrieval_k: int = 20,
+    final_k: int = 10,
+    workers: int = 4,
+    retrieval_mode: str = RETRIEVAL_MODE,
+    reranker: str = RERANKER,
+) -> Dict[str, Dict]:
+    """Full evaluation report per pipeline mode (two-call vs. merged), each on its own engine."""
+    reports = {}
+    for pipeline in pipelines:
+        engine = RecommenderEngine(reranker=reranker, retrieval_mode=retrieval_mode, pipeline=pipeline)
+        try:
+            reports[pipeline] = run_evaluation(train_csv_path, retrieval_k, final_k, workers, engine)
+        finally:
+            engine.close()
+    return reports
 
-    def _mean(xs: List[float]) -> float:
-        return sum(xs) / len(xs) if xs else 0.0
 
-    return {
-        "retrieval_mean_recall@K": _mean(retrieval_recalls),
-        "final_mean_recall@K": _mean(final_recalls),
-        "num_queries": len(ground_truth),
-    }
+def _print_comparison(reports: Dict[str, Dict], label: str = "reranker") -> None:
+    print("\n" + "="*60)
+    print(f"{label.capitalize()} comparison:")
+    print("="*60)
+    print(
+        f"{label:>10} {'final_recall':>12} {'p50_ms':>9} {'p95_ms':>9} "
+        f"{'llm_calls':>9} {'tokens':>8} {'cached':>8}"
+    )
+    for name, report in reports.items():
+        e2e = report["latency"]["end_to_end"]
+        print(
+            f"{name:>10} {report['metrics']['final_mean_recall@K']:>12.4f} "
+            f"{e2e['p50_ms']:>9.1f} {e2e['p95_ms']:>9.1f} "
+            f"{report['network_calls'].get('llm', 0):>9} {report['tokens']['total']:>8} "
+            f"{report['tokens']['cached_input']:>8}"
+        )
+    print("="*60)
 
 
-if __name__ == "__main__":
-    metrics = evaluate("data/train_queries.csv")
+def _print_report(report: Dict) -> None:
     print("\n" + "="*60)
     print("Evaluation metrics (Mean Recall@K):")
     print("="*60)
-    for k, v in metrics.items():
+    for k, v in report["metrics"].items():
         if isinstance(v, float):
             print(f"{k}: {v:.4f}")
         else:
             print(f"{k}: {v}")
+    print("-"*60)
+    print(f"Wall time: {report['latency']['wall_seconds']:.2f}s")
+    batch = report["latency"]["embedding_batch"]
+    print(
+        f"{'embedding':>12}: {batch['ms']:.1f}ms for {batch['queries']} queries in one batch "
+        f"({batch['per_query_ms']:.1f}ms/query)"
+    )
+    for name, summary in [("end_to_end", report["latency"]["end_to_end"]), *report["latency"]["stages"].items()]:
+        print(
+            f"{name:>12}: p50={summary['p50_ms']:.1f}ms "
+            f"p95={summary['p95_ms']:.1f}ms p99={summary['p99_ms']:.1f}ms"
+        )
+    print("-"*60)
+    print(f"Network calls: {report['network_calls']}")
+    print(f"Tokens: {report['tokens']}")
     print("="*60)
 
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline evaluation (Mean Recall@K + latency).")
+    parser.add_argument("--train-csv", default="data/train_queries.csv")
+    parser.add_argument("--retrieval-k", type=int, default=20)
+    parser.add_argument("--final-k", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--report", default=None, help="Write the full JSON report to this path")
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Disable the on-disk LLM and embedding stores (cold-cache latency and call counts)",
+    )
+    parser.add_argument(
+        "--rerankers",
+        nargs="+",
+        choices=["llm", "bm25"],
+        default=[RERANKER],
+        help="Evaluate each re-ranker and print a side-by-side comparison",
+    )
+    parser.add_argument("--retrieval-mode", choices=["dense", "hybrid"], default=RETRIEVAL_MODE)
+    parser.add_argument(
+        "--pipelines",
+        nargs="+",
+        choices=["two_call", "merged"],
+        default=[PIPELINE_MODE],
+        help="Evaluate each pipeline mode and print a side-by-side comparison",
+    )
+    args = parser.parse_args()
+    if len(args.pipelines) > 1 and len(args.rerankers) > 1:
+        parser.error("compare either --pipelines or --rerankers, not both (pass one value for the other)")
+    if args.no_cache:
+        disable_persistent_caches()
+
+    if len(args.pipelines) > 1:
+        reports = compare_pipelines(
+            args.train_csv, args.pipelines, args.retrieval_k, args.final_k, args.workers,
+            args.retrieval_mode, args.rerankers[0],
+        )
+        for report in reports.values():
+            _print_report(report)
+        _print_comparison(reports, label="pipeline")
+        report = {"runs": reports}
+    elif len(args.rerankers) > 1:
+        reports = compare_rerankers(
+            args.train_csv, args.rerankers, args.retrieval_k, args.final_k, args.workers,
+            args.retrieval_mode, args.pipelines[0],
+        )
+        for report in reports.values():
+            _print_report(report)
+        _print_comparison(reports)
+        report = {"runs": reports}
+    else:
+        engine = RecommenderEngine(
+            reranker=args.rerankers[0], retrieval_mode=args.retrieval_mode, pipeline=args.pipelines[0]
+        )
+        try:
+            report = run_evaluation(args.train_csv, args.retrieval_k, args.final_k, args.workers, engine)
+        finally:
+            engine.close()
+        _print_report(report)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"📝 Report written to {args.report}")
@@ -0,0 +1,256 @@
+"""
+Offline, deterministic stand-ins for the embedding and chat models.
+
+Selected with `MODEL_PROVIDER=fake` (see `make_embeddings` / `make_chat_llm`
+in rag/retriever.py and rag/embeddings.py), they let the whole pipeline run
+without a network or API key, so benchmarks measure this code's own
+overhead. Each fake speaks the same interface the pipeline uses:
+
+- `HashedEmbeddings`: signed hashed bag-of-words vectors (a LangChain
+  `Embeddings`), stable across processes.
+- `FakeChatModel`: `with_structured_output(schema, include_raw=True)`
+  answering `QueryIntent` prompts with keyword and regex rules (domains
+  and stated constraints), `ScoreList` prompts with a query/assessment
+  word-overlap heuristic, and `MergedAnswer` prompts with both.
+
+Both accept an artificial per-call latency to emulate network round trips
+(`time.sleep` on the sync path, `asyncio.sleep` on the async one).
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import time
+from typing import Dict, List, Set
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage
+
+try:  # imported as part of the `rag` package
+    from rag.lexical import tokenize, words
+except ImportError:  # run as a script from rag/
+    from lexical import tokenize, words
+
+FAKE_LLM_MODEL = "fake-heuristic"
+
+# Keyword rules for the intent classifier, in the same order as `DomainType`
+_DOMAIN_KEYWORDS = {
+    "Ability & Aptitude": [
+        "aptitude", "cognitive", "reasoning", "numerical", "verbal", "logical",
+        "analytical", "problem solving", "inductive", "deductive",
+    ],
+    "Biodata & Situational Judgment": [
+        "situational", "judgment", "judgement", "scenario", "biodata",
+    ],
+    "Competencies": ["competency", "competencies", "soft skills"],
+    "Development & 360": ["360", "development plan", "feedback", "coaching"],
+    "Assessment Exercises": [
+        "assessment centre", "assessment center", "exercise", "work sample", "in-tray",
+    ],
+    "Knowledge & Skills": [
+        "java", "python", "sql", "javascript", "java script", ".net", "c++", "c#",
+        "developer", "programming", "coding", "engineer", "excel", "selenium",
+        "technical", "data", "analyst", "accounting", "knowledge",
+    ],
+    "Personality & Behaviour": [
+        "personality", "behaviour", "behavior", "collaborat", "teamwork",
+        "stakeholder", "communication", "interpersonal", "leadership", "culture",
+        "attitude", "sales",
+    ],
+    "Simulations": ["simulation", "simulate", "typing", "call center", "contact center"],
+}
+
+
+def _content_words(text: str) -> Set[str]:
+    return {t for t in tokenize(text) if len(t) > 1}
+
+
+class HashedEmbeddings(Embeddings):
+    """
+    Signed feature hashing of word unigrams into `dim` buckets, L2-normalised.
+
+    Texts sharing words land close together, which is enough for retrieval
+    to behave plausibly on the catalog.
+    """
+
+    def __init__(self, dim: int = 256, latency_seconds: float = 0.0):
+        self.dim = dim
+        # Same attribute as OpenAIEmbeddings.model; keys the embedding cache
+        # (versioned with the tokenizer, which determines the vectors)
+        self.model = f"fake-hashed-v2-{dim}"
+        self.latency_seconds = latency_seconds
+
+    def _vector(self, text: str) -> List[float]:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for token in words(text):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            h = int.from_bytes(digest, "little")
+            vec[h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        norm = np.linalg.norm(vec)
+        if norm:
+            vec /= norm
+        return vec.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        return self._vector(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+        return self._vector(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+        return [self._vector(t) for t in texts]
+
+
+# ================== PROMPT PARSING ==================
+def _prompt_text(prompt) -> str:
+    """A prompt string, or the texts of a `[(role, text), ...]` message list joined in order."""
+    if isinstance(prompt, str):
+        return prompt
+    return "\n\n".join(text for _, text in prompt)
+
+
+def _prompt_query(prompt: str) -> str:
+    """The query text that `build_intent_prompt` / `build_scoring_prompt` / `build_merged_prompt` embed."""
+    body = prompt.split("\nQuery:\n", 1)[-1]
+    return body.split("\nAssessments:\n", 1)[0].strip()
+
+
+def _prompt_assessments(prompt: str) -> List[str]:
+    """The numbered assessment blocks of a scoring prompt, in order."""
+    body = prompt.split("\nAssessments:\n", 1)[-1]
+    return re.split(r"\n\[\d+\]\n", body)[1:]
+
+
+def classify_intent(query: str) -> List[str]:
+    """Domains whose keywords occur in the query (may be empty)."""
+    text = query.lower()
+    return [
+        domain
+        for domain, keywords in _DOMAIN_KEYWORDS.items()
+        if any(k in text for k in keywords)
+    ]
+
+
+_DURATION_RANGE_RE = re.compile(r"(\d+)\s*(?:-|to)\s*(\d+)\s*(min|hour|hr)")
+_DURATION_RE = re.compile(r"(\d+)\s*(min|hour|hr)")
+_AN_HOUR_RE = re.compile(r"\b(?:an|one|1)[\s-]hour")
+
+# Checked in order; the first matching level wins
+_SENIORITY_KEYWORDS = [
+    ("Executive", ["coo", "ceo", "cfo", "cto", "chief", "vice president", "executive"]),
+    ("Director", ["director", "head of"]),
+    ("Manager", ["manager", "lead "]),
+    ("Senior", ["senior", "seasoned"]),
+    ("Graduate", ["graduate", "fresher"]),
+    ("Entry-Level", ["entry level", "entry-level", "0-2 years", "junior"]),
+]
+
+
+def extract_constraints(query: str) -> Dict:
+    """Max duration, remote/adaptive requirements and seniority stated in the query."""
+    text = query.lower()
+    out: Dict = {}
+
+    minutes = None
+    match = _DURATION_RANGE_RE.search(text) or _DURATION_RE.search(text)
+    if match:
+        unit = match.group(match.lastindex)
+        minutes = int(match.group(match.lastindex - 1)) * (1 if unit == "min" else 60)
+    elif _AN_HOUR_RE.search(text):
+        minutes = 60
+    if minutes is not None:
+        out["max_duration_minutes"] = minutes
+    if "remote" in text:
+        out["remote_required"] = True
+    if "adaptive" in text:
+        out["adaptive_required"] = True
+    for level, keywords in _SENIORITY_KEYWORDS:
+        if any(k in text for k in keywords):
+            out["seniority"] = level
+            break
+    return out
+
+
+def heuristic_scores(query: str, assessments: List[str]) -> List[int]:
+    """1–5 per assessment from the share of query content words it contains."""
+    query_words = _content_words(query)
+    scores = []
+    for text in assessments:
+        if not query_words:
+            scores.append(1)
+            continue
+        overlap = len(query_words & _content_words(text)) / len(query_words)
+        scores.append(1 + min(4, int(overlap * 8)))
+    return scores
+
+
+# ================== CHAT MODEL ==================
+class _StructuredFake:
+    """What `FakeChatModel.with_structured_output` returns."""
+
+    def __init__(self, model: "FakeChatModel", schema, include_raw: bool):
+        self.model = model
+        self.schema = schema
+        self.include_raw = include_raw
+
+    def _answer(self, prompt):
+        prompt = _prompt_text(prompt)
+        fields = self.schema.model_fields
+        if "domains" not in fields and "scores" not in fields:
+            raise NotImplementedError(f"No fake response for schema {self.schema.__name__}")
+        query = _prompt_query(prompt)
+        data: Dict = {}
+        if "domains" in fields:
+            data["domains"] = classify_intent(query)
+            data.update({k: v for k, v in extract_constraints(query).items() if k in fields})
+        if "scores" in fields:
+            data["scores"] = heuristic_scores(query, _prompt_assessments(prompt))
+
+        parsed = self.schema.model_validate(data)
+        if not self.include_raw:
+            return parsed
+        content = json.dumps(data)
+        input_tokens, output_tokens = len(words(prompt)), len(words(content))
+        raw = AIMessage(
+            content=content,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+        )
+        return {"raw": raw, "parsed": parsed, "parsing_error": None}
+
+    def invoke(self, prompt):
+        if self.model.latency_seconds:
+            time.sleep(self.model.latency_seconds)
+        return self._answer(prompt)
+
+    async def ainvoke(self, prompt):
+        if self.model.latency_seconds:
+            await asyncio.sleep(self.model.latency_seconds)
+        return self._answer(prompt)
+
+
+class FakeChatModel:
+    """Rule-based stand-in for `ChatOpenAI` covering the structured-output calls."""
+
+    def __init__(self, model_name: str = FAKE_LLM_MODEL, latency_seconds: float = 0.0):
+        self.model_name = model_name
+        self.latency_seconds = latency_seconds
+
+    def with_structured_output(self, schema, include_raw: bool = False) -> _StructuredFake:
+        return _StructuredFake(self, schema, include_raw)
@@ -6,27 +6,31 @@ Query,Assessment_url
 Query 1,Recommendation 1 (URL)
 Query 1,Recommendation 2 (URL)
 ...
+
+Queries run on a bounded worker pool and every finished query is appended
+to a JSON-lines checkpoint next to the output. Re-running the same command
+after a failure resumes from the checkpoint and only runs what is missing;
+the CSV is always written in input order. The checkpoint's first line
+records what the results depend on (top-k, models, pipeline settings and
+the index version); a checkpoint from a run with different settings or an
+older index is discarded. It is deleted once the CSV has been written.
+
+    python rag/generate_submission.py --workers 8
 """
 
-from typing import List
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
 
 import pandas as pd
 
-from retriever import recommend
-
+from retriever import get_engine, index_version, recommend
 
-def generate_submission(
-    input_queries_csv: str,
-    output_csv: str,
-    top_k: int = 7,
-) -> None:
-    """
-    Read an unlabeled test CSV containing queries and write predictions
-    in the required two‑column format:
 
-    - Input CSV must have a column named either `Query` or `query`.
-    - Output CSV will have columns: `Query`, `Assessment_url`.
-    """
+def _read_queries(input_queries_csv: str) -> List[str]:
+    """Non-empty queries from a CSV with a `Query` or `query` column, in file order."""
     df = pd.read_csv(input_queries_csv)
 
     # Normalise column name
@@ -38,32 +42,141 @@ def generate_submission(
     if query_col is None:
         raise ValueError("Input CSV must contain a `Query` or `query` column.")
 
-    rows: List[dict] = []
+    queries = [str(q).strip() for q in df[query_col]]
+    return [q for q in queries if q]
 
-    for _, row in df.iterrows():
-        q = str(row[query_col]).strip()
-        if not q:
-            continue
 
-        rec_output = recommend(q)
-        recs = rec_output.get("recommended_assessments", [])[:top_k]
+def _run_params(top_k: int) -> Dict:
+    """Everything a result depends on besides its query, as stored in the checkpoint header."""
+    engine = get_engine()
+    return {
+        "top_k": top_k,
+        "llm_model": engine.llm.model_name,
+        "embedding_model": engine.embedding_model,
+        "backend": engine.backend,
+        "retrieval_mode": engine.retrieval_mode,
+        "reranker": engine.reranker,
+        "pipeline": engine.pipeline,
+        "index_version": index_version(engine.persist_dir),
+    }
 
-        for rec in recs:
-            url = rec.get("url") or ""
-            if not url:
+
+def _load_checkpoint(path: str, queries: List[str], params: Dict) -> Optional[Dict[int, List[str]]]:
+    """
+    Completed results from a previous run, keyed by query position, or None
+    if there is no checkpoint or its header does not match `params`.
+
+    Lines whose query no longer matches the input at that position are
+    ignored, as is a truncated last line from an interrupted write.
+    """
+    if not os.path.exists(path):
+        return None
+    done: Dict[int, List[str]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        try:
+            header = json.loads(f.readline())
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(header, dict) or header.get("params") != params:
+            return None
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
                 continue
-            rows.append({"Query": q, "Assessment_url": url})
+            idx = record.get("index")
+            if isinstance(idx, int) and 0 <= idx < len(queries) and record.get("query") == queries[idx]:
+                done[idx] = record.get("urls", [])
+    return done
 
+
+def generate_submission(
+    input_queries_csv: str,
+    output_csv: str,
+    top_k: int = 7,
+    workers: int = 4,
+    checkpoint_path: Optional[str] = None,
+) -> None:
+    """
+    Read an unlabeled test CSV containing queries and write predictions
+    in the required two‑column format:
+
+    - Input CSV must have a column named either `Query` or `query`.
+    - Output CSV will have columns: `Query`, `Assessment_url`.
+    - Progress is checkpointed to `checkpoint_path` (default:
+      `<output_csv>.checkpoint.jsonl`); queries already in it are skipped
+      if it was written with the same settings and index, and it is
+      removed after the output is written.
+    """
+    queries = _read_queries(input_queries_csv)
+    checkpoint_path = checkpoint_path or f"{output_csv}.checkpoint.jsonl"
+
+    params = _run_params(top_k)
+    done = _load_checkpoint(checkpoint_path, queries, params)
+    resume = done is not None
+    if not resume:
+        if os.path.exists(checkpoint_path):
+            print(f"♻️ Discarding {checkpoint_path}: written with other settings or an older index.")
+        done = {}
+    pending = [i for i in range(len(queries)) if i not in done]
+    print(f"▶️ {len(queries)} queries: {len(done)} from checkpoint, {len(pending)} to run.")
+
+    def run_one(idx: int) -> Tuple[int, List[str]]:
+        rec_output = recommend(queries[idx], top_k)
+        recs = rec_output.get("recommended_assessments", [])
+        return idx, [rec.get("url") for rec in recs if rec.get("url")]
+
+    failures: List[Tuple[int, str]] = []
+    with open(checkpoint_path, "a" if resume else "w", encoding="utf-8") as ckpt, ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        if not resume:
+            ckpt.write(json.dumps({"params": params}) + "\n")
+            ckpt.flush()
+        futures = {pool.submit(run_one, idx): idx for idx in pending}
+        for future in as_completed(futures):
+            idx = futures[future]
+            try:
+                _, urls = future.result()
+            except Exception as exc:
+                failures.append((idx, f"{type(exc).__name__}: {exc}"))
+                print(f"⚠️ Query {idx} failed: {exc}")
+                continue
+            done[idx] = urls
+            # Results are written from this thread only, one durable line each
+            record = {"index": idx, "query": queries[idx], "urls": urls}
+            ckpt.write(json.dumps(record, ensure_ascii=False) + "\n")
+            ckpt.flush()
+            os.fsync(ckpt.fileno())
+
+    if failures:
+        raise RuntimeError(
+            f"{len(failures)} of {len(queries)} queries failed; completed results are in "
+            f"{checkpoint_path}. Re-run to resume."
+        )
+
+    rows = [
+        {"Query": queries[idx], "Assessment_url": url}
+        for idx in range(len(queries))
+        for url in done[idx]
+    ]
     out_df = pd.DataFrame(rows, columns=["Query", "Assessment_url"])
     out_df.to_csv(output_csv, index=False)
+    os.remove(checkpoint_path)
     print(f"✅ Submission file written to {output_csv} with {len(out_df)} rows.")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the submission CSV.")
+    parser.add_argument("--input", default="data/unlabeled_test_queries.csv")
+    parser.add_argument("--output", default="submission.csv")
+    parser.add_argument("--top-k", type=int, default=7)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--checkpoint", default=None, help="Defaults to <output>.checkpoint.jsonl")
+    args = parser.parse_args()
+
     generate_submission(
-        input_queries_csv="data/unlabeled_test_queries.csv",
-        output_csv="submission.csv",
-        top_k=7,
+        input_queries_csv=args.input,
+        output_csv=args.output,
+        top_k=args.top_k,
+        workers=args.workers,
+        checkpoint_path=args.checkpoint,
     )
-
-
@@ -0,0 +1,289 @@
+"""
+Per-request tracing for the recommendation pipeline.
+
+A `Trace` collects wall time per pipeline stage plus counters for external
+calls and LLM tokens. The active trace lives in a context variable, so the
+pipeline records into it without threading an argument through every
+function; `tracing()` installs one for the duration of a block:
+
+    with tracing() as trace:
+        engine.recommend(query)
+    trace.to_dict()  # {"stages_ms": {...}, "calls": {...}, "tokens": {...}}
+
+Worker threads started with `run_in_context` record into the caller's
+trace; asyncio tasks and `asyncio.to_thread` inherit it automatically.
+
+Each `stage()` is also kept as a span (name, offset and duration within the
+request) and, with `OTEL_SPANS=1` and OpenTelemetry installed, opened as an
+OpenTelemetry span so an exporter configured by the host process sees it.
+
+`METRICS` aggregates finished traces process-wide and renders them in the
+Prometheus text format (served by api.py at GET /metrics).
+"""
+
+import contextvars
+import os
+import statistics
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:  # optional: spans are exported only if the host configured an SDK
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+STAGES = ["cache", "intent", "embedding", "search", "balancing", "scoring"]
+
+OTEL_SPANS = os.getenv("OTEL_SPANS", "0") == "1"
+_tracer = otel_trace.get_tracer("shl-recommender") if otel_trace is not None and OTEL_SPANS else None
+
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar(
+    "recommender_trace", default=None
+)
+
+
+class Trace:
+    """Stage timings and counters for one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.spans: List[Tuple[str, float, float]] = []
+        self.calls: Counter = Counter()
+        self.tokens: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, seconds: float, start: Optional[float] = None) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+            if start is not None:
+                self.spans.append((name, start - self.started, seconds))
+
+    def add_call(self, kind: str, n: int = 1) -> None:
+        with self._lock:
+            self.calls[kind] += n
+
+    def add_tokens(self, input_tokens: int = 0, output_tokens: int = 0, cached_input_tokens: int = 0) -> None:
+        with self._lock:
+            self.tokens["input"] += input_tokens
+            self.tokens["output"] += output_tokens
+            self.tokens["cached_input"] += cached_input_tokens
+
+    def to_dict(self, spans: bool = False) -> Dict:
+        with self._lock:
+            out = {
+                "stages_ms": {name: secs * 1000 for name, secs in self.stages.items()},
+                "calls": dict(self.calls),
+                "tokens": {
+                    "input": self.tokens["input"],
+                    "output": self.tokens["output"],
+                    "total": self.tokens["input"] + self.tokens["output"],
+                    # Input tokens the provider served from its prompt-prefix cache
+                    "cached_input": self.tokens["cached_input"],
+                },
+            }
+            if spans:
+                out["spans"] = [
+                    {"name": name, "start_ms": offset * 1000, "duration_ms": secs * 1000}
+                    for name, offset, secs in sorted(self.spans, key=lambda s: s[1])
+                ]
+            return out
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def tracing(trace: Optional[Trace] = None) -> Iterator[Trace]:
+    """Make `trace` (or a new one) the active trace inside the block."""
+    trace = trace or Trace()
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a pipeline stage into the active trace (no-op without one or a tracer)."""
+    trace = _current.get()
+    if trace is None and _tracer is None:
+        yield
+        return
+    start = time.perf_counter()
+    span = _tracer.start_as_current_span(f"recommend.{name}") if _tracer is not None else nullcontext()
+    try:
+        with span:
+            yield
+    finally:
+        if trace is not None:
+            trace.add_stage(name, time.perf_counter() - start, start)
+
+
+def record_call(kind: str, n: int = 1) -> None:
+    trace = _current.get()
+    if trace is not None:
+        trace.add_call(kind, n)
+
+
+def record_tokens(message) -> None:
+    """Add the token usage reported on a LangChain chat message, if any."""
+    trace = _current.get()
+    usage = getattr(message, "usage_metadata", None)
+    if trace is not None and usage:
+        trace.add_tokens(
+            usage.get("input_tokens", 0),
+            usage.get("output_tokens", 0),
+            (usage.get("input_token_details") or {}).get("cache_read", 0),
+        )
+
+
+def debug_timings(trace: Trace) -> Dict:
+    """The opt-in `debug_timings` block of a response: wall time, stages, spans, calls and tokens."""
+    return {"total_ms": (time.perf_counter() - trace.started) * 1000, **trace.to_dict(spans=True)}
+
+
+def run_in_context(executor, fn, *args, **kwargs):
+    """`executor.submit` that carries the caller's context (and trace) into the worker."""
+    ctx = contextvars.copy_context()
+    return executor.submit(ctx.run, fn, *args, **kwargs)
+
+
+# ================== SUMMARIES ==================
+def percentile(xs: List[float], pct: float) -> float:
+    if not xs:
+        return 0.0
+    ordered = sorted(xs)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def latency_summary(samples_ms: List[float]) -> Dict[str, float]:
+    """Mean, p50, p95 and p99 of a list of millisecond samples."""
+    return {
+        "mean_ms": statistics.mean(samples_ms) if samples_ms else 0.0,
+        "p50_ms": percentile(samples_ms, 50),
+        "p95_ms": percentile(samples_ms, 95),
+        "p99_ms": percentile(samples_ms, 99),
+    }
+
+
+# ================== METRICS ==================
+LATENCY_BUCKETS_SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in seconds (Prometheus semantics)."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS_SECONDS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.sum += seconds
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+
+
+def _labels(**labels: str) -> str:
+    body = ",".join(f'{k}="{str(v)}"' for k, v in labels.items())
+    return "{" + body + "}" if body else ""
+
+
+class MetricsRegistry:
+    """
+    Process-wide aggregate of finished requests.
+
+    `observe_request` folds one request's trace into per-endpoint and
+    per-stage latency histograms and call/token counters; `render` emits
+    them, plus any cache hit/miss counts passed in, as Prometheus text.
+    """
+
+    def __init__(self, prefix: str = "shl_recommender"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.requests: Counter = Counter()
+        self.request_latency: Dict[str, Histogram] = {}
+        self.stage_latency: Dict[str, Histogram] = {}
+        self.calls: Counter = Counter()
+        self.tokens: Counter = Counter()
+
+    def observe_request(self, endpoint: str, seconds: float, trace: Optional[Trace] = None, status: str = "ok") -> None:
+        data = trace.to_dict() if trace is not None else None
+        with self._lock:
+            self.requests[(endpoint, status)] += 1
+            self.request_latency.setdefault(endpoint, Histogram()).observe(seconds)
+            if data is None:
+                return
+            for name, ms in data["stages_ms"].items():
+                self.stage_latency.setdefault(name, Histogram()).observe(ms / 1000)
+            self.calls.update(data["calls"])
+            self.tokens["input"] += data["tokens"]["input"]
+            self.tokens["output"] += data["tokens"]["output"]
+            self.tokens["cached_input"] += data["tokens"]["cached_input"]
+
+    def _histogram_lines(self, name: str, label: str, histograms: Dict[str, Histogram]) -> List[str]:
+        lines = []
+        for key, h in sorted(histograms.items()):
+            for bound, count in zip(h.buckets, h.counts):
+                lines.append(f"{name}_bucket{_labels(**{label: key, 'le': bound})} {count}")
+            lines.append(f"{name}_bucket{_labels(**{label: key, 'le': '+Inf'})} {h.count}")
+            lines.append(f"{name}_sum{_labels(**{label: key})} {h.sum}")
+            lines.append(f"{name}_count{_labels(**{label: key})} {h.count}")
+        return lines
+
+    def render(self, caches: Optional[Dict[str, Dict[str, int]]] = None) -> str:
+        """
+        Prometheus text exposition format. `caches` maps a cache name to its
+        `{"hits": n, "misses": n}`, read at scrape time from the engine.
+        """
+        p = self.prefix
+        lines: List[str] = []
+
+        def metric(name: str, kind: str, help_text: str, samples: List[str]) -> None:
+            lines.append(f"# HELP {p}_{name} {help_text}")
+            lines.append(f"# TYPE {p}_{name} {kind}")
+            lines.extend(samples)
+
+        with self._lock:
+            metric("requests_total", "counter", "Requests handled, by endpoint and outcome.", [
+                f"{p}_requests_total{_labels(endpoint=e, status=s)} {n}"
+                for (e, s), n in sorted(self.requests.items())
+            ])
+            metric("request_duration_seconds", "histogram", "End-to-end request latency.",
+                   self._histogram_lines(f"{p}_request_duration_seconds", "endpoint", self.request_latency))
+            metric("stage_duration_seconds", "histogram", "Time per pipeline stage within a request.",
+                   self._histogram_lines(f"{p}_stage_duration_seconds", "stage", self.stage_latency))
+            metric("external_calls_total", "counter", "Embedding, LLM and vector-search calls, by kind.", [
+                f"{p}_external_calls_total{_labels(kind=k)} {n}" for k, n in sorted(self.calls.items())
+            ])
+            metric("llm_tokens_total", "counter", "LLM tokens, by direction.", [
+                f"{p}_llm_tokens_total{_labels(direction=d)} {self.tokens[d]}"
+                for d in ("input", "output", "cached_input")
+            ])
+
+        caches = caches or {}
+        metric("cache_hits_total", "counter", "Cache hits, by cache.", [
+            f"{p}_cache_hits_total{_labels(cache=c)} {s['hits']}" for c, s in sorted(caches.items())
+        ])
+        metric("cache_misses_total", "counter", "Cache misses, by cache.", [
+            f"{p}_cache_misses_total{_labels(cache=c)} {s['misses']}" for c, s in sorted(caches.items())
+        ])
+        metric("cache_hit_ratio", "gauge", "Hits over lookups since process start, by cache.", [
+            f"{p}_cache_hit_ratio{_labels(cache=c)} "
+            f"{s['hits'] / (s['hits'] + s['misses']) if s['hits'] + s['misses'] else 0.0}"
+            for c, s in sorted(caches.items())
+        ])
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
@@ -0,0 +1,263 @@
+"""
+Precomputed query intents for recurring job-role archetypes.
+
+Most traffic asks for a few hundred recurring roles ("Java developer",
+"sales associate", "bank admin"), and intent detection returns the same
+domains for them every time. This module keeps a small library of canonical
+role descriptions, each embedded once offline together with the intent the
+LLM detected for it:
+
+    python rag/intent_templates.py build [--roles data/role_templates.txt]
+    python rag/intent_templates.py stats
+
+The role descriptions come from data/role_templates.txt (one per line, `#`
+starts a comment), deliberately not from data/train_queries.csv: that file
+is the evaluation set, and templates built from it would let evaluation
+queries answer themselves. At request time `IntentTemplates.lookup` first
+checks whether the query is a template's text (case and spacing aside),
+which needs no embedding, then compares the query vector with the template
+matrix and returns the nearest template's intent when the cosine
+similarity clears the threshold. The engine checks the text before any
+network call, so a verbatim role costs no LLM call; otherwise it starts the
+LLM intent call alongside embedding and cancels it on a vector match.
+
+Only the domains, which follow from the role alone, are reused. Seniority,
+duration, remote and adaptive requirements belong to the individual query,
+so a query that states any of them is always sent to the LLM.
+
+Files (in `directory`):
+- `templates.npy`: unit-normalised float32 vectors, one row per template
+- `templates.json`: the embedding model plus each template's text and intent
+"""
+
+import argparse
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:  # imported as part of the `rag` package
+    from rag.query_cache import normalize_query
+except ImportError:  # run as a script from rag/
+    from query_cache import normalize_query
+
+DEFAULT_DIR = "vectorstore/intent_templates"
+VECTORS_FILE = "templates.npy"
+META_FILE = "templates.json"
+
+DEFAULT_ROLES = "data/role_templates.txt"
+
+# QueryIntent fields that depend on the role alone
+ROLE_FIELDS = ("domains",)
+
+# A stated duration, remote, adaptive or seniority requirement (checked before
+# any lookup). Seniority is only read from level words and years of
+# experience, never from job titles such as "manager" or "executive", which
+# are part of the role itself.
+_CONSTRAINT_CUE_RE = re.compile(
+    r"\d+\s*(?:-|to)?\s*\d*\s*(?:min|hour|hr)|\bhours?\b|\bremote|\badaptive|\birt\b"
+    r"|\b(?:senior|junior|entry[\s-]level|graduates?|fresher|intern|mid[\s-]level|mid[\s-]professional"
+    r"|experienced|managerial)\b"
+    r"|\d+\+?\s*years?\s+(?:of\s+)?(?:\w+\s+){0,2}experience|\bexperience\b[^.\n]{0,30}?\d+\+?\s*years?",
+    re.IGNORECASE,
+)
+
+
+def states_constraints(query: str) -> bool:
+    """Whether the query appears to state a duration, remote, adaptive or seniority requirement."""
+    return bool(_CONSTRAINT_CUE_RE.search(query or ""))
+
+
+def _unit_rows(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+
+class IntentTemplates:
+    """
+    Nearest-neighbour intent lookup over a fixed template library.
+
+    Args:
+        texts: Canonical role descriptions.
+        intents: Intent of each description (only ROLE_FIELDS are kept).
+        vectors: Embeddings of `texts` (normalised here).
+        model: Embedding model the vectors come from.
+        similarity_threshold: Cosine similarity a query needs to reuse a
+            template's intent.
+    """
+
+    def __init__(
+        self,
+        texts: List[str],
+        intents: List[Dict],
+        vectors,
+        model: str,
+        similarity_threshold: float = 0.9,
+    ):
+        if len(texts) != len(intents) or len(texts) != len(vectors):
+            raise ValueError("texts, intents and vectors must have the same length")
+        self.texts = list(texts)
+        # First template wins for texts that normalise the same
+        self._rows_by_text: Dict[str, int] = {}
+        for row, text in enumerate(self.texts):
+            self._rows_by_text.setdefault(normalize_query(text), row)
+        self.intents = [{k: intent.get(k) for k in ROLE_FIELDS} for intent in intents]
+        self.vectors = _unit_rows(vectors) if len(texts) else np.zeros((0, 0), dtype=np.float32)
+        self.model = model
+        self.similarity_threshold = similarity_threshold
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    # ---------- lookup ----------
+    def lookup(self, query: str, query_vector: Optional[List[float]] = None) -> Optional[Dict]:
+        """
+        Role-level intent fields of the template whose text is the query or,
+        given the query vector, of the closest template; None on a miss.
+        Without a vector a miss is not final, so it is not counted.
+        """
+        match = None
+        if len(self) and not states_constraints(query):
+            row = self._rows_by_text.get(normalize_query(query))
+            if row is None and query_vector is not None:
+                vec = _unit_rows(query_vector)[0]
+                if vec.shape[0] == self.vectors.shape[1]:
+                    sims = self.vectors @ vec
+                    best = int(np.argmax(sims))
+                    if sims[best] >= self.similarity_threshold:
+                        row = best
+            if row is not None:
+                match = dict(self.intents[row])
+        if match is None and query_vector is None:
+            return None
+        with self._lock:
+            if match is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return match
+
+    # ---------- persistence ----------
+    def save(self, directory: str = DEFAULT_DIR) -> None:
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, VECTORS_FILE), self.vectors)
+        meta = {
+            "model": self.model,
+            "templates": [{"text": t, "intent": i} for t, i in zip(self.texts, self.intents)],
+        }
+        # Metadata last: a library without it is treated as absent
+        with open(os.path.join(directory, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2, ensure_ascii=False)
+
+    @classmethod
+    def load(
+        cls,
+        directory: str,
+        model: str,
+        similarity_threshold: float = 0.9,
+    ) -> Optional["IntentTemplates"]:
+        """
+        The library saved in `directory`, or None if there is none or it was
+        embedded with a different model (its vectors are not comparable).
+        """
+        try:
+            with open(os.path.join(directory, META_FILE), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            vectors = np.load(os.path.join(directory, VECTORS_FILE))
+        except FileNotFoundError:
+            return None
+        if meta.get("model") != model:
+            return None
+        templates = meta["templates"]
+        return cls(
+            [t["text"] for t in templates],
+            [t["intent"] for t in templates],
+            vectors,
+            model,
+            similarity_threshold,
+        )
+
+
+# ================== OFFLINE BUILD ==================
+def read_roles(roles_path: str = DEFAULT_ROLES) -> List[str]:
+    """Unique role descriptions, one per non-empty, non-comment line of `roles_path`."""
+    roles: List[str] = []
+    with open(roles_path, "r", encoding="utf-8") as f:
+        for line in f:
+            role = line.split("#", 1)[0].strip()
+            if role and role not in roles:
+                roles.append(role)
+    return roles
+
+
+def build_templates(
+    roles_path: str = DEFAULT_ROLES,
+    directory: str = DEFAULT_DIR,
+    workers: int = 8,
+) -> IntentTemplates:
+    """
+    Label every role description with the LLM intent detector, embed it, and
+    save the library. Roles whose intent names no domain are left out, as
+    are roles that state a constraint themselves: `lookup` would never
+    return them.
+    Labels and vectors go through the engine's LLM and embedding caches, so
+    a rebuild only pays for new roles.
+    """
+    # Imported here: retriever.py imports this module
+    try:
+        from rag.retriever import RecommenderEngine, detect_query_intent
+    except ImportError:
+        from retriever import RecommenderEngine, detect_query_intent
+
+    texts = read_roles(roles_path)
+    engine = RecommenderEngine()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            intents = list(pool.map(lambda t: detect_query_intent(t, engine.llm, engine.llm_store), texts))
+        kept = [(t, i) for t, i in zip(texts, intents) if i.domains and not states_constraints(t)]
+        vectors = engine.embeddings.embed_documents([t for t, _ in kept]) if kept else []
+        templates = IntentTemplates(
+            [t for t, _ in kept],
+            [i.model_dump(include=set(ROLE_FIELDS)) for _, i in kept],
+            vectors,
+            engine.embedding_model,
+        )
+    finally:
+        engine.close()
+    templates.save(directory)
+    print(f"✅ {len(templates)} intent templates written to {directory} ({len(texts) - len(kept)} skipped)")
+    return templates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or inspect the intent template library.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_build = sub.add_parser("build", help="Label, embed and save the template library")
+    p_build.add_argument("--roles", default=DEFAULT_ROLES, help="Role descriptions, one per line")
+    p_build.add_argument("--dir", default=DEFAULT_DIR)
+    p_build.add_argument("--workers", type=int, default=8)
+
+    p_stats = sub.add_parser("stats", help="Show the saved library")
+    p_stats.add_argument("--dir", default=DEFAULT_DIR)
+
+    args = parser.parse_args()
+    if args.command == "build":
+        build_templates(args.roles, args.dir, args.workers)
+    elif args.command == "stats":
+        with open(os.path.join(args.dir, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        print(f"Library: {args.dir}  model={meta['model']}  templates={len(meta['templates'])}")
+        for t in meta["templates"]:
+            print(f"{', '.join(t['intent']['domains']):<60}  {t['text'][:70]}")
@@ -0,0 +1,126 @@
+"""
+Okapi BM25 over the assessment catalog, computed locally on CPU.
+
+`words` / `tokenize` are the project's one tokenizer; the offline fake
+models in rag/fake_models.py use them too.
+
+Used in two places in rag/retriever.py:
+- as a drop-in replacement for the LLM scoring call (`RERANKER="bm25"`):
+  candidates are scored against the query with catalog-wide term
+  statistics and bucketed onto the same 1–5 scale the LLM returns;
+- as the lexical half of hybrid retrieval (`RETRIEVAL_MODE="hybrid"`):
+  an inverted index with precomputed per-posting term weights scores the
+  whole catalog in a few vectorised additions per query term.
+"""
+
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9+#.]*")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "for", "from",
+    "has", "have", "i", "in", "is", "it", "its", "looking", "my", "need",
+    "of", "on", "or", "our", "that", "the", "their", "this", "to", "want",
+    "we", "who", "will", "with", "you", "your",
+}
+
+
+def words(text: str) -> List[str]:
+    """Lower-cased word tokens; keeps `c++`, `c#` and `.net` intact, drops a trailing full stop."""
+    return [w for w in (t.rstrip(".") for t in _TOKEN_RE.findall((text or "").lower())) if w]
+
+
+def tokenize(text: str) -> List[str]:
+    """`words` without stopwords."""
+    return [w for w in words(text) if w not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Term statistics of a corpus for Okapi BM25 scoring.
+
+    Args:
+        texts: The corpus (one text per catalog row).
+        k1: Term-frequency saturation.
+        b: Document-length normalisation.
+    """
+
+    def __init__(self, texts: List[str], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        docs = [tokenize(t) for t in texts]
+        self.num_docs = len(docs)
+        self.avgdl = (sum(len(d) for d in docs) / len(docs)) if docs else 1.0
+
+        doc_freq: Counter = Counter()
+        for tokens in docs:
+            doc_freq.update(set(tokens))
+        self.idf: Dict[str, float] = {
+            term: math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+            for term, df in doc_freq.items()
+        }
+
+        # Inverted index in CSR layout: the postings of term `t` are
+        # rows/weights[indptr[t]:indptr[t + 1]], each weight the idf-scaled BM25
+        # term weight. Everything except the query is known up front, so
+        # scoring a query is one gather and one bincount over its postings.
+        self._term_ids: Dict[str, int] = {term: i for i, term in enumerate(self.idf)}
+        postings: List[List[Tuple[int, float]]] = [[] for _ in self._term_ids]
+        for row, tokens in enumerate(docs):
+            for term, tf in Counter(tokens).items():
+                postings[self._term_ids[term]].append((row, self.idf[term] * self._term_weight(tf, len(tokens))))
+        self._indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in postings], out=self._indptr[1:])
+        flat = [entry for p in postings for entry in p]
+        self._rows = np.fromiter((r for r, _ in flat), dtype=np.int64, count=len(flat))
+        self._weights = np.fromiter((w for _, w in flat), dtype=np.float64, count=len(flat))
+
+    def _term_weight(self, tf: float, doc_len: float) -> float:
+        return tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * doc_len / (self.avgdl or 1.0)))
+
+    def score_text(self, query: str, text: str) -> float:
+        """BM25 score of one text for the query, using the corpus statistics."""
+        counts = Counter(tokenize(text))
+        doc_len = sum(counts.values())
+        return sum(
+            self.idf.get(term, 0.0) * self._term_weight(counts[term], doc_len)
+            for term in set(tokenize(query))
+            if term in counts
+        )
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every corpus row for the query (0 where no term matches)."""
+        ids = np.fromiter(
+            {self._term_ids[t] for t in tokenize(query) if t in self._term_ids}, dtype=np.int64
+        )
+        starts, ends = self._indptr[ids], self._indptr[ids + 1]
+        lengths = ends - starts
+        # Positions of every posting of every query term, without a Python loop
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        positions = offsets + np.arange(offsets.size)
+        return np.bincount(self._rows[positions], weights=self._weights[positions], minlength=self.num_docs)
+
+    def top(self, query: str, n: int) -> List[int]:
+        """Rows of the `n` best-scoring documents that match at least one query term."""
+        scores = self.scores(query)
+        matched = np.flatnonzero(scores > 0)
+        order = matched[np.argsort(-scores[matched], kind="stable")]
+        return order[:n].tolist()
+
+    def rerank_scores(self, query: str, texts: List[str]) -> List[int]:
+        """
+        1–5 relevance per text, scaled against the best text in the list.
+
+        Equal buckets keep their input (retrieval) order downstream; if no
+        text shares a term with the query every text gets 3.
+        """
+        raw = [self.score_text(query, t) for t in texts]
+        best = max(raw, default=0.0)
+        if best <= 0:
+            return [3] * len(texts)
+        return [1 + round(4 * s / best) for s in raw]
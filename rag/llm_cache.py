@@ -0,0 +1,267 @@
+"""
+Persistent, content-addressed store for structured LLM responses.
+
+Intent detection and scoring run at temperature 0, so a response is fully
+determined by the model, the prompt and the output schema. Responses are
+keyed on exactly those three things and kept in a local SQLite file, so
+repeat offline runs and warm restarts skip the network entirely.
+
+CLI (run from the project root):
+    python rag/llm_cache.py stats
+    python rag/llm_cache.py prune --older-than-days 30 [--model M] [--schema S]
+    python rag/llm_cache.py export out.jsonl [--model M] [--schema S]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+DEFAULT_PATH = "vectorstore/llm_cache.sqlite3"
+
+# Hit counters and last-use times are kept in memory and written in one
+# transaction after this many hits or seconds, so a cache hit is a read only
+HIT_FLUSH_EVERY = 64
+HIT_FLUSH_SECONDS = 30.0
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS responses (
+    model        TEXT NOT NULL,
+    schema       TEXT NOT NULL,
+    prompt_hash  TEXT NOT NULL,
+    prompt       TEXT NOT NULL,
+    response     TEXT NOT NULL,
+    created_at   REAL NOT NULL,
+    last_used_at REAL NOT NULL,
+    hits         INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (model, schema, prompt_hash)
+)
+"""
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def schema_key(schema: Type[BaseModel]) -> str:
+    """Schema name plus a short hash of its JSON schema, so edits invalidate old rows."""
+    spec = json.dumps(schema.model_json_schema(), sort_keys=True)
+    return f"{schema.__name__}:{hashlib.sha256(spec.encode('utf-8')).hexdigest()[:12]}"
+
+
+class LLMResponseStore:
+    """
+    SQLite-backed response store shared by threads (and, via WAL, by processes).
+
+    `get`/`put` take the parsed pydantic schema class and return/accept
+    instances of it, so callers never see the serialised form. `get` does
+    not write: hit counts are batched (see HIT_FLUSH_EVERY) and flushed by
+    a later lookup, the maintenance methods and `close()`.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(_SCHEMA_SQL)
+        self._conn.commit()
+        self._schema_keys: Dict[Type[BaseModel], str] = {}
+        # (model, schema, prompt_hash) -> [unflushed hits, last use]
+        self._pending_hits: Dict[Tuple[str, str, str], List[float]] = {}
+        self._unflushed_hits = 0
+        self._last_flush = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+
+    def _schema_key(self, schema: Type[BaseModel]) -> str:
+        key = self._schema_keys.get(schema)
+        if key is None:
+            key = self._schema_keys[schema] = schema_key(schema)
+        return key
+
+    def get(self, model: str, schema: Type[BaseModel], prompt: str) -> Optional[BaseModel]:
+        key = (model, self._schema_key(schema), prompt_hash(prompt))
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE model=? AND schema=? AND prompt_hash=?",
+                key,
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            pending = self._pending_hits.setdefault(key, [0, 0.0])
+            pending[0] += 1
+            pending[1] = time.time()
+            self.hits += 1
+            self._unflushed_hits += 1
+            if (
+                self._unflushed_hits >= HIT_FLUSH_EVERY
+                or time.monotonic() - self._last_flush >= HIT_FLUSH_SECONDS
+            ):
+                self._flush_hits_locked()
+        return schema.model_validate_json(row[0])
+
+    def flush_hits(self) -> None:
+        """Write the batched hit counts and last-use times."""
+        with self._lock:
+            self._flush_hits_locked()
+
+    def _flush_hits_locked(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._pending_hits:
+            return
+        self._conn.executemany(
+            "UPDATE responses SET hits = hits + ?, last_used_at = MAX(last_used_at, ?) "
+            "WHERE model=? AND schema=? AND prompt_hash=?",
+            [(n, used, *key) for key, (n, used) in self._pending_hits.items()],
+        )
+        self._conn.commit()
+        self._pending_hits.clear()
+        self._unflushed_hits = 0
+
+    def put(self, model: str, schema: Type[BaseModel], prompt: str, response: BaseModel) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(model, schema, prompt_hash, prompt, response, created_at, last_used_at, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                (
+                    model,
+                    self._schema_key(schema),
+                    prompt_hash(prompt),
+                    prompt,
+                    response.model_dump_json(),
+                    now,
+                    now,
+                ),
+            )
+            self._conn.commit()
+
+    # ---------- maintenance (used by the CLI) ----------
+    def stats(self) -> Dict:
+        with self._lock:
+            self._flush_hits_locked()
+            rows = self._conn.execute(
+                "SELECT model, schema, COUNT(*), SUM(hits), SUM(LENGTH(prompt) + LENGTH(response)) "
+                "FROM responses GROUP BY model, schema ORDER BY model, schema"
+            ).fetchall()
+        return {
+            "path": self.path,
+            "groups": [
+                {"model": m, "schema": s, "entries": n, "hits": h or 0, "bytes": b or 0}
+                for m, s, n, h, b in rows
+            ],
+        }
+
+    def _where(self, model: Optional[str], schema: Optional[str], older_than: Optional[float]):
+        clauses, params = [], []
+        if model:
+            clauses.append("model = ?")
+            params.append(model)
+        if schema:
+            # Match on the schema name with or without its hash suffix
+            clauses.append("(schema = ? OR schema LIKE ?)")
+            params.extend([schema, f"{schema}:%"])
+        if older_than is not None:
+            clauses.append("last_used_at < ?")
+            params.append(older_than)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def prune(
+        self,
+        older_than_days: Optional[float] = None,
+        model: Optional[str] = None,
+        schema: Optional[str] = None,
+    ) -> int:
+        """Delete matching rows (by last use, model, schema); returns how many were removed."""
+        older_than = time.time() - older_than_days * 86400 if older_than_days is not None else None
+        where, params = self._where(model, schema, older_than)
+        with self._lock:
+            self._flush_hits_locked()
+            cur = self._conn.execute(f"DELETE FROM responses{where}", params)
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+        return cur.rowcount
+
+    def export(self, out_path: str, model: Optional[str] = None, schema: Optional[str] = None) -> int:
+        """Write matching rows to a JSON-lines file; returns how many were written."""
+        where, params = self._where(model, schema, None)
+        with self._lock:
+            self._flush_hits_locked()
+            rows = self._conn.execute(
+                "SELECT model, schema, prompt_hash, prompt, response, created_at, last_used_at, hits "
+                f"FROM responses{where} ORDER BY created_at",
+                params,
+            ).fetchall()
+        with open(out_path, "w", encoding="utf-8") as f:
+            for m, s, h, p, r, created, used, hits in rows:
+                record = {
+                    "model": m,
+                    "schema": s,
+                    "prompt_hash": h,
+                    "prompt": p,
+                    "response": json.loads(r),
+                    "created_at": created,
+                    "last_used_at": used,
+                    "hits": hits,
+                }
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return len(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_hits_locked()
+            self._conn.close()
+
+
+def _main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect and maintain the LLM response store.")
+    parser.add_argument("--path", default=DEFAULT_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("stats", help="Show entry counts per model and schema")
+
+    prune = sub.add_parser("prune", help="Delete cached responses")
+    prune.add_argument("--older-than-days", type=float, default=None)
+    prune.add_argument("--model")
+    prune.add_argument("--schema")
+
+    export = sub.add_parser("export", help="Export cached responses as JSON lines")
+    export.add_argument("out")
+    export.add_argument("--model")
+    export.add_argument("--schema")
+
+    args = parser.parse_args()
+    store = LLMResponseStore(args.path)
+
+    if args.command == "stats":
+        stats = store.stats()
+        print(f"Store: {stats['path']}")
+        for g in stats["groups"]:
+            print(f"{g['model']}  {g['schema']}  entries={g['entries']}  hits={g['hits']}  bytes={g['bytes']}")
+    elif args.command == "prune":
+        if args.older_than_days is None and not args.model and not args.schema:
+            parser.error("prune needs at least one of --older-than-days, --model, --schema")
+        removed = store.prune(args.older_than_days, args.model, args.schema)
+        print(f"Removed {removed} entries")
+    elif args.command == "export":
+        written = store.export(args.out, args.model, args.schema)
+        print(f"Exported {written} entries to {args.out}")
+
+    store.close()
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,449 @@
+"""
+In-memory brute-force vector index over the persisted Chroma collection.
+
+The SHL catalog is a few hundred rows, so an exact scan is a single
+matrix-vector product and beats HNSW + SQLite + the LangChain wrapper for
+every search. `NumpyVectorStore` loads all embeddings and metadata once,
+keeps the embeddings in one contiguous float32 matrix and precomputes a
+boolean mask per `is_type_*` flag. It exposes the subset of the Chroma
+vector store interface the recommender uses, so it is a drop-in backend.
+
+Each document's A/B/C/D/E/K/P/S membership is also packed into an 8-bit
+mask (stored in `metadata["type_mask"]` too), which lets `search_by_types`
+return the per-type top-N lists for several types from one scoring pass.
+The duration / remote / adaptive fields are held as `ConstraintColumns`
+aligned with the rows, which the engine filters on for hard constraints.
+
+`to_snapshot` / `from_snapshot` persist the store as one flat file: the
+float32 embedding matrix, columnar metadata (type bitmask, duration in
+minutes, remote/adaptive flags, string-column indices) and a deduplicated
+UTF-8 string table. Loading maps the file read-only with `np.memmap`, so
+every worker process on a host shares one page-cache copy of the vectors
+and cold start does no parsing beyond the string table.
+"""
+
+import json
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+TYPE_CODES = ["A", "B", "C", "D", "E", "K", "P", "S"]
+# One bit per SHL test type, so a document's types fit in a uint8
+TYPE_BIT = {code: 1 << i for i, code in enumerate(TYPE_CODES)}
+
+
+def codes_to_mask(codes: List[str]) -> int:
+    mask = 0
+    for code in codes:
+        mask |= TYPE_BIT.get(code, 0)
+    return mask
+
+
+def metadata_type_mask(metadata: Dict) -> int:
+    """Bitmask of a document's test types from its stored `is_type_*` flags."""
+    mask = 0
+    for code, bit in TYPE_BIT.items():
+        if metadata.get(f"is_type_{code}"):
+            mask |= bit
+    return mask
+
+
+# Snapshot file, written next to the Chroma collection by rag/embeddings.py
+SNAPSHOT_FILE = "catalog.snapshot"
+SNAPSHOT_MAGIC = b"SHLSNAP1"
+_SNAPSHOT_ALIGN = 64
+# Metadata kept verbatim in the string table; a missing value is stored as -1
+SNAPSHOT_STRING_COLUMNS = [
+    "assessment_name",
+    "assessment_url",
+    "test_type_codes",
+    "duration",
+    "remote_testing",
+    "adaptive_irt",
+    "content_hash",
+]
+
+
+def duration_minutes(raw) -> int:
+    """Minutes from a stored duration ("30 minutes", "30", 30.0), or -1 if there are none."""
+    match = re.search(r"(\d+)", str(raw)) if raw is not None else None
+    return int(match.group(1)) if match else -1
+
+
+class ConstraintColumns:
+    """
+    Hard-constraint fields of a store's rows as aligned NumPy columns, so
+    the limits extracted from a query (max duration, remote, adaptive) are
+    a few vectorised comparisons over the whole catalog.
+    """
+
+    __slots__ = ("duration_minutes", "remote", "adaptive")
+
+    def __init__(self, duration_minutes: np.ndarray, remote: np.ndarray, adaptive: np.ndarray):
+        # -1 where the catalog gives no duration
+        self.duration_minutes = duration_minutes
+        self.remote = remote
+        self.adaptive = adaptive
+
+    @classmethod
+    def from_metadatas(cls, metadatas: List[Dict]) -> "ConstraintColumns":
+        return cls(
+            np.array([duration_minutes(m.get("duration")) for m in metadatas], dtype=np.int32),
+            np.array([m.get("remote_testing") == "Yes" for m in metadatas], dtype=bool),
+            np.array([m.get("adaptive_irt") == "Yes" for m in metadatas], dtype=bool),
+        )
+
+    def feasible(
+        self,
+        max_duration_minutes: Optional[int] = None,
+        remote_required: bool = False,
+        adaptive_required: bool = False,
+    ) -> Optional[np.ndarray]:
+        """
+        Row mask of the rows meeting every given constraint, or None when
+        nothing is constrained. A row without a listed duration is kept: it
+        cannot be shown to exceed the limit.
+        """
+        if max_duration_minutes is None and not remote_required and not adaptive_required:
+            return None
+        mask = np.ones(len(self.duration_minutes), dtype=bool)
+        if max_duration_minutes is not None:
+            mask &= (self.duration_minutes < 0) | (self.duration_minutes <= max_duration_minutes)
+        if remote_required:
+            mask &= self.remote
+        if adaptive_required:
+            mask &= self.adaptive
+        return mask
+
+
+def _distance_space(collection) -> str:
+    """Distance function the collection was built with ("l2", "cosine" or "ip")."""
+    metadata = collection.metadata or {}
+    if "hnsw:space" in metadata:
+        return metadata["hnsw:space"]
+    config = getattr(collection, "configuration", None) or {}
+    hnsw = config.get("hnsw") if isinstance(config, dict) else None
+    if hnsw and hnsw.get("space"):
+        return hnsw["space"]
+    return "l2"
+
+
+class NumpyVectorStore:
+    """
+    Exact nearest-neighbour search over an in-memory copy of a collection.
+
+    Ranking matches Chroma's distance function, so for the same vectors the
+    results are what an exact (non-approximate) Chroma search would return.
+    """
+
+    def __init__(
+        self,
+        embedding_function: Embeddings,
+        ids: List[str],
+        vectors: np.ndarray,
+        documents: List[Document],
+        space: str = "l2",
+        columns: Optional[Dict[str, np.ndarray]] = None,
+        normalized: bool = False,
+    ):
+        self.embeddings = embedding_function
+        self.ids = ids
+        self.documents = documents
+        self.space = space
+        self.matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+
+        # Per-row terms folded into the score so ranking is a single mat-vec.
+        # `normalized` rows (a cosine snapshot) are used as they are, so a
+        # memory-mapped matrix is not copied
+        if space == "cosine":
+            if not normalized:
+                norms = np.linalg.norm(self.matrix, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                self.matrix = np.ascontiguousarray(self.matrix / norms)
+            self._sq_norms = None
+        elif space == "l2":
+            self._sq_norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+        else:
+            self._sq_norms = None
+
+        # Columnar metadata; a snapshot passes its memory-mapped columns in
+        columns = columns or {}
+        metadatas = [d.metadata for d in documents]
+        self.type_masks = columns.get("type_mask")
+        if self.type_masks is None:
+            self.type_masks = np.array([metadata_type_mask(m) for m in metadatas], dtype=np.uint8)
+        if "duration_minutes" in columns:
+            self.constraints = ConstraintColumns(
+                columns["duration_minutes"], columns["remote"], columns["adaptive"]
+            )
+        else:
+            self.constraints = ConstraintColumns.from_metadatas(metadatas)
+        for doc, mask in zip(documents, self.type_masks):
+            doc.metadata["type_mask"] = int(mask)
+
+        self._masks: Dict[Tuple[str, object], np.ndarray] = {}
+        for code, bit in TYPE_BIT.items():
+            self._masks[(f"is_type_{code}", True)] = (self.type_masks & bit) != 0
+
+    @classmethod
+    def from_chroma(cls, vectorstore: Chroma) -> "NumpyVectorStore":
+        """Copy every embedding and metadata row out of a Chroma vector store."""
+        collection = vectorstore._collection
+        data = collection.get(include=["embeddings", "metadatas", "documents"])
+        documents = [
+            Document(id=doc_id, page_content=text or "", metadata=metadata or {})
+            for doc_id, text, metadata in zip(data["ids"], data["documents"], data["metadatas"])
+        ]
+        embeddings = data["embeddings"]
+        dim = len(embeddings[0]) if len(embeddings) else 0
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(documents), dim)
+        return cls(
+            vectorstore.embeddings,
+            list(data["ids"]),
+            vectors,
+            documents,
+            space=_distance_space(collection),
+        )
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    # ---------- snapshot ----------
+    def to_snapshot(self, path: str) -> None:
+        """
+        Write the store as a single memory-mappable file.
+
+        Written to a temporary file and renamed into place, so processes that
+        still map the previous snapshot keep a consistent view.
+        """
+        strings: Dict[str, int] = {}
+
+        def intern(value) -> int:
+            if value is None:
+                return -1
+            return strings.setdefault(str(value), len(strings))
+
+        metadatas = [d.metadata for d in self.documents]
+        sections: Dict[str, np.ndarray] = {
+            "embeddings": self.matrix,
+            "type_mask": self.type_masks,
+            "duration_minutes": self.constraints.duration_minutes,
+            "remote": self.constraints.remote.astype(np.uint8),
+            "adaptive": self.constraints.adaptive.astype(np.uint8),
+            "col_id": np.array([intern(i) for i in self.ids], dtype=np.int32),
+            "col_page_content": np.array([intern(d.page_content) for d in self.documents], dtype=np.int32),
+        }
+        for col in SNAPSHOT_STRING_COLUMNS:
+            sections[f"col_{col}"] = np.array([intern(m.get(col)) for m in metadatas], dtype=np.int32)
+
+        encoded = [s.encode("utf-8") for s in strings]
+        sections["string_offsets"] = np.cumsum([0] + [len(b) for b in encoded], dtype=np.uint64)
+        sections["string_data"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+        # Lay sections out after a fixed-size header, each one 64-byte aligned
+        layout, offset = {}, 0
+        for name, arr in sections.items():
+            offset = -(-offset // _SNAPSHOT_ALIGN) * _SNAPSHOT_ALIGN
+            layout[name] = {"offset": offset, "dtype": arr.dtype.str, "shape": list(arr.shape)}
+            offset += arr.nbytes
+        header = json.dumps(
+            {
+                "version": 1,
+                "rows": len(self.documents),
+                "dim": int(self.matrix.shape[1]) if self.matrix.ndim == 2 else 0,
+                "space": self.space,
+                # Cosine rows were unit-normalised at construction and are stored that way
+                "normalized": self.space == "cosine",
+                "string_columns": SNAPSHOT_STRING_COLUMNS,
+                "sections": layout,
+            }
+        ).encode("utf-8")
+        data_start = -(-(16 + len(header)) // _SNAPSHOT_ALIGN) * _SNAPSHOT_ALIGN
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(len(header).to_bytes(8, "little"))
+            f.write(header)
+            for name, arr in sections.items():
+                f.seek(data_start + layout[name]["offset"])
+                f.write(np.ascontiguousarray(arr).tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def from_snapshot(cls, path: str, embedding_function: Embeddings) -> "NumpyVectorStore":
+        """
+        Map a snapshot read-only; the embedding matrix is used in place, not
+        copied (snapshots written before cosine rows were stored normalised
+        are normalised into a copy).
+        """
+        with open(path, "rb") as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError(f"Not a catalog snapshot: {path}")
+            header_len = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(header_len))
+        data_start = -(-(16 + header_len) // _SNAPSHOT_ALIGN) * _SNAPSHOT_ALIGN
+
+        raw = np.memmap(path, dtype=np.uint8, mode="r")
+
+        def section(name: str) -> np.ndarray:
+            spec = header["sections"][name]
+            return np.ndarray(
+                tuple(spec["shape"]),
+                dtype=np.dtype(spec["dtype"]),
+                buffer=raw,
+                offset=data_start + spec["offset"],
+            )
+
+        offsets, blob = section("string_offsets"), section("string_data")
+        strings = [
+            bytes(blob[offsets[i]:offsets[i + 1]]).decode("utf-8")
+            for i in range(len(offsets) - 1)
+        ]
+
+        columns = {col: section(f"col_{col}") for col in header["string_columns"]}
+        ids = [strings[i] for i in section("col_id")]
+        contents = section("col_page_content")
+        type_masks = section("type_mask")
+        documents = []
+        for row in range(header["rows"]):
+            metadata = {
+                col: strings[idx[row]] for col, idx in columns.items() if idx[row] >= 0
+            }
+            for code, bit in TYPE_BIT.items():
+                metadata[f"is_type_{code}"] = bool(type_masks[row] & bit)
+            documents.append(Document(id=ids[row], page_content=strings[contents[row]], metadata=metadata))
+
+        return cls(
+            embedding_function,
+            ids,
+            section("embeddings"),
+            documents,
+            space=header["space"],
+            normalized=header.get("normalized", False),
+            columns={
+                "type_mask": type_masks,
+                "duration_minutes": section("duration_minutes"),
+                "remote": section("remote").view(bool),
+                "adaptive": section("adaptive").view(bool),
+            },
+        )
+
+    # ---------- filtering ----------
+    def _mask(self, filter: Optional[Dict]) -> Optional[np.ndarray]:
+        """Boolean row mask for an equality filter like {"is_type_K": True}."""
+        if not filter:
+            return None
+        if "$and" in filter:
+            masks = [self._mask(f) for f in filter["$and"]]
+            return np.logical_and.reduce([m for m in masks if m is not None])
+
+        mask = None
+        for key, value in filter.items():
+            cached = self._masks.get((key, value))
+            if cached is None:
+                cached = np.array([d.metadata.get(key) == value for d in self.documents], dtype=bool)
+                self._masks[(key, value)] = cached
+            mask = cached if mask is None else (mask & cached)
+        return mask
+
+    # ---------- search ----------
+    def scores(self, query_vector: List[float]) -> np.ndarray:
+        """Distance-like score per row (lower is closer), consistent with Chroma."""
+        return self.scores_many([query_vector])[0]
+
+    def scores_many(self, query_vectors: List[List[float]]) -> np.ndarray:
+        """Scores for a batch of queries from one matrix-matrix product: (queries, rows)."""
+        q = np.asarray(query_vectors, dtype=np.float32)
+        dots = q @ self.matrix.T
+        if self.space == "l2":
+            q_sq = np.einsum("ij,ij->i", q, q)
+            return self._sq_norms[None, :] - 2.0 * dots + q_sq[:, None]
+        if self.space == "cosine":
+            norms = np.linalg.norm(q, axis=1)
+            norms[norms == 0] = 1.0
+            return 1.0 - dots / norms[:, None]
+        return 1.0 - dots
+
+    def _top_k(self, scores: np.ndarray, k: int, mask: Optional[np.ndarray]) -> np.ndarray:
+        if mask is not None:
+            candidates = np.flatnonzero(mask)
+            scores = scores[candidates]
+        else:
+            candidates = None
+        k = min(k, scores.shape[0])
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        if k < scores.shape[0]:
+            # Keep every row tied with the k-th score so ties break by row order
+            kth = np.partition(scores, k - 1)[k - 1]
+            part = np.flatnonzero(scores <= kth)
+            order = part[np.lexsort((part, scores[part]))][:k]
+        else:
+            order = np.argsort(scores, kind="stable")
+        return candidates[order] if candidates is not None else order
+
+    def similarity_search_by_vector_with_score(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Dict] = None,
+    ) -> List[Tuple[Document, float]]:
+        scores = self.scores(embedding)
+        rows = self._top_k(scores, k, self._mask(filter))
+        return [(self.documents[i], float(scores[i])) for i in rows]
+
+    def similarity_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Dict] = None,
+        **kwargs,
+    ) -> List[Document]:
+        rows = self._top_k(self.scores(embedding), k, self._mask(filter))
+        return [self.documents[i] for i in rows]
+
+    def search_by_types(
+        self,
+        embedding: List[float],
+        types: List[str],
+        per_type_k: int,
+        top_k: int,
+        scores: Optional[np.ndarray] = None,
+        allowed: Optional[np.ndarray] = None,
+    ) -> Tuple[Dict[str, List[Document]], List[Document]]:
+        """
+        Single-pass multi-type retrieval.
+
+        Scores every row once, orders them once, then slices the per-type
+        top `per_type_k` lists out of that order with the type bitmask.
+        Returns `({type: docs}, unfiltered top_k docs)`; each list is what
+        the equivalent filtered / unfiltered search would have returned.
+        `scores` may carry this query's row of a batched `scores_many`;
+        `allowed` is an optional row mask every returned document must meet.
+        """
+        if scores is None:
+            scores = self.scores(embedding)
+        order = np.argsort(scores, kind="stable")
+        if allowed is not None:
+            order = order[allowed[order]]
+        bits = self.type_masks[order]
+        per_type = {}
+        for t in types:
+            rows = order[(bits & TYPE_BIT.get(t, 0)) != 0][:per_type_k]
+            per_type[t] = [self.documents[i] for i in rows]
+        return per_type, [self.documents[i] for i in order[:top_k]]
+
+    def similarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Optional[Dict] = None,
+        **kwargs,
+    ) -> List[Document]:
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k, filter)
@@ -0,0 +1,238 @@
+"""
+Two-level result cache that sits in front of the recommender.
+
+Level 1 is an exact match on the normalised query text and `k`.
+Level 2 (optional) reuses a cached result when the new query's embedding is
+within a cosine-similarity threshold of a cached query with the same `k`.
+
+Memory is bounded by an LRU cap plus a TTL, and the whole cache is dropped
+whenever the persisted index changes (see `index_version`). A result is only
+stored if it was computed on the index version the cache currently holds, so
+a request that was still running on the old index cannot repopulate it.
+"""
+
+import copy
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:  # imported as part of the `rag` package
+    from rag.embeddings import INDEX_VERSION_FILE
+except ImportError:  # run as a script from rag/
+    from embeddings import INDEX_VERSION_FILE
+
+
+def index_version(persist_dir: str) -> str:
+    """Return a token that changes whenever the index in `persist_dir` is rebuilt."""
+    try:
+        stat = os.stat(os.path.join(persist_dir, INDEX_VERSION_FILE))
+    except FileNotFoundError:
+        return ""
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query used as the exact key."""
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+class _Entry:
+    __slots__ = ("result", "expires_at", "slot")
+
+    def __init__(self, result: Dict, expires_at: float, slot: Optional[int]):
+        self.result = result
+        self.expires_at = expires_at
+        self.slot = slot
+
+
+class QueryCache:
+    """
+    Thread-safe LRU + TTL cache of recommendation results.
+
+    Args:
+        max_entries: Maximum number of cached results (oldest evicted first).
+        ttl_seconds: Lifetime of a cached result.
+        similarity_threshold: Cosine similarity at or above which a cached
+            result is reused for a different query. `None` disables level 2.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600.0,
+        similarity_threshold: Optional[float] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+
+        self._entries: "OrderedDict[Tuple[str, int], _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Level 2: unit-normalised query vectors in a fixed slot matrix
+        self._vectors: Optional[np.ndarray] = None
+        self._slot_keys: List[Optional[Tuple[str, int]]] = [None] * max_entries
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+
+        self._index_version: Optional[str] = None
+
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.similarity_threshold is not None
+
+    # ---------- invalidation ----------
+    def check_index_version(self, version: str) -> None:
+        """Drop every entry if the index version differs from the one cached against."""
+        with self._lock:
+            if self._index_version is not None and version != self._index_version:
+                self._clear_locked()
+                self.invalidations += 1
+            self._index_version = version
+
+    def clear(self, index_version: Optional[str] = None) -> None:
+        """Drop every entry; `index_version`, if given, becomes the version cached against."""
+        with self._lock:
+            self._clear_locked()
+            if index_version is not None:
+                self._index_version = index_version
+
+    def _clear_locked(self) -> None:
+        self._entries.clear()
+        self._vectors = None
+        self._slot_keys = [None] * self.max_entries
+        self._free_slots = list(range(self.max_entries - 1, -1, -1))
+
+    # ---------- lookup ----------
+    def get(self, query: str, k: int) -> Optional[Dict]:
+        """Level 1: exact lookup on the normalised query and `k`."""
+        key = (normalize_query(query), k)
+        with self._lock:
+            entry = self._live_entry(key)
+            if entry is None:
+                if not self.semantic_enabled:
+                    self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry.result)
+
+    def get_similar(self, query_vector: List[float], k: int) -> Optional[Dict]:
+        """Level 2: reuse the closest cached result whose query is similar enough."""
+        if not self.semantic_enabled:
+            return None
+        vec = self._unit(query_vector)
+        with self._lock:
+            if self._vectors is None or vec.shape[0] != self._vectors.shape[1]:
+                self.misses += 1
+                return None
+
+            sims = self._vectors @ vec
+            for slot in np.argsort(-sims):
+                if sims[slot] < self.similarity_threshold:
+                    break
+                key = self._slot_keys[slot]
+                if key is None or key[1] != k:
+                    continue
+                entry = self._live_entry(key)
+                if entry is None:
+                    continue
+                self._entries.move_to_end(key)
+                self.semantic_hits += 1
+                return copy.deepcopy(entry.result)
+
+            self.misses += 1
+            return None
+
+    # ---------- insert ----------
+    def put(
+        self,
+        query: str,
+        k: int,
+        result: Dict,
+        query_vector: Optional[List[float]] = None,
+        index_version: Optional[str] = None,
+    ) -> None:
+        """
+        Store a result. With `index_version` (the version it was computed
+        on), a result from any other version than the current one is dropped.
+        """
+        key = (normalize_query(query), k)
+        with self._lock:
+            if index_version is not None and index_version != self._index_version:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._release_slot(old.slot)
+
+            while len(self._entries) >= self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._release_slot(evicted.slot)
+                self.evictions += 1
+
+            slot = None
+            if self.semantic_enabled and query_vector is not None:
+                vec = self._unit(query_vector)
+                if self._vectors is None:
+                    self._vectors = np.zeros((self.max_entries, vec.shape[0]), dtype=np.float32)
+                if vec.shape[0] == self._vectors.shape[1]:
+                    slot = self._free_slots.pop()
+                    self._vectors[slot] = vec
+                    self._slot_keys[slot] = key
+
+            self._entries[key] = _Entry(
+                copy.deepcopy(result),
+                time.monotonic() + self.ttl_seconds,
+                slot,
+            )
+
+    # ---------- metrics ----------
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    # ---------- internals ----------
+    def _live_entry(self, key: Tuple[str, int]) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self._entries[key]
+            self._release_slot(entry.slot)
+            self.expirations += 1
+            return None
+        return entry
+
+    def _release_slot(self, slot: Optional[int]) -> None:
+        if slot is None:
+            return
+        self._slot_keys[slot] = None
+        self._vectors[slot] = 0.0
+        self._free_slots.append(slot)
+
+    @staticmethod
+    def _unit(vector: List[float]) -> np.ndarray:
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
@@ -1,22 +1,123 @@
+import asyncio
+import copy
 import os
-from typing import List, Dict, Literal
+import threading
+from typing import AsyncIterator, Dict, Iterator, List, Literal, Optional, Tuple
 
+import httpx
+import numpy as np
+from chromadb.api.client import SharedSystemClient
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from pydantic import BaseModel, ValidationError, conint
 from dotenv import load_dotenv
 
+try:  # imported as part of the `rag` package (api.py, frontend.py)
+    from rag.catalog import CatalogEntry, build_entries, parse_codes, parse_description
+    from rag.embedding_cache import CachedEmbeddings, EmbeddingCache
+    from rag.fake_models import FakeChatModel, HashedEmbeddings
+    from rag.intent_templates import IntentTemplates
+    from rag.instrumentation import record_call, record_tokens, stage
+    from rag.lexical import BM25Index
+    from rag.llm_cache import DEFAULT_PATH as LLM_CACHE_DEFAULT_PATH, LLMResponseStore
+    from rag.numpy_index import SNAPSHOT_FILE, TYPE_BIT, ConstraintColumns, NumpyVectorStore, codes_to_mask
+    from rag.query_cache import QueryCache, index_version, normalize_query
+except ImportError:  # run as a script from rag/ (evaluation.py, generate_submission.py)
+    from catalog import CatalogEntry, build_entries, parse_codes, parse_description
+    from embedding_cache import CachedEmbeddings, EmbeddingCache
+    from fake_models import FakeChatModel, HashedEmbeddings
+    from intent_templates import IntentTemplates
+    from instrumentation import record_call, record_tokens, stage
+    from lexical import BM25Index
+    from llm_cache import DEFAULT_PATH as LLM_CACHE_DEFAULT_PATH, LLMResponseStore
+    from numpy_index import SNAPSHOT_FILE, TYPE_BIT, ConstraintColumns, NumpyVectorStore, codes_to_mask
+    from query_cache import QueryCache, index_version, normalize_query
+
 load_dotenv()
 
 # ================== CONFIG ==================
 PERSIST_DIR = "vectorstore/chroma"
+COLLECTION_NAME = "shl_catalog"
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 EMBEDDING_MODEL = "openai/text-embedding-3-large"
 LLM_MODEL = "gpt-4o-mini"
 
+# "openrouter" or "fake" (offline, deterministic models from rag/fake_models.py).
+# A fake-provider index must be built with the fake provider too.
+MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "openrouter")
+# Artificial per-call latency of the fake models, to emulate network round trips
+FAKE_EMBEDDING_LATENCY_SECONDS = float(os.getenv("FAKE_EMBEDDING_LATENCY_SECONDS", "0"))
+FAKE_LLM_LATENCY_SECONDS = float(os.getenv("FAKE_LLM_LATENCY_SECONDS", "0"))
+
+# Search backend: "chroma" (HNSW via langchain-chroma), "numpy" (exact, in-memory)
+# or "snapshot" (exact, over the memory-mapped snapshot written by rag/embeddings.py)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+
+# Shared HTTP connection pool used by the embedding and chat clients
+HTTP_MAX_CONNECTIONS = 20
+HTTP_MAX_KEEPALIVE = 10
+HTTP_TIMEOUT_SECONDS = 30.0
+
+# How long close() waits for the blocking wrappers' loop to release its
+# connections and worker threads
+LOOP_SHUTDOWN_TIMEOUT_SECONDS = 30.0
+
 TOP_K_RETRIEVE = 20
 FINAL_K = 7  # must be between 5–10
 
+# Size of the broad unfiltered search that runs while intent detection is in
+# flight; per-type selection is then done locally over this pool
+CANDIDATE_POOL_K = 200
+
+# Maximum number of batch items whose LLM calls are in flight at once
+BATCH_MAX_CONCURRENCY = 8
+
+# LLM re-ranking: the top RERANK_POOL_K balanced candidates are split into
+# chunks of RERANK_CHUNK_SIZE scored concurrently, then the score-ordered pool
+# is balanced down to the requested k. Chunks that have not answered after
+# RERANK_TIMEOUT_SECONDS (or that failed or answered unusably) get
+# RERANK_FALLBACK_SCORE, which keeps them in retrieval order.
+RERANK_POOL_K = int(os.getenv("RERANK_POOL_K", TOP_K_RETRIEVE))
+RERANK_CHUNK_SIZE = 4
+RERANK_TIMEOUT_SECONDS = 10.0
+RERANK_FALLBACK_SCORE = 3
+
+# Final-stage scorer: "llm" (chunked LLM scoring above) or "bm25" (local
+# lexical scoring over the catalog, no network call)
+RERANKER = os.getenv("RERANKER", "llm")
+
+# Candidate retrieval: "dense" (vector search only) or "hybrid" (vector search
+# plus BM25 over name and description, fused with reciprocal rank fusion)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense")
+RRF_K = 60
+
+# LLM calls per query: "two_call" (intent detection alongside retrieval, then
+# scoring of the intent-balanced candidates) or "merged" (one call over the
+# top MERGED_CANDIDATES_K candidates that returns domains, constraints and
+# scores together; the re-ranker setting does not apply)
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "two_call")
+MERGED_CANDIDATES_K = 20
+
+# Result cache in front of the pipeline
+QUERY_CACHE_MAX_ENTRIES = 1024
+QUERY_CACHE_TTL_SECONDS = 3600.0
+# Cosine similarity for reusing a near-duplicate query's result (None = exact matches only)
+QUERY_CACHE_SIMILARITY = None
+
+# On-disk memo of temperature-0 intent/scoring responses (None disables it)
+LLM_CACHE_PATH = LLM_CACHE_DEFAULT_PATH
+
+# On-disk vectors keyed by model + text hash, shared with rag/embeddings.py (None disables it)
+EMBEDDING_CACHE_DIR = "vectorstore/embedding_cache"
+
+# Role templates with precomputed intents, built by rag/intent_templates.py
+# (None, or no library on disk, disables them). A query at least this
+# cosine-similar to a template skips the LLM intent call.
+INTENT_TEMPLATES_DIR = "vectorstore/intent_templates"
+INTENT_TEMPLATE_SIMILARITY = 0.9
+
 
 # ================== TEST TYPE MAP ==================
 TEST_TYPE_MAP = {
@@ -43,41 +144,213 @@ DOMAIN_TO_TEST_TYPES = {
 }
 
 
-# ================== VECTORSTORE ==================
-def load_vectorstore():
-    embeddings = OpenAIEmbeddings(
+# ================== CLIENTS ==================
+def make_http_client() -> httpx.Client:
+    """Create a keep-alive HTTP client that can be shared by all OpenRouter clients."""
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        ),
+        timeout=HTTP_TIMEOUT_SECONDS,
+    )
+
+
+def make_async_http_client() -> httpx.AsyncClient:
+    """Async counterpart of `make_http_client` for the `ainvoke`/`aembed_*` paths."""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        ),
+        timeout=HTTP_TIMEOUT_SECONDS,
+    )
+
+
+def make_embeddings(
+    http_client: Optional[httpx.Client] = None,
+    http_async_client: Optional[httpx.AsyncClient] = None,
+) -> Embeddings:
+    if MODEL_PROVIDER == "fake":
+        return HashedEmbeddings(latency_seconds=FAKE_EMBEDDING_LATENCY_SECONDS)
+    return OpenAIEmbeddings(
         model=EMBEDDING_MODEL,
-        base_url="https://openrouter.ai/api/v1",
+        base_url=OPENROUTER_BASE_URL,
+        api_key=os.getenv("OPENROUTER_API_KEY"),
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
+
+
+def make_chat_llm(
+    http_client: Optional[httpx.Client] = None,
+    http_async_client: Optional[httpx.AsyncClient] = None,
+) -> ChatOpenAI:
+    if MODEL_PROVIDER == "fake":
+        return FakeChatModel(latency_seconds=FAKE_LLM_LATENCY_SECONDS)
+    return ChatOpenAI(
+        model=LLM_MODEL,
+        base_url=OPENROUTER_BASE_URL,
         api_key=os.getenv("OPENROUTER_API_KEY"),
+        temperature=0,
+        http_client=http_client,
+        http_async_client=http_async_client,
     )
-    return Chroma(
-        collection_name="shl_catalog",
-        persist_directory=PERSIST_DIR,
+
+
+class CountingEmbeddings(Embeddings):
+    """
+    Thin wrapper that counts embedding round trips.
+
+    The engine routes every embedding (including any made implicitly by
+    Chroma) through this wrapper, below the embedding cache, so `calls`
+    shows exactly how many paid embedding requests a code path issued.
+    """
+
+    def __init__(self, inner: Embeddings):
+        self.inner = inner
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _count(self) -> None:
+        with self._lock:
+            self.calls += 1
+        record_call("embedding")
+
+    def embed_query(self, text: str) -> List[float]:
+        self._count()
+        return self.inner.embed_query(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._count()
+        return self.inner.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        self._count()
+        return await self.inner.aembed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._count()
+        return await self.inner.aembed_documents(texts)
+
+
+def _parsed(output: Dict):
+    """Unpack an `include_raw=True` structured response, recording token usage."""
+    record_tokens(output.get("raw"))
+    if output.get("parsing_error") is not None:
+        raise output["parsing_error"]
+    return output["parsed"]
+
+
+def _chat_input(prompt: str, system: Optional[str]):
+    """
+    What the model is sent for `prompt`, and the text the response store
+    keys it on: the prompt alone, or a leading system message plus the
+    prompt as the user message.
+    """
+    if system is None:
+        return prompt, prompt
+    return [("system", system), ("human", prompt)], f"{system}\n\n{prompt}"
+
+
+def invoke_structured(
+    llm: ChatOpenAI,
+    schema,
+    prompt: str,
+    store: Optional[LLMResponseStore] = None,
+    system: Optional[str] = None,
+):
+    """`llm.with_structured_output(schema).invoke(prompt)`, memoised in `store` if given."""
+    messages, key = _chat_input(prompt, system)
+    if store is not None:
+        cached = store.get(llm.model_name, schema, key)
+        if cached is not None:
+            record_call("llm_cache_hit")
+            return cached
+    record_call("llm")
+    result = _parsed(llm.with_structured_output(schema, include_raw=True).invoke(messages))
+    if store is not None:
+        store.put(llm.model_name, schema, key, result)
+    return result
+
+
+async def ainvoke_structured(
+    llm: ChatOpenAI,
+    schema,
+    prompt: str,
+    store: Optional[LLMResponseStore] = None,
+    system: Optional[str] = None,
+):
+    """Async counterpart of `invoke_structured`; the SQLite store is used from a worker thread."""
+    messages, key = _chat_input(prompt, system)
+    if store is not None:
+        cached = await asyncio.to_thread(store.get, llm.model_name, schema, key)
+        if cached is not None:
+            record_call("llm_cache_hit")
+            return cached
+    record_call("llm")
+    result = _parsed(await llm.with_structured_output(schema, include_raw=True).ainvoke(messages))
+    if store is not None:
+        await asyncio.to_thread(store.put, llm.model_name, schema, key, result)
+    return result
+
+
+# ================== VECTORSTORE ==================
+def load_vectorstore(
+    embeddings: Optional[Embeddings] = None,
+    persist_dir: str = PERSIST_DIR,
+    backend: str = VECTOR_BACKEND,
+    fresh: bool = False,
+):
+    """
+    Open the persisted catalog collection.
+
+    `backend="chroma"` returns the Chroma vector store itself;
+    `backend="numpy"` copies it into a `NumpyVectorStore` for exact
+    in-memory search; `backend="snapshot"` maps the exported snapshot
+    read-only into a `NumpyVectorStore` without opening Chroma at all.
+    All expose the same search methods.
+
+    chromadb keeps one client system per persist path for the life of the
+    process, so re-opening a path reuses the segments loaded the first
+    time. `fresh=True` drops those cached systems first, so the collection
+    is read back from disk, including writes made by another process
+    (rag/embeddings.py). Stores opened earlier keep their own system.
+    """
+    if embeddings is None:
+        embeddings = make_embeddings()
+    if backend == "snapshot":
+        return NumpyVectorStore.from_snapshot(os.path.join(persist_dir, SNAPSHOT_FILE), embeddings)
+    if fresh:
+        SharedSystemClient.clear_system_cache()
+    vectorstore = Chroma(
+        collection_name=COLLECTION_NAME,
+        persist_directory=persist_dir,
         embedding_function=embeddings,
     )
+    if backend == "numpy":
+        return NumpyVectorStore.from_chroma(vectorstore)
+    if backend != "chroma":
+        raise ValueError(f"Unknown vector backend: {backend}")
+    return vectorstore
 
 
 # ================== QUERY INTENT DETECTION (OPTION A) ==================
 DomainType = Literal["Ability & Aptitude", "Biodata & Situational Judgment", "Competencies", "Development & 360", "Assessment Exercises", "Knowledge & Skills", "Personality & Behaviour", "Simulations"]
 
+SeniorityType = Literal["Entry-Level", "Graduate", "Mid-Professional", "Senior", "Manager", "Director", "Executive"]
+
 class QueryIntent(BaseModel):
     domains: List[DomainType]
+    # Hard constraints stated in the query; defaults mean "not stated"
+    max_duration_minutes: Optional[int] = None
+    remote_required: bool = False
+    adaptive_required: bool = False
+    seniority: Optional[SeniorityType] = None
 
 
-def detect_query_intent(query: str) -> List[str]:
-    llm = ChatOpenAI(
-        model=LLM_MODEL,
-        base_url="https://openrouter.ai/api/v1",
-        api_key=os.getenv("OPENROUTER_API_KEY"),
-        temperature=0,
-    )
-
-    prompt = f"""
-You are an HR assessment expert.
-
-Identify which most relevant and important skill domains are required by the hiring query.
-
-Possible domains (choose one or more):
+# Shared by the intent prompt and the merged prompt
+DOMAIN_GUIDE = """Possible domains (choose one or more):
 - "Ability & Aptitude" – cognitive ability, problem solving, reasoning, numerical / verbal skills
 - "Biodata & Situational Judgment" – biographical data, realistic work scenarios, judgment in work situations
 - "Competencies" – behavioral competencies and soft skills required for effective performance
@@ -86,7 +359,24 @@ Possible domains (choose one or more):
 - "Knowledge & Skills" – technical or professional knowledge and job-specific hard skills like Java, Python, SQL, etc.
 - "Personality & Behaviour" – personality traits, work styles, and behavioral preferences
 - "Simulations" – interactive or game-like simulations of real work environments or tasks
+"""
+
+CONSTRAINT_GUIDE = """Also extract the constraints the query states explicitly (leave a field out if it is not stated):
+- "max_duration_minutes" – the longest acceptable assessment time in minutes (e.g. "30-40 mins" -> 40, "about an hour" -> 60)
+- "remote_required" – true only if the assessment must be taken remotely
+- "adaptive_required" – true only if an adaptive (IRT) assessment is asked for
+- "seniority" – one of "Entry-Level", "Graduate", "Mid-Professional", "Senior", "Manager", "Director", "Executive"
+"""
+
+
+def build_intent_prompt(query: str) -> str:
+    return f"""
+You are an HR assessment expert.
+
+Identify which most relevant and important skill domains are required by the hiring query.
 
+{DOMAIN_GUIDE}
+{CONSTRAINT_GUIDE}
 Rules:
 - Return ONLY a JSON object.
 - Do not explain your answer.
@@ -95,36 +385,59 @@ Query:
 {query}
 """
 
-    structured_llm = llm.with_structured_output(QueryIntent)
+
+def detect_query_intent(
+    query: str,
+    llm: Optional[ChatOpenAI] = None,
+    store: Optional[LLMResponseStore] = None,
+) -> QueryIntent:
+    """Domains and stated constraints of the query (nothing detected if the answer is unusable)."""
+    if llm is None:
+        llm = make_chat_llm()
 
     try:
-        result = structured_llm.invoke(prompt).domains
-        return result
+        return invoke_structured(llm, QueryIntent, build_intent_prompt(query), store)
     except ValidationError:
-        return []
+        return QueryIntent(domains=[])
+
+
+async def adetect_query_intent(
+    query: str,
+    llm: Optional[ChatOpenAI] = None,
+    store: Optional[LLMResponseStore] = None,
+) -> QueryIntent:
+    if llm is None:
+        llm = make_chat_llm()
+
+    try:
+        return await ainvoke_structured(llm, QueryIntent, build_intent_prompt(query), store)
+    except ValidationError:
+        return QueryIntent(domains=[])
 
 
 def infer_required_test_types(domains: List[str]) -> List[str]:
     test_types = set()
     for domain in domains:
         test_types.update(DOMAIN_TO_TEST_TYPES.get(domain, []))
+    # Safety fallback
+    if not test_types:
+        return ["K", "P"]
     return list(test_types)
 
 
 # ================== HELPERS ==================
 def extract_test_types(doc: Document) -> List[str]:
     """Return list of SHL test-type codes (e.g. ["K", "P"])."""
-    raw = doc.metadata.get("test_type_codes", [])
-
     # Backward compatibility: handle both string and list storage
-    if isinstance(raw, str):
-        codes = [c.strip() for c in raw.split(",") if c.strip()]
-    elif isinstance(raw, list):
-        codes = [str(c).strip() for c in raw if str(c).strip()]
-    else:
-        codes = []
+    return parse_codes(doc.metadata.get("test_type_codes", []))
+
 
-    return codes
+def test_type_mask(doc: Document) -> int:
+    """Bitmask of the doc's test types; precomputed at index load when available."""
+    mask = doc.metadata.get("type_mask")
+    if mask is None:
+        mask = codes_to_mask(extract_test_types(doc))
+    return mask
 
 
 def semantic_test_types(codes: List[str]) -> str:
@@ -132,11 +445,7 @@ def semantic_test_types(codes: List[str]) -> str:
 
 
 def extract_description(doc: Document) -> str:
-    text = doc.page_content or ""
-    if "Description:" in text:
-        desc = text.split("Description:", 1)[1]
-        return desc.strip()
-    return text.strip()
+    return parse_description(doc.page_content)
 
 
 # ================== DYNAMIC BALANCING ==================
@@ -168,8 +477,8 @@ def balanced_selection(
         if not url or url in seen_urls:
             continue
         
-        doc_types = extract_test_types(doc)
-        matching_types = [t for t in required_test_types if t in doc_types]
+        doc_mask = test_type_mask(doc)
+        matching_types = [t for t in required_test_types if doc_mask & TYPE_BIT.get(t, 0)]
         
         # Select if it matches a required type and we haven't exceeded per-type limit
         if matching_types:
@@ -200,14 +509,11 @@ class ScoreList(BaseModel):
     scores: List[conint(ge=1, le=5)]
 
 
-def score_with_llm(query: str, docs: List[Document]) -> List[int]:
-    llm = ChatOpenAI(
-        model=LLM_MODEL,
-        base_url="https://openrouter.ai/api/v1",
-        api_key=os.getenv("OPENROUTER_API_KEY"),
-        temperature=0,
-    )
-
+def build_scoring_prompt(
+    query: str,
+    docs: List[Document],
+    entries: Optional[Dict[str, CatalogEntry]] = None,
+) -> str:
     prompt = f"""
 You are an SHL assessment expert helping recruiters choose the most relevant assessments.
 
@@ -225,121 +531,401 @@ Query:
 
 Assessments:
 """
+    return prompt + assessment_blocks(docs, entries)
 
+
+def assessment_blocks(
+    docs: List[Document],
+    entries: Optional[Dict[str, CatalogEntry]] = None,
+) -> str:
+    """The numbered name / categories / description blocks a scoring prompt lists."""
+    blocks = ""
     for i, doc in enumerate(docs):
-        prompt += f"""
+        entry = entries.get(doc.metadata.get("assessment_url")) if entries else None
+        if entry is not None:
+            blocks += f"\n[{i+1}]\n{entry.prompt_block}"
+            continue
+        blocks += f"""
 [{i+1}]
 Name: {doc.metadata['assessment_name']}
 Categories: {semantic_test_types(extract_test_types(doc))}
 Description:
 {extract_description(doc)}
 """
+    return blocks
 
-    structured_llm = llm.with_structured_output(ScoreList)
-    return structured_llm.invoke(prompt).scores
 
+async def ascore_with_llm(
+    query: str,
+    docs: List[Document],
+    llm: Optional[ChatOpenAI] = None,
+    store: Optional[LLMResponseStore] = None,
+    entries: Optional[Dict[str, CatalogEntry]] = None,
+) -> List[int]:
+    if llm is None:
+        llm = make_chat_llm()
 
-# ================== MAIN RECOMMENDER ==================
-def recommend(query: str, k: int = FINAL_K) -> Dict:
+    result = await ainvoke_structured(llm, ScoreList, build_scoring_prompt(query, docs, entries), store)
+    return result.scores
+
+
+# ================== MERGED INTENT + SCORING ==================
+class MergedAnswer(QueryIntent):
+    scores: List[conint(ge=1, le=5)]
+
+
+# Everything that does not depend on the request, sent as the leading system
+# message so every merged call starts with the same tokens. OpenAI serves a
+# repeated prompt prefix from its cache once the prefix is at least 1024
+# tokens long; this one is about 1500 (over 1100 words, and no token spans two
+# words), so it qualifies, and the `cached_input` token count in /metrics
+# shows it being served. Keep it above that size and free of per-request text.
+MERGED_SYSTEM_PROMPT = f"""
+You are an SHL assessment expert helping recruiters choose the most relevant assessments from the SHL product catalog.
+
+Every request gives you one hiring query followed by a numbered list of candidate assessments. Each candidate shows its name, its categories and a description taken from the catalog. Read the query, decide what the role needs, and answer in one JSON object with:
+1. "domains" – the most relevant and important skill domains the query requires.
+2. The constraints the query states.
+3. "scores" – one score per assessment from 1 (low relevance) to 5 (high relevance).
+
+{DOMAIN_GUIDE}
+Choosing domains:
+- Name every domain the role clearly needs, usually one to three. A role that combines technical work with teamwork, client contact or leadership needs both "Knowledge & Skills" and "Personality & Behaviour".
+- Programming languages, frameworks, tools, accounting, data analysis, office software and other job-specific hard skills belong to "Knowledge & Skills".
+- Reasoning, numeracy, verbal comprehension, attention to detail and the ability to learn quickly belong to "Ability & Aptitude".
+- Communication style, collaboration, leadership style, motivation, resilience and cultural fit belong to "Personality & Behaviour".
+- Customer handling, sales conversations, safety decisions and other "what would you do" workplace situations belong to "Biodata & Situational Judgment".
+- Named behavioral competencies, such as "drives results" or "influences others", belong to "Competencies".
+- Contact-centre calls, data entry, typing and other hands-on replicas of the job belong to "Simulations".
+- Choose "Development & 360" only when the query is about developing current employees or collecting feedback on them, and "Assessment Exercises" only when it asks for an assessment centre, in-tray exercises or work samples.
+- The domains come from the query alone. Do not add a domain only because one of the listed assessments belongs to it, and do not drop one because no listed assessment covers it.
+
+The categories shown for each assessment use the same names as the domains above, so an assessment whose categories include one of your domains measures something the role needs. Many assessments belong to more than one category.
+
+{CONSTRAINT_GUIDE}
+Extracting constraints:
+- Extract only what the query states about the assessment; never infer a constraint from the role, the industry or the seniority. A query that says nothing about time has no "max_duration_minutes".
+- "max_duration_minutes" is the upper bound the query allows: "under 30 minutes" -> 30, "30-40 mins" -> 40, "no more than 45 minutes" -> 45, "about an hour" -> 60, "an hour and a half" -> 90. A duration that describes the job rather than the assessment, such as a 40-hour week or a six-month contract, is not a constraint.
+- "remote_required" is true for phrases such as "remote testing", "must be taken online" or "candidates cannot come on site". A remote or hybrid job does not by itself require a remote assessment.
+- "adaptive_required" is true only when the query asks for adaptive or IRT-based testing by name.
+- "seniority" follows the level the query names: "fresh graduates" or "campus hires" -> "Graduate"; "entry-level" or "0-2 years" -> "Entry-Level"; "3-5 years of experience" -> "Mid-Professional"; "senior" or "8+ years" -> "Senior"; people managers and team leads -> "Manager"; heads of a function -> "Director"; C-level roles and vice presidents -> "Executive". A job title that does not name a level leaves it out.
+
+Scoring each assessment:
+- 5 – measures a core skill or trait the query names, at a level that fits the role; a recruiter would clearly include it.
+- 4 – measures an important requirement the query implies rather than names, or a named skill at a slightly different level.
+- 3 – relevant to this kind of role in general, but not to what this query emphasises.
+- 2 – only loosely related: a neighbouring skill, a different job family, or a clearly wrong level.
+- 1 – unrelated to the query.
+
+When scoring, consider:
+- Skill alignment with the query: a test of the exact language, tool or trait named beats a broader test of the same area.
+- Match between assessment categories and the domains you chose.
+- Complementarity (avoid over-scoring duplicates): when several assessments measure the same thing, give the best fit the higher score and the near-copies a lower one, so the top of the list covers every domain the role needs.
+- The level of the role: a test written for executives rarely suits a graduate hire, and a basic skills check rarely suits a senior specialist.
+- Score relevance only. Assessments that break the stated constraints are removed after your answer, so do not lower a score because of duration, remote or adaptive requirements.
+- Judge each assessment on its name, categories and description only; do not assume features the description does not mention.
+
+How the answer fits together, for two example queries:
+- "Hiring a Java developer who works closely with business teams; the test should take under 40 minutes" needs "Knowledge & Skills" and "Personality & Behaviour", states "max_duration_minutes": 40 and no other constraint. A Java knowledge test would score 5, a general workplace personality questionnaire 4, a numerical reasoning test 3, a Python test 2 and a retail sales simulation 1.
+- "Graduate analysts with strong numerical reasoning, tested remotely" needs "Ability & Aptitude", states "remote_required": true and "seniority": "Graduate". A numerical reasoning test for graduates would score 5, a verbal reasoning test 4, a general knowledge test of spreadsheets 3 and a leadership questionnaire for managers 1.
+
+Rules:
+- Return ONLY a JSON object.
+- "scores" must list exactly one integer per assessment, in the SAME ORDER as the numbered list.
+- Leave out any constraint field the query does not state.
+- Do not explain your answer.
+"""
+
+
+def build_merged_prompt(
+    query: str,
+    docs: List[Document],
+    entries: Optional[Dict[str, CatalogEntry]] = None,
+) -> str:
+    """The per-request user message: the query and its candidates (MERGED_SYSTEM_PROMPT goes first)."""
+    return f"Query:\n{query}\n\nAssessments:\n" + assessment_blocks(docs, entries)
+
+
+async def amerged_with_llm(
+    query: str,
+    docs: List[Document],
+    llm: Optional[ChatOpenAI] = None,
+    store: Optional[LLMResponseStore] = None,
+    entries: Optional[Dict[str, CatalogEntry]] = None,
+) -> MergedAnswer:
+    """Intent, constraints and candidate scores from a single LLM call."""
+    if llm is None:
+        llm = make_chat_llm()
+
+    return await ainvoke_structured(
+        llm, MergedAnswer, build_merged_prompt(query, docs, entries), store, system=MERGED_SYSTEM_PROMPT
+    )
+
+
+def lexical_text(doc: Document) -> str:
+    """Text a document is matched on lexically: its name plus the embedded content."""
+    return f"{doc.metadata.get('assessment_name', '')}\n{doc.page_content or ''}"
+
+
+def catalog_documents(vectorstore) -> List[Document]:
+    """Every document in the store, in row order."""
+    documents = getattr(vectorstore, "documents", None)
+    if documents is None:
+        data = vectorstore._collection.get(include=["documents", "metadatas"])
+        documents = [
+            Document(id=doc_id, page_content=text or "", metadata=metadata or {})
+            for doc_id, text, metadata in zip(data["ids"], data["documents"], data["metadatas"])
+        ]
+    return documents
+
+
+def build_lexical_index(documents: List[Document]) -> BM25Index:
+    """BM25 statistics and inverted index over the catalog documents."""
+    return BM25Index([lexical_text(d) for d in documents])
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int = RRF_K) -> List[Document]:
     """
-    End-to-end recommendation pipeline:
-    1. Dense retrieval over the SHL catalog vector store.
-    2. LLM-based intent detection to infer required test-type families.
-    3. Intent-aware balancing to keep a diverse assessment mix.
-    4. LLM scoring and re-ranking to produce the final recommendations.
+    Fuse several rankings: each document scores sum(1 / (k + rank)) over the
+    rankings it appears in (rank from 1). Documents are matched by URL;
+    ties keep first-seen order.
     """
-    vectorstore = load_vectorstore()
+    fused: Dict[str, float] = {}
+    docs: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            url = doc.metadata.get("assessment_url", "")
+            fused[url] = fused.get(url, 0.0) + 1.0 / (k + rank)
+            docs.setdefault(url, doc)
+    order = sorted(fused, key=lambda url: fused[url], reverse=True)
+    return [docs[url] for url in order]
 
-    #
-    # 1. Detect intent
-    domains = detect_query_intent(query)
-    required_test_types = infer_required_test_types(domains)
 
-    # Safety fallback
-    if not required_test_types:
-        required_test_types = ["K", "P"]
+def hybrid_candidates(
+    vectorstore,
+    lexical: BM25Index,
+    catalog: List[Document],
+    query: str,
+    query_vector: List[float],
+    dense: Optional[List[Document]] = None,
+    pool_k: int = CANDIDATE_POOL_K,
+) -> List[Document]:
+    """
+    Dense and BM25 rankings of the catalog fused with RRF, as a candidate pool.
+
+    `dense` may carry the unfiltered vector ranking already fetched for this
+    query; otherwise it is searched here.
+    """
+    if dense is None:
+        record_call("vector_search")
+        dense = vectorstore.similarity_search_by_vector(query_vector, k=pool_k)
+    lexical_ranking = [catalog[row] for row in lexical.top(query, pool_k)]
+    return reciprocal_rank_fusion([dense, lexical_ranking])[:pool_k]
+
+
+def rerank_chunks(docs: List[Document], chunk_size: int = RERANK_CHUNK_SIZE) -> List[List[Document]]:
+    """Split candidates into consecutive chunks that are scored independently."""
+    size = max(1, chunk_size)
+    return [docs[i:i + size] for i in range(0, len(docs), size)]
+
+
+def merge_chunk_scores(chunks: List[List[Document]], chunk_scores: List[Optional[List[int]]]) -> List[int]:
+    """
+    Concatenate per-chunk scores in candidate order. A chunk without a usable
+    answer (None, or the wrong number of scores) gets the fallback score.
+    """
+    scores: List[int] = []
+    for chunk, chunk_score in zip(chunks, chunk_scores):
+        if chunk_score is None or len(chunk_score) != len(chunk):
+            chunk_score = [RERANK_FALLBACK_SCORE] * len(chunk)
+        scores.extend(chunk_score)
+    return scores
 
-    # 2. Intent-aware retrieval
+
+# ================== RETRIEVAL ==================
+def _row_allowed(doc: Document, allowed: np.ndarray) -> bool:
+    row = doc.metadata.get("row")
+    return row is not None and bool(allowed[row])
+
+
+def retrieve_by_vector(
+    vectorstore,
+    query_vector: List[float],
+    required_test_types: List[str],
+    top_k: int = TOP_K_RETRIEVE,
+    candidates: Optional[List[Document]] = None,
+    candidate_pool_k: int = CANDIDATE_POOL_K,
+    scores=None,
+    allowed: Optional[np.ndarray] = None,
+) -> List[Document]:
+    """
+    Intent-aware retrieval driven by a precomputed query embedding.
+
+    Runs one filtered search per required test type and an unfiltered top-up,
+    all via `similarity_search_by_vector`, so no search re-embeds the query.
+
+    If `candidates` holds an unfiltered ranking for the same vector (the top
+    `candidate_pool_k` docs), per-type selection is done locally over it and
+    Chroma is only queried again for a type the pool cannot fill. Because the
+    pool is a similarity-ordered prefix, the result is identical to running
+    the filtered searches directly.
+
+    Stores that implement `search_by_types` (the NumPy backend) answer every
+    per-type list and the top-up from a single scoring pass instead; `scores`
+    may carry that pass precomputed (see `batch_retrieval_inputs`). Explicit
+    `candidates` (e.g. a hybrid pool) take precedence over that pass.
+
+    `allowed`, if given, is a row mask (aligned with the store) of the
+    assessments meeting the query's hard constraints; nothing outside it is
+    returned. It is applied locally, so it needs either the single-pass
+    search or `candidates` ranking the whole catalog, each carrying its
+    `metadata["row"]`; the store's filtered searches are never used then.
+    """
     retrieved: List[Document] = []
     seen_urls = set()
 
     # Distribute retrieval budget across required types
-    per_type_k = max(1, TOP_K_RETRIEVE // max(1, len(required_test_types)))
+    per_type_k = max(1, top_k // max(1, len(required_test_types)))
+
+    per_type_docs: Dict[str, List[Document]] = {}
+    if hasattr(vectorstore, "search_by_types") and candidates is None:
+        per_type_docs, candidates = vectorstore.search_by_types(
+            query_vector, required_test_types, per_type_k, top_k, scores=scores, allowed=allowed
+        )
+        pool_is_complete = True
+    elif allowed is not None:
+        if candidates is None:
+            raise ValueError("a row mask needs a single-pass store or a whole-catalog candidate pool")
+        candidates = [d for d in candidates if _row_allowed(d, allowed)]
+        pool_is_complete = True
+    else:
+        # A pool shorter than requested already holds the whole collection
+        pool_is_complete = candidates is not None and len(candidates) < candidate_pool_k
 
     for t in required_test_types:
         flag_key = f"is_type_{t}"
-        
+
+        docs_for_type = per_type_docs.get(t)
+        if docs_for_type is None and candidates is not None:
+            bit = TYPE_BIT.get(t, 0)
+            docs_for_type = [d for d in candidates if test_type_mask(d) & bit][:per_type_k]
+            if len(docs_for_type) < per_type_k and not pool_is_complete:
+                docs_for_type = None
+        if docs_for_type is None:
             # Use boolean metadata flags like is_type_K, is_type_P for filtering
-        docs_for_type = vectorstore.similarity_search(
-            query,
-            k=per_type_k,
-            filter={flag_key: True},
-        )
+            record_call("vector_search")
+            docs_for_type = vectorstore.similarity_search_by_vector(
+                query_vector,
+                k=per_type_k,
+                filter={flag_key: True},
+            )
         for doc in docs_for_type:
             url = doc.metadata.get("assessment_url")
             if url and url not in seen_urls:
                 retrieved.append(doc)
                 seen_urls.add(url)
 
-    # Fallback: if we still have fewer than TOP_K_RETRIEVE docs, top up with standard retrieval
-    if len(retrieved) < TOP_K_RETRIEVE:
-        extra_docs = vectorstore.similarity_search(
-            query,
-            k=TOP_K_RETRIEVE - len(retrieved),
-        )
+    # Fallback: if we still have fewer than top_k docs, top up with standard retrieval
+    if len(retrieved) < top_k:
+        needed = top_k - len(retrieved)
+        if candidates is not None and (len(candidates) >= needed or pool_is_complete):
+            extra_docs = candidates[:needed]
+        else:
+            record_call("vector_search")
+            extra_docs = vectorstore.similarity_search_by_vector(query_vector, k=needed)
         for doc in extra_docs:
             url = doc.metadata.get("assessment_url")
             if url and url not in seen_urls:
                 retrieved.append(doc)
                 seen_urls.add(url)
 
-    # 3. Intent-aware balancing on retrieved set
-    balanced = balanced_selection(
-        retrieved,
-        required_test_types=required_test_types,
-        k=k,
-    )
+    return retrieved
 
-    # 4. LLM scoring
-    scores = score_with_llm(query, balanced)
 
+def candidate_pool(vectorstore, query_vector: List[float]) -> Optional[List[Document]]:
+    """
+    Broad unfiltered search that can run before the intent is known.
+
+    Single-pass stores skip it: their per-type search is already one scan.
+    """
+    if hasattr(vectorstore, "search_by_types"):
+        return None
+    record_call("vector_search")
+    return vectorstore.similarity_search_by_vector(query_vector, k=CANDIDATE_POOL_K)
+
+
+def batch_retrieval_inputs(vectorstore, query_vectors: List[List[float]]) -> List[Dict]:
+    """
+    Per-query keyword arguments for `retrieve_by_vector`, computed for a
+    whole batch at once: one score matrix for the NumPy backend, one
+    multi-embedding collection query for Chroma.
+    """
+    if not query_vectors:
+        return []
+    if hasattr(vectorstore, "scores_many"):
+        return [{"scores": row} for row in vectorstore.scores_many(query_vectors)]
+    if hasattr(vectorstore, "_collection"):
+        results = vectorstore._collection.query(
+            query_embeddings=query_vectors,
+            n_results=CANDIDATE_POOL_K,
+            include=["documents", "metadatas"],
+        )
+        return [
+            {
+                "candidates": [
+                    Document(id=doc_id, page_content=text or "", metadata=metadata or {})
+                    for doc_id, text, metadata in zip(ids, texts, metadatas)
+                ]
+            }
+            for ids, texts, metadatas in zip(
+                results["ids"], results["documents"], results["metadatas"]
+            )
+        ]
+    return [{"candidates": candidate_pool(vectorstore, v)} for v in query_vectors]
+
+
+def _error_item(exc: BaseException) -> Dict:
+    return {"error": f"{type(exc).__name__}: {exc}"}
+
+
+async def _await(awaitable):
+    """Wrap any awaitable in a coroutine (`run_coroutine_threadsafe` accepts nothing else)."""
+    return await awaitable
+
+
+def _discard_task(task: asyncio.Task) -> None:
+    """Cancel a task whose result is no longer needed; a failure it already had is marked retrieved."""
+    task.cancel()
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+# ================== MAIN RECOMMENDER ==================
+def build_recommendations(
+    balanced: List[Document],
+    scores: List[int],
+    k: int,
+    entries: Optional[Dict[str, CatalogEntry]] = None,
+) -> Dict:
+    """
+    Re-rank balanced docs by LLM score and shape them into the API response.
+
+    Docs found in `entries` reuse their precomputed response item.
+    """
     ranked = sorted(
         zip(balanced, scores),
         key=lambda x: x[1],
         reverse=True,
     )
 
-    def duration_as_int(raw):
-        if raw is None:
-            return None
-        if isinstance(raw, str):
-            import re
-
-            m = re.search(r"(\d+)", raw)
-            if m:
-                return int(m.group(1))
-        try:
-            return int(float(raw))
-        except Exception:
-            return None
-
     # Build final recommendations, ensuring no duplicates by URL
     recommended = []
     seen_urls = set()
     for doc, _ in ranked:
         url = doc.metadata.get("assessment_url")
         if url and url not in seen_urls:
-            codes = extract_test_types(doc)
+            entry = entries.get(url) if entries else None
             recommended.append(
-                {
-                    "url": url,
-                    "name": doc.metadata.get("assessment_name"),
-                    "adaptive_support": doc.metadata.get("adaptive_irt"),
-                    "description": extract_description(doc),
-                    "duration": duration_as_int(doc.metadata.get("duration")),
-                    "remote_support": doc.metadata.get("remote_testing"),
-                    "test_type": [TEST_TYPE_MAP.get(c, c) for c in codes],
-                }
+                dict(entry.response) if entry is not None else CatalogEntry(doc, TEST_TYPE_MAP).response
             )
             seen_urls.add(url)
             if len(recommended) >= k:
@@ -347,6 +933,928 @@ def recommend(query: str, k: int = FINAL_K) -> Dict:
     return {"recommended_assessments": recommended}
 
 
+def provisional_recommendations(
+    balanced: List[Document],
+    k: int,
+    entries: Optional[Dict[str, CatalogEntry]] = None,
+) -> Dict:
+    """Balanced selection in retrieval order, shaped like the final response."""
+    return build_recommendations(balanced, [0] * len(balanced), k, entries)
+
+
+class LoadedIndex:
+    """
+    One loaded index and everything derived from it: the vector store, its
+    catalog documents, per-URL entries, constraint columns, URL -> catalog
+    document map and BM25 index, plus the index version they were read at.
+
+    Built whole by `RecommenderEngine._load_index()` and never modified, so
+    a reload swaps it in with one attribute write and a request that
+    captured it keeps seeing one consistent index to the end.
+    """
+
+    __slots__ = ("version", "vectorstore", "catalog", "entries", "constraints", "canonical", "lexical")
+
+    def __init__(
+        self,
+        version: str,
+        vectorstore,
+        catalog: List[Document],
+        entries: Dict[str, CatalogEntry],
+        constraints: ConstraintColumns,
+        canonical: Dict[str, Document],
+        lexical: Optional[BM25Index],
+    ):
+        self.version = version
+        self.vectorstore = vectorstore
+        self.catalog = catalog
+        self.entries = entries
+        self.constraints = constraints
+        self.canonical = canonical
+        self.lexical = lexical
+
+
+class RecommenderEngine:
+    """
+    Long-lived recommender that owns the vector store and the model clients.
+
+    Create it once per process (the API does this at startup) so the Chroma
+    collection is opened once and every OpenRouter call reuses the same
+    keep-alive connection pool. `reload()` swaps in a freshly built index
+    without restarting the process; `close()` releases the connections.
+    Every request also checks the index version file that rag/embeddings.py
+    rewrites after a build, so each worker process reloads a rebuilt index
+    by itself (see `reload_if_stale()`).
+
+    The pipeline is implemented once, as coroutines: `arecommend()`,
+    `astream_recommend()` and `arecommend_many()` are what the API awaits.
+    `recommend()`, `stream_recommend()` and `recommend_many()` are blocking
+    wrappers for the offline scripts; they run the same coroutines on an
+    event loop the engine keeps on a background thread (see `_run()`).
+
+    `pipeline` selects how many LLM calls a query costs (see PIPELINE_MODE),
+    so the two flows can be compared on the same index.
+    """
+
+    def __init__(
+        self,
+        persist_dir: str = PERSIST_DIR,
+        backend: str = VECTOR_BACKEND,
+        reranker: str = RERANKER,
+        retrieval_mode: str = RETRIEVAL_MODE,
+        pipeline: str = PIPELINE_MODE,
+    ):
+        if reranker not in ("llm", "bm25"):
+            raise ValueError(f"Unknown reranker: {reranker}")
+        if retrieval_mode not in ("dense", "hybrid"):
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode}")
+        if pipeline not in ("two_call", "merged"):
+            raise ValueError(f"Unknown pipeline mode: {pipeline}")
+        self.persist_dir = persist_dir
+        self.backend = backend
+        self.reranker = reranker
+        self.retrieval_mode = retrieval_mode
+        self.pipeline = pipeline
+        self._lock = threading.Lock()
+        # Event loop behind the blocking wrappers, started on first use
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._loop_lock = threading.Lock()
+        self._http_client = make_http_client()
+        self._async_http_client = make_async_http_client()
+        embedding_client = make_embeddings(self._http_client, self._async_http_client)
+        self._embedding_counter = CountingEmbeddings(embedding_client)
+        self.embeddings: Embeddings = self._embedding_counter
+        if EMBEDDING_CACHE_DIR:
+            # Counting sits under the cache, so only provider round trips are counted
+            self.embeddings = CachedEmbeddings(
+                self._embedding_counter,
+                EmbeddingCache(embedding_client.model, EMBEDDING_CACHE_DIR),
+            )
+        self.embedding_model: str = embedding_client.model
+        self.llm = make_chat_llm(self._http_client, self._async_http_client)
+        self.intent_templates: Optional[IntentTemplates] = None
+        self._load_intent_templates()
+        self.index: LoadedIndex = self._load_index()
+        self.cache = QueryCache(
+            max_entries=QUERY_CACHE_MAX_ENTRIES,
+            ttl_seconds=QUERY_CACHE_TTL_SECONDS,
+            similarity_threshold=QUERY_CACHE_SIMILARITY,
+        )
+        self.cache.check_index_version(self.index.version)
+        self.llm_store = LLMResponseStore(LLM_CACHE_PATH) if LLM_CACHE_PATH else None
+
+    def reload(self, persist_dir: Optional[str] = None) -> None:
+        """
+        Re-open the (possibly rebuilt) collection and swap it in atomically:
+        requests already running finish on the index they started with.
+        """
+        with self._lock:
+            if persist_dir is not None:
+                self.persist_dir = persist_dir
+            self._reload_locked()
+
+    def _reload_locked(self) -> None:
+        self.index = self._load_index(fresh=True)
+        self._load_intent_templates()
+        # Results still being computed on the old index are refused from here on
+        self.cache.clear(self.index.version)
+
+    def _load_intent_templates(self) -> None:
+        """(Re)load the role template library, if one is configured and on disk."""
+        if INTENT_TEMPLATES_DIR:
+            self.intent_templates = IntentTemplates.load(
+                INTENT_TEMPLATES_DIR, self.embedding_model, INTENT_TEMPLATE_SIMILARITY
+            )
+
+    def index_is_stale(self) -> bool:
+        """Whether the index on disk was rebuilt after this engine loaded it (one `stat`)."""
+        return index_version(self.persist_dir) != self.index.version
+
+    def reload_if_stale(self) -> bool:
+        """Reload if the index was rebuilt since it was loaded; returns whether it reloaded."""
+        if not self.index_is_stale():
+            return False
+        with self._lock:
+            # Another request may have reloaded while this one waited
+            if not self.index_is_stale():
+                return False
+            self._reload_locked()
+        return True
+
+    def _load_index(self, fresh: bool = False) -> LoadedIndex:
+        """
+        Open the collection and build the per-URL catalog entries, the
+        constraint columns, and the BM25 index when the re-ranker or hybrid
+        retrieval needs it. `fresh` re-opens Chroma from disk (see
+        `load_vectorstore()`).
+
+        The constraint columns are the store's own (read straight from the
+        snapshot on that backend); Chroma has none, so they are built from
+        the catalog metadata in the same row order.
+
+        The catalog documents carry their `type_mask` and store `row`, and
+        candidate pools are mapped onto them, so per-type selection never
+        re-parses type codes and a constraint mask indexes them directly.
+        """
+        # Read before loading, so a rebuild that lands mid-load is seen as stale
+        version = index_version(self.persist_dir)
+        vectorstore = load_vectorstore(self.embeddings, self.persist_dir, self.backend, fresh=fresh)
+        catalog = catalog_documents(vectorstore)
+        entries = build_entries(catalog, TEST_TYPE_MAP)
+        canonical = {}
+        for row, doc in enumerate(catalog):
+            doc.metadata["row"] = row
+            entry = entries.get(doc.metadata.get("assessment_url"))
+            if entry is not None:
+                doc.metadata["type_mask"] = entry.type_mask
+                canonical.setdefault(entry.url, doc)
+        lexical = None
+        if self.reranker == "bm25" or self.retrieval_mode == "hybrid":
+            lexical = build_lexical_index(catalog)
+        constraints = getattr(vectorstore, "constraints", None)
+        if constraints is None:
+            constraints = ConstraintColumns.from_metadatas([d.metadata for d in catalog])
+        return LoadedIndex(version, vectorstore, catalog, entries, constraints, canonical, lexical)
+
+    # Current index, for scripts; a request captures `self.index` once instead
+    @property
+    def vectorstore(self):
+        return self.index.vectorstore
+
+    @property
+    def catalog(self) -> List[Document]:
+        return self.index.catalog
+
+    @property
+    def entries(self) -> Dict[str, CatalogEntry]:
+        return self.index.entries
+
+    @property
+    def lexical(self) -> Optional[BM25Index]:
+        return self.index.lexical
+
+    def _feasible(self, index: LoadedIndex, intent: QueryIntent) -> Optional[np.ndarray]:
+        """
+        Row mask of the assessments meeting the intent's hard constraints, or
+        None if it states none. If no assessment can meet them they are
+        dropped rather than returning nothing.
+        """
+        mask = index.constraints.feasible(
+            intent.max_duration_minutes, intent.remote_required, intent.adaptive_required
+        )
+        if mask is not None and not mask.any():
+            record_call("constraints_relaxed")
+            return None
+        return mask
+
+    def _constrained_inputs(
+        self,
+        query: str,
+        index: LoadedIndex,
+        query_vector: List[float],
+        allowed: Optional[np.ndarray],
+        inputs: Dict,
+    ) -> Dict:
+        """
+        Retrieval inputs that can take the row mask `allowed`. The mask is
+        applied locally, so a candidate pool that stops short of the catalog
+        is replaced by one unfiltered search over all of it (re-fused in
+        hybrid mode). The single-pass search takes the mask as it is.
+        """
+        candidates = inputs.get("candidates")
+        if allowed is None or candidates is None or len(candidates) < CANDIDATE_POOL_K:
+            return inputs
+        record_call("vector_search")
+        dense = index.vectorstore.similarity_search_by_vector(query_vector, k=len(index.catalog))
+        return self._retrieval_inputs(
+            query, index, query_vector, {"candidates": dense}, pool_k=len(index.catalog)
+        )
+
+    def close(self) -> None:
+        """
+        Release the connections, the blocking wrappers' event loop and the
+        LLM cache. Blocking, and must not be called on an event loop; async
+        callers use `aclose()`.
+        """
+        loop = self._loop
+        if loop is not None:
+            # Connections and worker threads of the blocking wrappers belong to
+            # their loop, so it releases them itself before it is stopped
+            asyncio.run_coroutine_threadsafe(self._async_http_client.aclose(), loop).result(
+                LOOP_SHUTDOWN_TIMEOUT_SECONDS
+            )
+            asyncio.run_coroutine_threadsafe(loop.shutdown_default_executor(), loop).result(
+                LOOP_SHUTDOWN_TIMEOUT_SECONDS
+            )
+            loop.call_soon_threadsafe(loop.stop)
+            self._loop_thread.join()
+            loop.close()
+            self._loop = self._loop_thread = None
+        self._http_client.close()
+        if self.llm_store is not None:
+            self.llm_store.close()
+
+    async def aclose(self) -> None:
+        """
+        `close()` for async callers (the API lifespan). The async client is
+        closed on the caller's loop, which opened the API's connections; the
+        blocking teardown then runs in a worker thread.
+        """
+        await self._async_http_client.aclose()
+        await asyncio.to_thread(self.close)
+
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """Hit and miss counts of each cache in front of a network call, for /metrics."""
+        stats = {
+            "query": {"hits": self.cache.hits + self.cache.semantic_hits, "misses": self.cache.misses},
+        }
+        if self.llm_store is not None:
+            stats["llm"] = {"hits": self.llm_store.hits, "misses": self.llm_store.misses}
+        if isinstance(self.embeddings, CachedEmbeddings):
+            stats["embedding"] = {"hits": self.embeddings.cache.hits, "misses": self.embeddings.cache.misses}
+        if self.intent_templates is not None:
+            stats["intent_template"] = {"hits": self.intent_templates.hits, "misses": self.intent_templates.misses}
+        return stats
+
+    @property
+    def provider_embeddings(self) -> Embeddings:
+        """The counted embedding client below the embedding cache: never reads or fills it."""
+        return self._embedding_counter
+
+    @property
+    def embedding_calls(self) -> int:
+        """Embedding round trips this engine sent to the provider (at most one per recommend())."""
+        return self._embedding_counter.calls
+
+    # ---------- blocking wrappers ----------
+    def _run(self, awaitable):
+        """
+        Run part of the async pipeline to completion from blocking code.
+
+        Every blocking entry point shares one event loop on a daemon thread,
+        started on first use, so the async HTTP pool is only ever driven by
+        that loop and calls made from several threads overlap on it. The
+        caller's context, and so its active trace, carries over into the
+        task. Must not be called from that loop itself.
+        """
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(
+                    target=self._loop.run_forever, name="recommender-loop", daemon=True
+                )
+                self._loop_thread.start()
+            loop = self._loop
+        return asyncio.run_coroutine_threadsafe(_await(awaitable), loop).result()
+
+    def recommend(self, query: str, k: int = FINAL_K, query_vector: Optional[List[float]] = None) -> Dict:
+        """Blocking version of `arecommend()`, for the offline scripts."""
+        return self._run(self.arecommend(query, k, query_vector))
+
+    def stream_recommend(self, query: str, k: int = FINAL_K) -> Iterator[Dict]:
+        """Blocking version of `astream_recommend()`: yields each event as soon as it is ready."""
+        events = self.astream_recommend(query, k)
+        try:
+            while True:
+                try:
+                    yield self._run(events.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self._run(events.aclose())
+
+    def recommend_many(
+        self,
+        queries: List[str],
+        k: int = FINAL_K,
+        max_concurrency: int = BATCH_MAX_CONCURRENCY,
+    ) -> List[Dict]:
+        """Blocking version of `arecommend_many()`."""
+        return self._run(self.arecommend_many(queries, k, max_concurrency))
+
+    # ---------- cache ----------
+    async def _lookup(
+        self,
+        query: str,
+        k: int,
+        query_vector: Optional[List[float]] = None,
+    ) -> Tuple[Optional[Dict], Optional[List[float]]]:
+        """
+        Exact (or, if enabled, near-duplicate) cache lookup. Returns the cached
+        result, plus the query vector if it was given or had to be computed
+        for level 2. A reload of a rebuilt index runs in a worker thread first.
+        """
+        if self.index_is_stale():
+            await asyncio.to_thread(self.reload_if_stale)
+        with stage("cache"):
+            self.cache.check_index_version(index_version(self.persist_dir))
+            cached = self.cache.get(query, k)
+        if cached is not None or not self.cache.semantic_enabled:
+            return cached, query_vector
+        if query_vector is None:
+            with stage("embedding"):
+                query_vector = await self.embeddings.aembed_query(query)
+        with stage("cache"):
+            return self.cache.get_similar(query_vector, k), query_vector
+
+    # ---------- single query ----------
+    async def arecommend(
+        self,
+        query: str,
+        k: int = FINAL_K,
+        query_vector: Optional[List[float]] = None,
+    ) -> Dict:
+        """
+        End-to-end recommendation pipeline:
+        1. Dense retrieval over the SHL catalog vector store.
+        2. LLM-based intent detection to infer required test-type families.
+        3. Intent-aware balancing to keep a diverse assessment mix.
+        4. Re-ranking (chunked, concurrent LLM scoring, or local BM25) to
+           produce the final recommendations.
+
+        An exact (or, if enabled, near-duplicate) repeat of an earlier query
+        is answered from the cache without any network call.
+
+        In the "merged" pipeline, steps 2 and 4 are one LLM call instead (see
+        `_merged_rank()`).
+
+        Network calls go through `ainvoke`/`aembed_query` so they never block
+        the event loop; the local vector-store queries run in a worker thread.
+        A caller that already embedded the query (e.g. in a batch) passes
+        `query_vector` and the pipeline does not embed it again.
+        """
+        cached, query_vector = await self._lookup(query, k, query_vector)
+        if cached is not None:
+            return cached
+
+        if self.pipeline == "merged":
+            index = self.index
+            query_vector, inputs = await self._search(query, index, query_vector)
+            result = await self._merged_rank(query, k, index, query_vector, **inputs)
+        else:
+            index, query_vector, intent, inputs = await self._prepare(query, query_vector)
+            result = await self._rank(query, k, index, query_vector, intent, **inputs)
+        self.cache.put(query, k, result, query_vector, index.version)
+        return result
+
+    async def astream_recommend(self, query: str, k: int = FINAL_K) -> AsyncIterator[Dict]:
+        """
+        Streaming version of `arecommend()`.
+
+        Yields `{"stage": "candidates", ...}` with the balanced selection in
+        retrieval order as soon as it is known, then `{"stage": "final", ...}`
+        once LLM scoring has re-ranked it. A cache hit yields only "final".
+        In the "merged" pipeline the provisional list is the top of the
+        shortlist sent to the merged call, before constraints and balancing.
+        """
+        cached, query_vector = await self._lookup(query, k)
+        if cached is not None:
+            yield {"stage": "final", **cached}
+            return
+
+        if self.pipeline == "merged":
+            index = self.index
+            query_vector, inputs = await self._search(query, index, query_vector)
+            shortlist = await asyncio.to_thread(self._shortlist, index, query_vector, **inputs)
+            yield {"stage": "candidates", **provisional_recommendations(shortlist, k, index.entries)}
+            result = await self._merged_rank(query, k, index, query_vector, shortlist, **inputs)
+            self.cache.put(query, k, result, query_vector, index.version)
+            yield {"stage": "final", **result}
+            return
+
+        index, query_vector, intent, inputs = await self._prepare(query, query_vector)
+        pool = await asyncio.to_thread(
+            self._balance, query, max(k, RERANK_POOL_K), index, query_vector, intent, **inputs
+        )
+        yield {"stage": "candidates", **self._select(index, pool, [0] * len(pool), k, intent)}
+
+        scores = await self._score(index, query, pool)
+        result = self._select(index, pool, scores, k, intent)
+        self.cache.put(query, k, result, query_vector, index.version)
+        yield {"stage": "final", **result}
+
+    # ---------- pipeline stages ----------
+    async def _prepare(
+        self,
+        query: str,
+        query_vector: Optional[List[float]] = None,
+    ) -> Tuple[LoadedIndex, List[float], QueryIntent, Dict]:
+        """
+        Steps 1–2. They are independent network calls, so intent detection
+        runs as a task while the query is embedded and a broad candidate
+        pool is fetched; latency is roughly the slower of the two.
+
+        A query that is a role template's text is answered by the template
+        before any call starts. Otherwise a template close to the query
+        vector cancels the intent task once the vector is known.
+
+        Returns the loaded index the request runs on, the query vector, the
+        detected intent and the keyword arguments for `retrieve_by_vector`.
+        """
+        # Captured once: a concurrent reload() swaps in a new index, never edits this one
+        index = self.index
+
+        intent = self._template_intent(query, query_vector)
+        if intent is not None:
+            query_vector, inputs = await self._search(query, index, query_vector)
+            return index, query_vector, intent, inputs
+
+        # 1. Detect intent (in the background)
+        intent_task = asyncio.create_task(self._detect_intent(query))
+
+        # 2. Embed once and fetch an unfiltered candidate pool meanwhile
+        embedded = query_vector is not None
+        try:
+            query_vector, inputs = await self._search(query, index, query_vector)
+        except BaseException:
+            intent_task.cancel()
+            raise
+
+        intent = None if embedded else self._template_intent(query, query_vector)
+        if intent is not None:
+            _discard_task(intent_task)
+            return index, query_vector, intent, inputs
+        return index, query_vector, await intent_task, inputs
+
+    async def _search(
+        self,
+        query: str,
+        index: LoadedIndex,
+        query_vector: Optional[List[float]] = None,
+    ) -> Tuple[List[float], Dict]:
+        """Embed the query (unless already embedded) and fetch its unfiltered candidate pool."""
+        if query_vector is None:
+            with stage("embedding"):
+                query_vector = await self.embeddings.aembed_query(query)
+        with stage("search"):
+            candidates = await asyncio.to_thread(candidate_pool, index.vectorstore, query_vector)
+            inputs = self._retrieval_inputs(query, index, query_vector, {"candidates": candidates})
+        return query_vector, inputs
+
+    def _retrieval_inputs(
+        self,
+        query: str,
+        index: LoadedIndex,
+        query_vector: List[float],
+        inputs: Dict,
+        pool_k: int = CANDIDATE_POOL_K,
+    ) -> Dict:
+        """
+        Keyword arguments for `retrieve_by_vector`. A candidate pool is mapped
+        onto the catalog documents, which carry their precomputed type mask
+        and row. In hybrid mode those dense candidates (fetched here if the
+        store did not need a pool) are then fused with the BM25 ranking.
+        """
+        candidates = inputs.get("candidates")
+        if candidates is not None:
+            canonical = index.canonical
+            candidates = [canonical.get(d.metadata.get("assessment_url"), d) for d in candidates]
+        if self.retrieval_mode == "hybrid":
+            fused = hybrid_candidates(
+                index.vectorstore,
+                index.lexical,
+                index.catalog,
+                query,
+                query_vector,
+                dense=candidates,
+                pool_k=pool_k,
+            )
+            return {"candidates": fused}
+        if candidates is None:
+            return inputs
+        return {**inputs, "candidates": candidates}
+
+    def _balance(
+        self,
+        query: str,
+        k: int,
+        index: LoadedIndex,
+        query_vector: List[float],
+        intent: QueryIntent,
+        **retrieval_inputs,
+    ) -> List[Document]:
+        """
+        Intent-aware selection and balancing once vector and intent are known.
+        Only assessments meeting the query's hard constraints are considered.
+        Blocking (a store search may be needed): call it in a worker thread.
+        """
+        required_test_types = infer_required_test_types(intent.domains)
+        allowed = self._feasible(index, intent)
+
+        # Intent-aware selection, done locally over the candidate pool
+        with stage("search"):
+            retrieval_inputs = self._constrained_inputs(query, index, query_vector, allowed, retrieval_inputs)
+            retrieved = retrieve_by_vector(
+                index.vectorstore,
+                query_vector,
+                required_test_types,
+                allowed=allowed,
+                **retrieval_inputs,
+            )
+
+        # 3. Intent-aware balancing on retrieved set
+        with stage("balancing"):
+            return balanced_selection(
+                retrieved,
+                required_test_types=required_test_types,
+                k=k,
+            )
+
+    async def _rank(
+        self,
+        query: str,
+        k: int,
+        index: LoadedIndex,
+        query_vector: List[float],
+        intent: QueryIntent,
+        **retrieval_inputs,
+    ) -> Dict:
+        """Steps 3–5 once the query vector and the intent are both known."""
+        pool = await asyncio.to_thread(
+            self._balance, query, max(k, RERANK_POOL_K), index, query_vector, intent, **retrieval_inputs
+        )
+
+        # 4. LLM scoring of the whole pool
+        scores = await self._score(index, query, pool)
+
+        # 5. Balance the score-ordered pool down to k
+        return self._select(index, pool, scores, k, intent)
+
+    def _select(
+        self, index: LoadedIndex, pool: List[Document], scores: List[int], k: int, intent: QueryIntent
+    ) -> Dict:
+        """
+        Order the pool by score (ties keep retrieval order), balance it down
+        to `k` over the intent's test types, and shape the response. With
+        all-equal scores this is the balanced selection in retrieval order.
+        """
+        ranked = sorted(zip(pool, scores), key=lambda x: x[1], reverse=True)
+        score_of = {doc.metadata.get("assessment_url"): score for doc, score in ranked}
+        with stage("balancing"):
+            selected = balanced_selection(
+                [doc for doc, _ in ranked],
+                required_test_types=infer_required_test_types(intent.domains),
+                k=k,
+            )
+        return build_recommendations(
+            selected, [score_of[d.metadata.get("assessment_url")] for d in selected], k, index.entries
+        )
+
+    def _template_intent(self, query: str, query_vector: Optional[List[float]]) -> Optional[QueryIntent]:
+        """
+        The intent of a matching role template, if templates are loaded and
+        one has the query's text or (with `query_vector`) is close enough.
+        Only the template's domains are used; every other field is left
+        unstated.
+        """
+        if self.intent_templates is None:
+            return None
+        fields = self.intent_templates.lookup(query, query_vector)
+        if fields is None:
+            return None
+        record_call("intent_template_hit")
+        return QueryIntent(**fields)
+
+    async def _detect_intent(self, query: str) -> QueryIntent:
+        with stage("intent"):
+            return await adetect_query_intent(query, self.llm, self.llm_store)
+
+    def _lexical_score(self, index: LoadedIndex, query: str, balanced: List[Document]) -> List[int]:
+        with stage("scoring"):
+            return index.lexical.rerank_scores(query, [lexical_text(d) for d in balanced])
+
+    async def _score(self, index: LoadedIndex, query: str, balanced: List[Document]) -> List[int]:
+        """
+        Chunked, concurrent LLM scoring with a deadline.
+
+        Chunks still running at the deadline are cancelled and fall back to
+        retrieval order, as do chunks whose call failed (network or
+        provider error) or whose response fails validation. A failing chunk
+        never fails the request.
+
+        With the "bm25" reranker the candidates are scored locally instead.
+        """
+        if self.reranker == "bm25":
+            return self._lexical_score(index, query, balanced)
+        chunks = rerank_chunks(balanced)
+        with stage("scoring"):
+            tasks = [
+                asyncio.create_task(ascore_with_llm(query, chunk, self.llm, self.llm_store, index.entries))
+                for chunk in chunks
+            ]
+            if tasks:
+                await asyncio.wait(tasks, timeout=RERANK_TIMEOUT_SECONDS)
+
+        chunk_scores: List[Optional[List[int]]] = []
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+                record_call("llm_timeout")
+                chunk_scores.append(None)
+                continue
+            try:
+                chunk_scores.append(task.result())
+            except ValidationError:
+                chunk_scores.append(None)
+            except Exception:
+                record_call("llm_error")
+                chunk_scores.append(None)
+        return merge_chunk_scores(chunks, chunk_scores)
+
+    # ---------- merged pipeline ----------
+    def _shortlist(self, index: LoadedIndex, query_vector: List[float], **retrieval_inputs) -> List[Document]:
+        """The top MERGED_CANDIDATES_K candidates, unfiltered since the intent is not known yet."""
+        with stage("search"):
+            return retrieve_by_vector(
+                index.vectorstore, query_vector, [], top_k=MERGED_CANDIDATES_K, **retrieval_inputs
+            )
+
+    async def _merged_rank(
+        self,
+        query: str,
+        k: int,
+        index: LoadedIndex,
+        query_vector: List[float],
+        shortlist: Optional[List[Document]] = None,
+        **retrieval_inputs,
+    ) -> Dict:
+        """
+        Replaces intent detection, balancing and scoring with one LLM call
+        that reads the shortlist and returns domains, constraints and
+        scores, then applies that answer locally (see `_apply_merged()`).
+        """
+        if shortlist is None:
+            shortlist = await asyncio.to_thread(
+                self._shortlist, index, query_vector, **retrieval_inputs
+            )
+        with stage("scoring"):
+            try:
+                answer = await amerged_with_llm(query, shortlist, self.llm, self.llm_store, index.entries)
+            except ValidationError:
+                answer = None
+        return await asyncio.to_thread(
+            self._apply_merged, query, k, index, query_vector, shortlist, answer, **retrieval_inputs
+        )
+
+    def _apply_merged(
+        self,
+        query: str,
+        k: int,
+        index: LoadedIndex,
+        query_vector: List[float],
+        shortlist: List[Document],
+        answer: Optional[MergedAnswer],
+        **retrieval_inputs,
+    ) -> Dict:
+        """
+        Shortlisted documents outside the answer's constraints are dropped;
+        the rest are ordered by score and balanced down to `k` over the
+        detected domains' test types. If fewer than `k` remain, feasible
+        documents from the constrained retrieval fill in, ranked after every
+        scored candidate.
+
+        An unusable answer detects nothing; scores of the wrong length fall
+        back to RERANK_FALLBACK_SCORE, which keeps retrieval order.
+        """
+        intent = answer if answer is not None else QueryIntent(domains=[])
+        scores = answer.scores if answer is not None else []
+        if len(scores) != len(shortlist):
+            scores = [RERANK_FALLBACK_SCORE] * len(shortlist)
+        required_test_types = infer_required_test_types(intent.domains)
+        allowed = self._feasible(index, intent)
+
+        ranked = sorted(
+            (
+                (doc, score)
+                for doc, score in zip(shortlist, scores)
+                if allowed is None or _row_allowed(doc, allowed)
+            ),
+            key=lambda x: x[1],
+            reverse=True,
+        )
+        score_of = {doc.metadata.get("assessment_url"): score for doc, score in ranked}
+        docs = [doc for doc, _ in ranked]
+        if len(docs) < k:
+            with stage("search"):
+                retrieval_inputs = self._constrained_inputs(
+                    query, index, query_vector, allowed, retrieval_inputs
+                )
+                docs += retrieve_by_vector(
+                    index.vectorstore, query_vector, required_test_types, allowed=allowed, **retrieval_inputs
+                )
+
+        with stage("balancing"):
+            balanced = balanced_selection(docs, required_test_types=required_test_types, k=k)
+        return build_recommendations(
+            balanced, [score_of.get(d.metadata.get("assessment_url"), 0) for d in balanced], k, index.entries
+        )
+
+    # ---------- batch ----------
+    def _cached_or_pending(
+        self, queries: List[str], k: int
+    ) -> Tuple[List[Optional[Dict]], List[int], Dict[int, int]]:
+        """
+        Fill results for empty and cached queries. Returns the indices still to
+        run and a map from each repeated query's index to its first occurrence.
+        """
+        self.cache.check_index_version(index_version(self.persist_dir))
+        results: List[Optional[Dict]] = [None] * len(queries)
+        pending = []
+        first_seen: Dict[str, int] = {}
+        duplicates: Dict[int, int] = {}
+        for i, query in enumerate(queries):
+            if not query or not query.strip():
+                results[i] = {"error": "Empty query"}
+                continue
+            key = normalize_query(query)
+            if key in first_seen:
+                duplicates[i] = first_seen[key]
+                continue
+            first_seen[key] = i
+            cached = self.cache.get(query, k)
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.append(i)
+        return results, pending, duplicates
+
+    @staticmethod
+    def _fill_duplicates(results: List[Optional[Dict]], duplicates: Dict[int, int]) -> List[Dict]:
+        for i, first in duplicates.items():
+            results[i] = copy.deepcopy(results[first])
+        return results
+
+    async def arecommend_many(
+        self,
+        queries: List[str],
+        k: int = FINAL_K,
+        max_concurrency: int = BATCH_MAX_CONCURRENCY,
+    ) -> List[Dict]:
+        """
+        Recommend for many queries at once; results come back in input order.
+
+        All uncached queries are embedded in one batched request and scored
+        against the index in one matrix operation, while at most
+        `max_concurrency` items have LLM calls in flight. Repeated queries
+        run once. A failing item yields `{"error": "..."}` instead of failing
+        the batch.
+        """
+        if self.index_is_stale():
+            await asyncio.to_thread(self.reload_if_stale)
+        index = self.index
+        results, pending, duplicates = self._cached_or_pending(queries, k)
+        if not pending:
+            return self._fill_duplicates(results, duplicates)
+
+        async def embed_batch():
+            with stage("embedding"):
+                vectors = await self.embeddings.aembed_documents([queries[i] for i in pending])
+            with stage("search"):
+                inputs = await asyncio.to_thread(batch_retrieval_inputs, index.vectorstore, vectors)
+            return vectors, inputs
+
+        embedded = asyncio.create_task(embed_batch())
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def run_item(j: int) -> Dict:
+            query = queries[pending[j]]
+            async with semaphore:
+                two_call = self.pipeline == "two_call"
+                intent = intent_task = None
+                if two_call:
+                    intent = self._template_intent(query, None)
+                    if intent is None:
+                        # Overlaps the batch embedding; a role-template match cancels it
+                        intent_task = asyncio.create_task(self._detect_intent(query))
+                try:
+                    vectors, inputs = await embedded
+                except BaseException:
+                    if intent_task is not None:
+                        intent_task.cancel()
+                    raise
+                if intent_task is not None:
+                    intent = self._template_intent(query, vectors[j])
+                    if intent is None:
+                        intent = await intent_task
+                    else:
+                        _discard_task(intent_task)
+                with stage("search"):
+                    item_inputs = self._retrieval_inputs(query, index, vectors[j], inputs[j])
+                if not two_call:
+                    result = await self._merged_rank(query, k, index, vectors[j], **item_inputs)
+                else:
+                    result = await self._rank(query, k, index, vectors[j], intent, **item_inputs)
+            self.cache.put(query, k, result, vectors[j], index.version)
+            return result
+
+        try:
+            outcomes = await asyncio.gather(
+                *(run_item(j) for j in range(len(pending))),
+                return_exceptions=True,
+            )
+        finally:
+            if not embedded.done():
+                embedded.cancel()
+            elif not embedded.cancelled():
+                embedded.exception()  # mark a batch-level failure as retrieved
+
+        for i, outcome in zip(pending, outcomes):
+            if isinstance(outcome, BaseException):
+                if not isinstance(outcome, Exception):
+                    raise outcome
+                results[i] = _error_item(outcome)
+            else:
+                results[i] = outcome
+        return self._fill_duplicates(results, duplicates)
+
+
+_engine: Optional[RecommenderEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> RecommenderEngine:
+    """Return the process-wide engine, creating it on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = RecommenderEngine()
+    return _engine
+
+
+def set_engine(engine: Optional[RecommenderEngine]) -> None:
+    """Install (or clear) the process-wide engine, e.g. from the API lifespan."""
+    global _engine
+    with _engine_lock:
+        _engine = engine
+
+
+def recommend(query: str, k: int = FINAL_K) -> Dict:
+    """Run the recommendation pipeline on the process-wide engine."""
+    return get_engine().recommend(query, k)
+
+
+async def arecommend(query: str, k: int = FINAL_K) -> Dict:
+    """Async counterpart of `recommend()`."""
+    return await get_engine().arecommend(query, k)
+
+
+def stream_recommend(query: str, k: int = FINAL_K) -> Iterator[Dict]:
+    """Staged results (provisional, then final) from the process-wide engine."""
+    return get_engine().stream_recommend(query, k)
+
+
+def recommend_many(queries: List[str], k: int = FINAL_K) -> List[Dict]:
+    """Batch recommendations on the process-wide engine, in input order."""
+    return get_engine().recommend_many(queries, k)
+
+
+async def arecommend_many(queries: List[str], k: int = FINAL_K) -> List[Dict]:
+    """Async counterpart of `recommend_many()`."""
+    return await get_engine().arecommend_many(queries, k)
+
+
 # ================== LOCAL TEST ==================
 if __name__ == "__main__":
     print(